@@ -19,18 +19,37 @@
 
 import shutil
 import os
-import copy
 import subprocess
 import sys
-import glob 
 import ctypes
+import ctypes.util
+import select
+import struct
+import hashlib
 import threading
+import heapq
+import itertools
+import sqlite3
+import json
+import math
+import re
+import socketserver
+import logging
+import logging.handlers
+import http.server
+import tempfile
+import errno
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # Windows
 import xml.etree.ElementTree as ET
 from os import stat
-from time import sleep, mktime, ctime
+from time import sleep, mktime, time, perf_counter
 from datetime import datetime
 from enum import Enum
-from queue import Queue
+from types import MappingProxyType
+from queue import Queue, PriorityQueue, Empty
 from datetime import datetime as dt
 if sys.platform == "win32": import winreg
 
@@ -45,8 +64,117 @@ if sys.platform == "win32": import winreg
 #
 # #####################################################################################################################################
 
+class TraceSpan():
+    """ A span being timed, see Tracer.Span(). """
+    def __init__(self, tracer, name, category, args):
+        """ TraceSpan class constructor. """
+        self.tracer   = tracer
+        self.name     = name
+        self.category = category
+        self.args     = args
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        self.tracer.AddSpan(self.name, self.category, self.start, perf_counter(), self.args)
+        return False
+
+class NoTraceSpan():
+    """ Stands in for a TraceSpan while tracing is off, entering and leaving it does nothing. """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        return False
+
+class Tracer():
+    """ Optional timing of the engine's hot paths (scanning, stat, job building, queue waits, encodes, archiving),
+        written as Chrome trace-event JSON that chrome://tracing or Perfetto can open.
+        While no tracer is started Span() only checks one attribute and hands back a shared do-nothing span. """
+    active = None
+    noSpan = NoTraceSpan()
+
+    def __init__(self, fileName):
+        """ Tracer class constructor. """
+        self.fileName    = fileName
+        self.lock        = threading.Lock()
+        self.events      = []
+        self.threadNames = {} # thread id -> name, for the trace viewer's row labels
+        self.origin      = perf_counter()
+        self.processId   = os.getpid()
+
+    @staticmethod
+    def Start(fileName):
+        """ Starts recording spans, replacing (without writing it) any tracer already recording. """
+        Tracer.active = Tracer(fileName)
+        return Tracer.active
+
+    @staticmethod
+    def Stop():
+        """ Stops recording and writes the trace file. """
+        tracer = Tracer.active
+        Tracer.active = None
+        if tracer != None:
+            tracer.Write()
+
+    @staticmethod
+    def Span(name, category='engine', args=None):
+        """ Context manager timing the code it wraps as one span. """
+        tracer = Tracer.active
+        if tracer == None:
+            return Tracer.noSpan
+        return TraceSpan(tracer, name, category, args)
+
+    @staticmethod
+    def Traced(name, category='engine'):
+        """ Decorator timing every call of a function as one span. """
+        def Decorate(function):
+            def TracedFunction(*args, **kwargs):
+                if Tracer.active == None:
+                    return function(*args, **kwargs)
+                with Tracer.Span(name, category):
+                    return function(*args, **kwargs)
+            TracedFunction.__name__ = function.__name__
+            TracedFunction.__doc__  = function.__doc__
+            return TracedFunction
+        return Decorate
+
+    def AddSpan(self, name, category, start, end, args=None):
+        """ Records a finished span, start and end from perf_counter(). """
+        threadId = threading.get_ident()
+        event = {'name' : name,
+                 'cat' : category,
+                 'ph' : 'X',
+                 'ts' : (start - self.origin) * 1000000,
+                 'dur' : (end - start) * 1000000,
+                 'pid' : self.processId,
+                 'tid' : threadId}
+        if args != None:
+            event['args'] = args
+        with self.lock:
+            if threadId not in self.threadNames:
+                self.threadNames[threadId] = threading.current_thread().name
+            self.events.append(event)
+
+    def Write(self):
+        """ Writes every span recorded so far. """
+        with self.lock:
+            events = list(self.events)
+            threadNames = dict(self.threadNames)
+        for threadId, threadName in threadNames.items():
+            events.append({'name' : 'thread_name', 'ph' : 'M', 'pid' : self.processId, 'tid' : threadId,
+                           'args' : {'name' : threadName}})
+        with open(self.fileName, 'w') as traceFile:
+            json.dump({'traceEvents' : events, 'displayTimeUnit' : 'ms'}, traceFile)
+
 class Handbrake():
     """Contains all Handbrake specific functionality"""
+    # the conversions offered under FILE in the GUI, name -> (Handbrake options, output extension)
+    presets = {'stdConversion' : (" -i {0} -o {1} -f mkv --width 1280 --crop 0:0:0:0 --decomb -s 1 -N eng -m --large-file --encoder x264 -q 19 -E ffac3", "mkv"),
+               'altConversion' : (" -i {0} -o {1} -f mp4 --width 1280 --crop 0:0:0:0 --decomb -s 1 -N eng -m --large-file --encoder x264 -q 19 -E ffac3", "mp4")}
+
     def __init__(self):
         """ Handbrake class constructor. """
         if sys.platform[:5] == "linux":
@@ -55,69 +183,299 @@ class Handbrake():
             self.dirSep = "\\"
         pass
 
-    def __BuildHandBrakeParameterString(self, movie, destinationDirectory):
-        """Creates a string containing a well formed Handbrake CLI command"""
-        if destinationDirectory[-1] != self.dirSep:
-            destinationDirectory += self.dirSep
+    @staticmethod
+    def GetPresetName(optionsString):
+        """ Returns the name of the preset with the given Handbrake options, None for options of no preset. """
+        for presetName, (presetOptions, extension) in Handbrake.presets.items():
+            if presetOptions == optionsString:
+                return presetName
+        return None
 
-        #build movie string 
-        fm = FileManip()
-        MovieName = fm.GetFileNameOnlyFromPathWithFile(movie)
-        
-        MovieName = MovieName[:len(MovieName)-3] + Progress.statuses['OutputExtension']
+    @staticmethod
+    def GetHandBrakeCLIPath():
+        """ Locates the HandbrakeCLI executable: MANAGEHD_HANDBRAKECLI if set, else the 'path', else the platform default. """
+        handbrakePath = os.getenv('MANAGEHD_HANDBRAKECLI')
+        if handbrakePath:
+            return handbrakePath
+        handbrakePath = shutil.which("HandBrakeCLI")
+        if handbrakePath != None:
+            return handbrakePath
+        if sys.platform[:5] == "linux" or sys.platform[:6] == "darwin":
+            return "/usr/bin/HandBrakeCLI"
+        return "HandBrakeCLI"
 
-        if sys.platform[:5] == "linux" or sys.platform[:3] == "osx":
-            handbrakeOsSpecificPrefix = "/usr/bin/HandBrakeCLI"
-        else:
-            handbrakeOsSpecificPrefix = "HandBrakeCLI"
+    progressPattern = re.compile(r"Encoding: task (\d+) of (\d+), ([\d.]+) %"
+                                 r"(?: \(([\d.]+) fps, avg ([\d.]+) fps, ETA (\d+)h(\d+)m(\d+)s\))?")
+
+    @staticmethod
+    def ParseProgressLine(line):
+        """ Reads a Handbrake progress line such as
+                Encoding: task 1 of 2, 45.67 % (87.53 fps, avg 90.12 fps, ETA 00h12m34s)
+            and returns (percent of the whole job, fps, average fps, ETA in seconds), or None for any other line.
+            fps, average fps and ETA are None until Handbrake has measured them. """
+        match = Handbrake.progressPattern.search(line)
+        if match == None:
+            return None
+        task, taskCount, percent = int(match.group(1)), int(match.group(2)), float(match.group(3))
+        overallPercent = ((task - 1) * 100 + percent) / max(1, taskCount)
+        if match.group(4) == None:
+            return overallPercent, None, None, None
+        eta = int(match.group(6)) * 3600 + int(match.group(7)) * 60 + int(match.group(8))
+        return overallPercent, float(match.group(4)), float(match.group(5)), eta
+
+    def GetTemporaryPath(self, destinationPath):
+        """ Returns the hidden work file Handbrake encodes into before it is renamed to destinationPath. Named after
+            a hash of the file name when the name itself is too long to take the extra characters. """
+        directory, fileName = os.path.split(destinationPath)
+        baseName, extension = os.path.splitext(fileName)
+        temporaryName = "." + baseName + ".partial" + extension
+        if Handbrake.IsFileNameTooLong(temporaryName):
+            temporaryName = "." + hashlib.sha1(fileName.encode('utf-8', 'surrogateescape')).hexdigest() + ".partial" + extension
+        return os.path.join(directory, temporaryName)
+
+    maxFileNameBytes = 255 # NAME_MAX of ext4, NTFS (in characters), HFS+...
 
-        #build defaults string and add movie string
-        HandbrakeOptionsString = str(Progress.statuses['HandbrakeOptionsString'])
-        CommandString = handbrakeOsSpecificPrefix + HandbrakeOptionsString.format('"' + movie + '"',  '"' + str(destinationDirectory + MovieName) + '"')
-        return CommandString
+    @staticmethod
+    def IsFileNameTooLong(fileName):
+        """ True when fileName does not fit in a single path component (255 bytes on the usual filesystems). """
+        return len(fileName.encode('utf-8', 'surrogateescape')) > Handbrake.maxFileNameBytes
 
-    def CreateListOfCommandStrings(self, listOfVideos, destinationDirectory):
-        """ Construct the command line strings needed to invoke Handbrake and process each video file. """
+    @staticmethod
+    def GetLogDirectory():
+        """ Returns the directory holding the Handbrake log of every job and the job summaries:
+            MANAGEHD_LOGDIR if set, else ManageHD-logs on the Desktop (Windows) or next to this script. """
+        logDirectory = os.getenv('MANAGEHD_LOGDIR')
+        if logDirectory:
+            return logDirectory
         if sys.platform[:5] == "win32":
-            logDirectory = " > %UserProfile%\Desktop\ManageHD.log"
-        else:
-            logDirectory = os.path.dirname(os.path.abspath(__file__))
+            return os.path.join(os.getenv('UserProfile', ''), 'Desktop', 'ManageHD-logs')
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ManageHD-logs')
 
-        fm = FileManip()
-        listOfCommands = {}
-        for video in listOfVideos:
-            listOfCommands[(self.__BuildHandBrakeParameterString(video, destinationDirectory) + logDirectory)] = fm.GetFileSizeInMegabytes(video)            
-        return listOfCommands
-
-    def __BuildHandBrakeParameterList(self,  movie, destinationDirectory):
-        """ Creates a list of parameter for Handbrake that will later be used to build the cli strings. """
-        if destinationDirectory[-1] != self.dirSep:
-            destinationDirectory += self.dirSep
-
-        #build movie string 
-        MovieName = self.GetFileNameOnlyFromPathWithFile(movie)
-        #self.CurrentMovie.set_text(MovieName)
-
-        #build defaults string and add movie string
-        Parameters = '-f mkv --width 1280 --crop 0:0:0:0 --decomb -s 1 -N eng -m --large-file --encoder x264 -q 19 -E ffac3'.split(" ")
-        Parameters.insert(0, str(destinationDirectory + MovieName))
-        Parameters.insert(0, "-o")
-        Parameters.insert(0, movie)
-        Parameters.insert(0, "-i")
-        if sys.platform[:5] == "linux":
-            Parameters.insert(0,"/usr/bin/HandBrakeCLI")
-        else:
-            Parameters.insert(0,"HandBrakeCLI")
+    @staticmethod
+    def GetJobLogFile(job):
+        """ Returns the file the Handbrake output of a job (or segment) goes to. Named after its output, plus a short
+            hash of the full output path so videos of the same name in different directories get their own log.
+            Long names are cut short, the hash still tells them apart. """
+        baseName = os.path.splitext(os.path.basename(job.destinationPath))[0]
+        pathHash = hashlib.sha1(job.destinationPath.encode('utf-8', 'surrogateescape')).hexdigest()[:8]
+        while Handbrake.IsFileNameTooLong(baseName + "-" + pathHash + ".log"):
+            baseName = baseName[:-1]
+        return os.path.join(Handbrake.GetLogDirectory(), baseName + "-" + pathHash + ".log")
+
+    @staticmethod
+    def OpenJobLog(job):
+        """ Creates (replacing the log of an earlier attempt) the log file of a job, headed by its command line. """
+        logFileName = Handbrake.GetJobLogFile(job)
+        os.makedirs(os.path.dirname(logFileName), exist_ok=True)
+        logFile = open(logFileName, 'w')
+        logFile.write("# " + datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + subprocess.list2cmdline(job.argv) + "\n")
+        logFile.flush()
+        return logFile
+
+    def GetDestinationPath(self, movie, sourceDirectory, destinationDirectory):
+        """ Returns the converted file name for a movie, mirroring its sub directory below the source directory. """
+        relativePath = os.path.relpath(movie, sourceDirectory)
+        if relativePath.startswith(os.pardir):
+            relativePath = os.path.basename(movie)
+        relativePath = os.path.splitext(relativePath)[0] + "." + Progress.statuses['OutputExtension']
+        return os.path.join(destinationDirectory, relativePath)
+
+    def CreateJobs(self, scanResults, sourceDirectory, destinationDirectory):
+        """ Generator, turns (path, sizeInMB, modifiedTime) scan results into VideoJobs as they arrive. """
+        createdDirectories = set()
+        for movie, sizeInMB, modifiedTime in scanResults:
+            with Tracer.Span('CreateJob', 'scan'):
+                job = VideoJob(movie, sizeInMB, modifiedTime)
+                job.preset = str(Progress.statuses['HandbrakeOptionsString'])
+                job.destinationPath = self.GetDestinationPath(movie, sourceDirectory, destinationDirectory)
+                outputDirectory = os.path.dirname(job.destinationPath)
+                if outputDirectory not in createdDirectories:
+                    os.makedirs(outputDirectory, exist_ok=True)
+                    createdDirectories.add(outputDirectory)
+                job.temporaryPath = self.GetTemporaryPath(job.destinationPath)
+                job.argv = self.BuildHandBrakeParameterList(movie, job.temporaryPath)
+            yield job
+
+    def BuildHandBrakeParameterList(self, movie, outputFile, optionsString=None):
+        """ Creates the argument list (argv) that runs Handbrake on a single movie, no shell or quoting involved.
+            Uses the current Handbrake options unless given another optionsString. """
+        if optionsString == None:
+            optionsString = Progress.statuses['HandbrakeOptionsString']
+        Parameters = [self.GetHandBrakeCLIPath()]
+        for parameter in str(optionsString).split():
+            if parameter == "{0}":
+                parameter = movie
+            elif parameter == "{1}":
+                parameter = outputFile
+            Parameters.append(parameter)
         return Parameters
 
+class VideoJob():
+    """ A single source video and the Handbrake command that converts it. """
+    def __init__(self, sourcePath, sizeInMB, modifiedTime=0):
+        """ VideoJob class constructor. """
+        self.sourcePath      = sourcePath
+        self.sizeInMB        = sizeInMB
+        self.modifiedTime    = modifiedTime
+        self.destinationPath = ""
+        self.temporaryPath   = "" # Handbrake writes here, renamed to destinationPath once the encode succeeded
+        self.argv            = []
+        self.preset          = ""
+        self.state           = "queued" # queued, running, done, failed, refused (no space) or cancelled
+        self.exitCode        = None
+        self.runner          = None
+        self.finished        = threading.Event()
+        self.parent          = None # SegmentGroup when this job encodes only a time range of the source
+        self.startTime       = None
+        self.percent         = 0.0  # live progress, as reported by Handbrake
+        self.fps             = None
+        self.averageFps      = None
+        self.eta             = None # seconds
+        self.reportedMB      = 0.0  # megabytes already passed on to the autotuner
+        self.lastReport      = 0.0
+        self.concurrency     = 0    # videos encoding on this machine when it started, 0 when not run by the local pool
+        self.predictedSeconds = None # wall time the ThroughputHistory expected, for measuring its error
+
+    def CommitOutput(self):
+        """ Atomically renames a finished encode to its final name, or removes the partial output of a failed one. """
+        if self.temporaryPath == "":
+            return
+        try:
+            if self.state == "done":
+                os.replace(self.temporaryPath, self.destinationPath)
+            elif os.path.exists(self.temporaryPath):
+                os.remove(self.temporaryPath)
+        except OSError:
+            if self.state == "done":
+                self.state = "failed"
+
+class ProgressState():
+    """ Thread-safe holder of the progress statistics. Writers never modify the published mapping, they publish a
+        changed copy under a lock, so readers get a consistent, immutable snapshot from a single attribute read and
+        never block. Every change bumps the version (also stored in the snapshot under 'Version'): an observer only
+        needs to re-render when it differs from the version it rendered last.
+        Plain indexing is kept for compatibility, state['key'] reads the latest snapshot and state['key'] = value
+        publishes a new one. Read-modify-write updates must go through Increment() or Update() to be atomic.
+        Listeners are called as listener(event, subject) from the thread that caused the event, never with the lock
+        held: 'statisticsChanged' with the new snapshot, plus the job and batch events passed to Notify(). """
+    def __init__(self, initialValues):
+        """ ProgressState class constructor. """
+        self.condition = threading.Condition()
+        self.version   = 0
+        self.snapshot  = self.__Freeze(initialValues, self.version)
+        self.listeners = []
+
+    @staticmethod
+    def __Freeze(values, version):
+        """ Private method, returns an immutable mapping of values. Nested dicts are frozen too. """
+        frozen = {}
+        for key, value in values.items():
+            if isinstance(value, dict):
+                value = MappingProxyType(dict(value))
+            frozen[key] = value
+        frozen['Version'] = version
+        return MappingProxyType(frozen)
+
+    def Snapshot(self):
+        """ Returns the current statistics as an immutable mapping. """
+        return self.snapshot
+
+    def Update(self, changes=None, increments=None):
+        """ Atomically sets the keys in changes and adds the amounts in increments. Publishes a new snapshot only
+            when a value actually changed. Returns the resulting version. """
+        with self.condition:
+            values = dict(self.snapshot)
+            changed = False
+            if changes != None:
+                for key, value in changes.items():
+                    if key not in values or values[key] != value:
+                        values[key] = value
+                        changed = True
+            if increments != None:
+                for key, amount in increments.items():
+                    if amount != 0:
+                        values[key] = values[key] + amount
+                        changed = True
+            if changed:
+                self.version += 1
+                self.snapshot = self.__Freeze(values, self.version)
+                self.condition.notify_all()
+            version, snapshot = self.version, self.snapshot
+        if changed:
+            self.Notify('statisticsChanged', snapshot)
+        return version
+
+    def Increment(self, key, amount=1):
+        """ Atomically adds amount to a numeric statistic. """
+        return self.Update(increments={key : amount})
+
+    def Reset(self, values):
+        """ Replaces every statistic at once. """
+        with self.condition:
+            self.version += 1
+            self.snapshot = self.__Freeze(values, self.version)
+            self.condition.notify_all()
+            snapshot = self.snapshot
+        self.Notify('statisticsChanged', snapshot)
+
+    def Subscribe(self, listener):
+        """ Registers listener(event, subject) for every change and event. """
+        with self.condition:
+            self.listeners = self.listeners + [listener]
+
+    def Unsubscribe(self, listener):
+        """ Removes a listener registered with Subscribe(). """
+        with self.condition:
+            self.listeners = [registered for registered in self.listeners if registered != listener]
+
+    def Notify(self, event, subject=None):
+        """ Hands an event to every listener. """
+        for listener in self.listeners:
+            listener(event, subject)
+
+    def WaitForChange(self, sinceVersion, timeout=None):
+        """ Blocks until the version differs from sinceVersion (or timeout seconds passed), returns the snapshot. """
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != sinceVersion, timeout)
+            return self.snapshot
+
+    def __getitem__(self, key):
+        return self.snapshot[key]
+
+    def __setitem__(self, key, value):
+        self.Update({key : value})
+
+    def __contains__(self, key):
+        return key in self.snapshot
+
+    def __iter__(self):
+        return iter(self.snapshot)
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    def get(self, key, default=None):
+        return self.snapshot.get(key, default)
+
+    def keys(self):
+        return self.snapshot.keys()
+
+    def values(self):
+        return self.snapshot.values()
+
+    def items(self):
+        return self.snapshot.items()
+
 class Progress():
     """ Keeps track of video conversion progress """
     #Need a static variable to track progress
-    statuses = {'VideosTotal' : 0, \
+    statuses = ProgressState({'VideosTotal' : 0, \
                 'VideosCurrent' : 0, \
                 'VideosCompleted' : 0 ,\
+                'VideosFailed' : 0, \
+                'VideosSkipped' : 0, \
                 'VideoNames' : "", \
-                'ListOfVidsAndSizesInMB' : {}, \
+                'TotalSizeInMB' : 0, \
                 'ProcessingSpeedInGBperHour' : 0, \
                 'ProcessedSoFarInMB' : 0, \
                 'AverageMinutesPerGigabyte' : 0, \
@@ -125,16 +483,24 @@ class Progress():
                 'EndTime' : "", \
                 'TimeRemaining' : 0, \
                 'VideosRemaining' : 0, \
-                'StatusesHaveChanged' : True, \
                 'ProcessingComplete' : False, \
                 'ProcessingCompleteStatus' : None, \
                 'BatchStatus' : "", \
                 'InvalidQuotingInFileName' : "", \
                 'NoVideoFilesFound' : 0, \
                 'DirectoryChanged' : False, \
-                'HandbrakeOptionsString' : str(" -i {0} -o {1} -f mkv --width 1280 --crop 0:0:0:0 --decomb -s 1 -N eng -m --large-file --encoder x264 -q 19 -E ffac3"), \
+                'HandbrakeOptionsString' : Handbrake.presets['stdConversion'][0], \
+                'PredictedMakespanInMB' : {}, \
+                'InProgressMB' : 0, \
+                'LiveSpeedInMBperSecond' : 0, \
+                'EtaPrediction' : {}, \
+                'ThroughputByConcurrency' : {}, \
+                'TunedConcurrency' : 0, \
+                'CalibratedGBperHour' : 0, \
+                'VideosHeld' : 0, \
+                'VideosRefused' : 0, \
                 'OutputExtension' : "mkv", 
-               }
+               })
     
     cliParams ={'sourceDir' : None, \
                 'archiveDir' : None, \
@@ -145,12 +511,14 @@ class Progress():
                }  
     
     runPlatform = ""
+    batchComplete = threading.Event() # set once a batch has been converted and archived
     listOfEachRunsGBperHourRate = []
     listOfSourceVideos = []
+    listOfSourceVideosArchiving = (None, 'move') # copier and archive mode of the batch that left them behind
 
     def __init__(self):
         """ Constructor. """
-        self.resetStatuses = copy.deepcopy(self.statuses)
+        self.resetStatuses = dict(self.statuses.Snapshot())
     
     def GetStatuses(self):
         """ Returns the Statuses list."""
@@ -159,26 +527,45 @@ class Progress():
     @staticmethod
     def CalculateTimeRemaining():
         """ Estimate the projected time to completion for this batch based on the file sizes and processing speed estimate. """        
-        totalDataSizeInMB = sum(Progress.statuses['ListOfVidsAndSizesInMB'].values())
-        totalMinusDone = totalDataSizeInMB - Progress.statuses['ProcessedSoFarInMB']
-        
-        if Progress.statuses['ProcessingSpeedInGBperHour'] != 0.0:
-            timeRemainingInMin = (totalMinusDone / ((Progress.statuses['ProcessingSpeedInGBperHour'] * 1024) / 60))
-        elif Progress.cliParams['ProcessingSpeedInGBperHour'] != 0.0:
-            timeRemainingInMin = (totalMinusDone / ((Progress.statuses['ProcessingSpeedInGBperHour'] * 1024) / 60))
-        else:
+        timeRemainingInMin, confidence = Progress.CalculateMinutesRemaining()
+        if timeRemainingInMin == None:
             return "Calc'd at end of 1st video ..."
+        return Progress.FormatMinutes(timeRemainingInMin) + confidence
 
-        fmt               = '%Y-%m-%d %H:%M:%S'
-        dateTimeNowString = datetime.now().strftime(fmt)
-        startTimeString   = Progress.statuses['StartTime'].strftime(fmt)
-        dateTimeNow       = datetime.strptime(dateTimeNowString, fmt)
-        startTime         = datetime.strptime(startTimeString, fmt)
+    @staticmethod
+    def CalculateMinutesRemaining():
+        """ Returns the projected minutes to completion of this batch and the confidence to display with them,
+            (None, "") while there is nothing to base a projection on yet. """
+        statuses = Progress.statuses.Snapshot()
+        totalMinusDone = statuses['TotalSizeInMB'] - statuses['ProcessedSoFarInMB'] - statuses['InProgressMB']
+        
+        elapsedTimeInMinutes = (datetime.now() - statuses['StartTime']).total_seconds() / 60
+        prediction = statuses['EtaPrediction']
+        confidence = ""
 
-        elapsedTimeInMinutes = (dateTimeNow - startTime).seconds / 60
+        if statuses['VideosCompleted'] == 0 and prediction.get('seconds') != None:
+            # until this batch has finished a video, trust what the history of earlier batches predicts
+            timeRemainingInMin = max(0.0, prediction['seconds'] / 60 - elapsedTimeInMinutes)
+            if prediction.get('errorSeconds') != None and prediction['seconds'] > 0:
+                confidence = " (+/- " + str(int(round(100 * prediction['errorSeconds'] / prediction['seconds']))) + "%)"
+        elif statuses['VideosCompleted'] == 0 and statuses['CalibratedGBperHour'] != 0:
+            # measured by 'calibrate' for this preset and number of workers
+            timeRemainingInMin = (totalMinusDone / ((statuses['CalibratedGBperHour'] * 1024) / 60))
+        elif statuses['ProcessingSpeedInGBperHour'] != 0.0:
+            timeRemainingInMin = (totalMinusDone / ((statuses['ProcessingSpeedInGBperHour'] * 1024) / 60))
+        elif statuses['LiveSpeedInMBperSecond'] != 0.0:
+            # no video finished yet, go by how fast the running ones progress
+            timeRemainingInMin = (totalMinusDone / (statuses['LiveSpeedInMBperSecond'] * 60))
+        elif Progress.cliParams['ProcessingSpeedInGBperHour'] != 0.0:
+            timeRemainingInMin = (totalMinusDone / ((Progress.cliParams['ProcessingSpeedInGBperHour'] * 1024) / 60))
+        else:
+            return None, ""
 
-        projectedRunTimeInMinutes = elapsedTimeInMinutes + timeRemainingInMin
+        return timeRemainingInMin, confidence
 
+    @staticmethod
+    def FormatMinutes(timeRemainingInMin):
+        """ Formats a duration in minutes the way the time remaining is displayed. """
         if timeRemainingInMin >= (60 * 24 * 2):
             return str( '%.1f' % (timeRemainingInMin / (60 * 24) )) + " Days"
         if timeRemainingInMin >= (60 * 24) and timeRemainingInMin < (60 * 24 * 2):
@@ -192,10 +579,10 @@ class Progress():
         return "less than 1 minute"
 
     @staticmethod
-    def CalculateGBperHour(key, duration, threadCount):
+    def CalculateGBperHour(sizeInMB, duration, threadCount):
         """ Calculate the speed at which video files are processed (varies by hardware implementation) in GB/Hour. """
         if duration == 0: return 1.5 #Most modern boxes can process 1.7 gb/hour this handles initial value population
-        GBperSec = (Progress.statuses['ListOfVidsAndSizesInMB'][key] / 1024) / duration
+        GBperSec = (sizeInMB / 1024) / duration
         if threadCount > 1 and Progress.statuses['VideosCurrent'] > 0:
             if Progress.statuses['VideosCurrent'] < threadCount:
                 threadMultiplier = (Progress.statuses['VideosCurrent'] + 1)
@@ -205,14 +592,35 @@ class Progress():
         Progress.listOfEachRunsGBperHourRate.append(GBperSec * 60 * 60)
         return sum(Progress.listOfEachRunsGBperHourRate) / len(Progress.listOfEachRunsGBperHourRate)
 
+    @staticmethod
+    def Subscribe(listener):
+        """ Registers listener(event, subject) with the engine. Events: 'statisticsChanged' (snapshot),
+            'jobQueued', 'jobStarted', 'jobProgress', 'jobFinished' (VideoJob), 'sourceArchived' (path in the archive)
+            and 'batchComplete' (None).
+            Videos split into segments are queued and finished as a whole, but start and progress per segment. """
+        Progress.statuses.Subscribe(listener)
+
+    @staticmethod
+    def Unsubscribe(listener):
+        """ Removes a listener registered with Subscribe(). """
+        Progress.statuses.Unsubscribe(listener)
+
+    @staticmethod
+    def SignalBatchComplete():
+        """ Marks the batch as converted and archived, waking up whoever waits for it. """
+        Progress.batchComplete.set()
+        Progress.statuses.Notify('batchComplete')
+
     @staticmethod
     def ResetStatuses():  
         """ Store the initial values for the Statuses list. Used to re-initialize the list."""
         resetStatuses = {'VideosTotal' : 0, \
                     'VideosCurrent' : 0, \
                     'VideosCompleted' : 0 ,\
+                    'VideosFailed' : 0, \
+                    'VideosSkipped' : 0, \
                     'VideoNames' : "", \
-                    'ListOfVidsAndSizesInMB' : {}, \
+                    'TotalSizeInMB' : 0, \
                     'ProcessingSpeedInGBperHour' : 0, \
                     'ProcessedSoFarInMB' : 0, \
                     'AverageMinutesPerGigabyte' : 0, \
@@ -220,7 +628,6 @@ class Progress():
                     'EndTime' : "", \
                     'TimeRemaining' : 0, \
                     'VideosRemaining' : 0, \
-                    'StatusesHaveChanged' : True, \
                     'ProcessingComplete' : False, \
                     'ProcessingCompleteStatus' : None, \
                     'BatchStatus' : "", \
@@ -228,9 +635,19 @@ class Progress():
                     'NoVideoFilesFound' : 0, \
                     'DirectoryChanged' : False, \
                     'HandbrakeOptionsString' : Progress.statuses['HandbrakeOptionsString'], \
+                    'PredictedMakespanInMB' : {}, \
+                    'InProgressMB' : 0, \
+                    'LiveSpeedInMBperSecond' : 0, \
+                    'EtaPrediction' : {}, \
+                    'ThroughputByConcurrency' : {}, \
+                    'TunedConcurrency' : 0, \
+                    'CalibratedGBperHour' : 0, \
+                    'VideosHeld' : 0, \
+                    'VideosRefused' : 0, \
                     'OutputExtension' : Progress.statuses['OutputExtension'], 
                    }
-        Progress.statuses = copy.deepcopy(resetStatuses)
+        Progress.statuses.Reset(resetStatuses)
+        Progress.batchComplete.clear()
         if Progress.cliParams['ProcessingSpeedInGBperHour'] != 0:
             Progress.statuses['ProcessingSpeedInGBperHour'] = Progress.cliParams['ProcessingSpeedInGBperHour']
         Progress.listOfEachRunsGBperHourRate = []
@@ -240,7 +657,7 @@ class Progress():
         self.statuses['VideosTotal']                = newStatuses['VideosTotal']
         self.statuses['VideosCurrent']              = newStatuses['VideosCurrent']
         self.statuses['VideoNames']                 = newStatuses['VideoNames']
-        self.statuses['ListOfVidsAndSizesInMB']     = newStatuses['ListOfVidsAndSizesInMB']
+        self.statuses['TotalSizeInMB']              = newStatuses['TotalSizeInMB']
         self.statuses['ProcessingSpeedInGBperHour'] = newStatuses['ProcessingSpeedInGBperHour'] 
         self.statuses['ProcessedSoFarInMB']         = newStatuses['ProcessedSoFarInMB']         
         self.statuses['AveragePerGigabyte']         = newStatuses['AveragePerGigabyte']
@@ -256,84 +673,29 @@ class Progress():
         self.statuses['HandbrakeOptionsString']     = newStatuses['HandbrakeOptionsString']
         self.statuses['OutputExtension']            = newStatuses['OutputExtension']
 
-    def ArchiveSourceVideo(archiveDir, sourceDir, destinationDir, listOfSourceVideos=None):
-        """ Move the source video files that were actually processed to the archive directory. """
-        fm = FileManip()
-
-        if archiveDir == '':
+    @Tracer.Traced('ArchiveSourceVideo', 'archive')
+    def ArchiveSourceVideo(archiveDir, sourceDir, destinationDir, listOfSourceVideos=None, copier=None, mode='move'):
+        """ Move the source video files that were actually processed to the archive directory, all at once.
+            Batches archive every source as soon as it is converted (see ArchivePipeline), this is for the sources
+            left behind, by default those held back for lack of space, with the copier and mode of their batch. """
+        if archiveDir == '' or archiveDir == None:
             return
         
         if listOfSourceVideos == None:
             listOfSourceVideos = Progress.listOfSourceVideos
-        
-        #Gather original video names and createdates from source directory into a list
-        origNameAndSize = {}
-        origNameAndDate = {}
-        for item in listOfSourceVideos:
-            #if sys.platform[:5] == "linux":
-                #item = item.replace("\\ "," ")
-            origNameAndSize[item] = fm.GetFileSizeInMegabytes(item)
-            origNameAndDate[item] = ctime(os.path.getctime(item))
-            
-        #Gather converted video names and createdates from target directory into a list
-        convertedAndSize = {}   
-        convertedAndDate = {}
-        for item in listOfSourceVideos:
-            separator = ""
-            if sys.platform[:5] == "linux":
-                separator = "/"
-            else:
-                separator = "\\"
-            fullyQualItem = destinationDir + separator + fm.GetFileNameOnlyFromPathWithFile(item)
-            convertedAndSize[fullyQualItem] = fm.GetFileSizeInMegabytes(fullyQualItem)
-            convertedAndDate[fullyQualItem] = ctime(os.path.getctime(fullyQualItem))
-            
-        #Iterate through the the orig vid list and look for the name in the converted list
-        #  and make sure the converted date is more recent than the original create
-        #  Add those meeting that criteria to a archive list with a fully qual'd path and add 
-        #  its file size to the totalFileSize tally.
-        
-        filesToArchive       = []
-        totalArchiveDataSize = 0.0
-        fmt                  = '%a %b %d %H:%M:%S %Y'
-        for origItem in origNameAndDate:
-            for convItem in convertedAndDate:
-                origName = fm.GetFileNameOnlyFromPathWithFile(origItem)
-                convName = fm.GetFileNameOnlyFromPathWithFile(convItem)
-                if origName == convName:
-                    if datetime.strptime(origNameAndDate[origItem], fmt) <= datetime.strptime(convertedAndDate[convItem], fmt): #if orig date older
-                        filesToArchive.append(origItem)
-                        totalArchiveDataSize += origNameAndSize[origItem]
-                    break
+            copier, mode = Progress.listOfSourceVideosArchiving
+            Progress.listOfSourceVideos = []
 
-        #If the archive drive is different from the source drive then check to see if 
-        #  the totalFileSize tally is less than the space available in the archive drive.
-        areTheyDifferentDrives = False
-        
-        if sys.platform[:5] == "win32":
-            # windows
-            if archiveDir[0] != sourceDir[0]:
-                #different drives
-                areTheyDifferentDrives = True
-        else:
-            # *nix
-            if os.stat(archiveDir).st_dev != os.stat(sourceDir).st_dev:
-                #Different drive/mountpoint
-                areTheyDifferentDrives = True
-
-        if areTheyDifferentDrives == True:
-            if fm.GetDriveSpace(archiveDir) < totalArchiveDataSize:
-                #Not enough drive space
-                Progress.statuses['BatchStatus'] = 'Insufficient Drive Space'
-                return
+        fm = FileManip()
+        hb = Handbrake()
+        archiver = ArchivePipeline(archiveDir, sourceDir, copier, mode)
+        archiver.Start()
+        for item in listOfSourceVideos:
+            job = VideoJob(item, fm.GetFileSizeInMegabytes(item))
+            job.destinationPath = hb.GetDestinationPath(item, sourceDir, destinationDir)
+            archiver.Submit(job)
+        return archiver.Finish()
 
-        for item in filesToArchive:
-            fm.MoveFile(sourceDir, fm.GetFileNameOnlyFromPathWithFile(item), archiveDir)
-            Progress.listOfSourceVideos = listOfSourceVideos
-            
-        Progress.statuses['BatchStatus'] = 'Completed'
-        Progress.listOfSourceVideos = []
-        filesToArchive              = []
     def DeterminePlatform():
         """ Determine if the application is running on Linux, windows, or a Mac. """
         if sys.platform[:5] == "linux":
@@ -373,6 +735,8 @@ class FileManip():
                                  '        <nix></nix>\n'
                                  '        <mac></mac>\n'
                                  '	</speed>\n'
+                                 '	<calibration>\n'
+                                 '	</calibration>\n'
                                  '</data>\n')
     
     def ReadSettingsFile(self):
@@ -457,47 +821,109 @@ class FileManip():
         self.ReadSettingsFile()
         return params
 
+    def ReadCalibration(self):
+        """ Returns the throughput measured by 'calibrate' on this platform as {preset name : {workers : GB/hour}}. """
+        calibration = {}
+        if not self.VerifyExists('cliattribs.xm'):
+            return calibration
+        Progress.DeterminePlatform()
+        root = ET.parse('cliattribs.xm').getroot()
+        for throughput in root.findall('calibration/throughput'):
+            if throughput.get('platform') != Progress.runPlatform:
+                continue
+            calibration.setdefault(throughput.get('preset'), {})[int(throughput.get('workers'))] = float(throughput.text)
+        return calibration
+
+    def WriteCalibration(self, presetName, throughputByWorkers):
+        """ Replaces the calibrated throughput of a preset on this platform with {workers : GB/hour}. """
+        if not self.VerifyExists('cliattribs.xm'):
+            with open("cliattribs.xm", "w") as text_file:
+                print(self.GetEmptyXmlFileTemplate(), file=text_file)
+        Progress.DeterminePlatform()
+        tree = ET.parse('cliattribs.xm')
+        root = tree.getroot()
+        calibration = root.find('calibration')
+        if calibration == None:
+            calibration = ET.SubElement(root, 'calibration')
+        for throughput in calibration.findall('throughput'):
+            if throughput.get('platform') == Progress.runPlatform and throughput.get('preset') == presetName:
+                calibration.remove(throughput)
+        for workers in sorted(throughputByWorkers):
+            throughput = ET.SubElement(calibration, 'throughput', {'platform' : Progress.runPlatform, 'preset' : presetName,
+                                                                  'workers' : str(workers), 'measure' : "GBpH"})
+            throughput.text = '%.2f' % throughputByWorkers[workers]
+        # one element per line, to keep the file editable by hand
+        calibration.text = "\n        "
+        for throughput in calibration:
+            throughput.tail = "\n        "
+        if len(calibration) > 0:
+            calibration[-1].tail = "\n\t"
+        tree.write('cliattribs.xm')
+
     def MoveFile(self, source_dir, file_name, target_dir):    
-        """Relocate a given file from a given dir to another specific dir."""
+        """Relocate a given file from a given dir to another specific dir. file_name may include a sub directory, which is recreated under target_dir.
+           Raises OSError (shutil.Error) when the file could not be moved."""
         if source_dir[-1] != self.dirSep:
             source_dir += self.dirSep
         if target_dir[-1] != self.dirSep:
             target_dir += self.dirSep
         source_dir += file_name
-        try:
-            shutil.move(source_dir,  target_dir)
-        except:
-            #print("Move failed!!")
-            pass
+        target_dir = os.path.join(target_dir, os.path.dirname(file_name))
+        os.makedirs(target_dir, exist_ok=True)
+        shutil.move(source_dir,  target_dir)
+
+    def ScanForVideos(self, directoryPath, fileTypes, recursive=True, excludeDirectories=()):
+        """ Generator, walks directoryPath and yields (path, sizeInMB, modifiedTime) for every file of one of the given types.
+            Each file is stat'd exactly once, through its DirEntry, and results are yielded while the walk is still running. """
+        extensions = set()
+        for fileType in fileTypes:
+            fileType = fileType.strip().lstrip(".")
+            if fileType != "":
+                extensions.add(os.path.normcase("." + fileType))
+        excluded = set()
+        for directory in excludeDirectories:
+            if directory:
+                excluded.add(os.path.normcase(os.path.realpath(directory)))
 
+        pendingDirectories = [directoryPath]
+        while pendingDirectories:
+            currentDirectory = pendingDirectories.pop()
+            try:
+                with Tracer.Span('ListDirectory', 'scan', {'directory' : currentDirectory}):
+                    entries = sorted(os.scandir(currentDirectory), key=lambda entry: entry.name)
+            except OSError:
+                continue
+            subDirectories = []
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive and os.path.normcase(os.path.realpath(entry.path)) not in excluded:
+                            subDirectories.append(entry.path)
+                        continue
+                    if os.path.normcase(os.path.splitext(entry.name)[1]) not in extensions:
+                        continue
+                    if not entry.is_file():
+                        continue
+                    with Tracer.Span('stat', 'scan'):
+                        entryStat = entry.stat()
+                except OSError:
+                    continue
+                yield entry.path, entryStat.st_size / 1024 / 1024, entryStat.st_mtime
+            # reversed so that sub directories are walked in name order
+            pendingDirectories.extend(reversed(subDirectories))
+
+    @Tracer.Traced('GetFileList', 'scan')
     def GetFileList(self, directoryPath, fileTypes, fileCount=0):
         """Retrieves name info for a specified number of files in the specified path."""
         MovieList = []
-        items = []
-
-        if directoryPath[-1] != self.dirSep:
-            #print(self.dirSep)
-            directoryPath += self.dirSep        
-        
-        for fileType in fileTypes:
-            subItems = glob.glob(directoryPath + "*." + fileType)
-            #print(subItems)
-            for item in subItems:           
-                items.append(item) #.replace(" ",self.dirSep)
-
-        if fileCount == 0:
-            fileCount = len(items)
+        for item, sizeInMB, modifiedTime in self.ScanForVideos(directoryPath, fileTypes, recursive=False):
+            MovieList.append(item)
+            if fileCount != 0 and len(MovieList) >= fileCount:
+                break
 
-        Progress.statuses['VideosTotal'] = fileCount
-        
-        try:
-            for x in range(0,  fileCount):
-                MovieList.append(items[x])
-        except:
-            return MovieList
+        Progress.statuses['VideosTotal'] = len(MovieList)
         return MovieList
 
-
     def GetFileNameOnlyFromPathWithFile(self, PathWithFile):        
         """Retrieves the name of the file without the path portion."""
         FileNameStartIndex = PathWithFile.rfind(self.dirSep) + 1
@@ -511,28 +937,1308 @@ class FileManip():
             size = 0
         return size
     
+    def GetFreeSpaceInMB(self, path):
+        """ Returns the free space, in megabytes, available to this user on the drive containing the provided path.
+            A path that does not exist yet is measured on its nearest existing parent. """
+        path = os.path.abspath(path)
+        while not os.path.exists(path) and os.path.dirname(path) != path:
+            path = os.path.dirname(path)
+        return shutil.disk_usage(path).free / 1024 / 1024
+
     def GetDriveSpace(self, path):
-        """ Returns the amount of free space, in gigabytes, on the drive containing the provided path. """
-        if sys.platform[:5] == "linux":
-            st = os.statvfs(path)
-            return '%.1f' % ((st.f_bavail * st.f_frsize) / 1024/1024/1024) + " GB"
-        elif sys.platform[:5] == "win32":
-            drive = os.getenv(path)
-            freeuser = ctypes.c_int64()
-            total = ctypes.c_int64()
-            free = ctypes.c_int64()
-            ctypes.windll.kernel32.GetDiskFreeSpaceExW(drive, 
-                                            ctypes.byref(freeuser), 
-                                            ctypes.byref(total), 
-                                            ctypes.byref(free))
-            return str('%.1f' % (free.value/1024/1024/1024)) + " GB"
-        return 0
+        """ Returns the amount of free space, in gigabytes, on the drive containing the provided path, formatted for display. """
+        return '%.1f' % (self.GetFreeSpaceInMB(path) / 1024) + " GB"
+
     def VerifyExists(self, pathOrFile):
         """ Verify that a path or fully qualified file exists. """
         if os.path.exists(pathOrFile):                        
             return True        
         return 0
     
+class ArchivePipeline():
+    """ Archives the source of every successful conversion as soon as it is handed over, on a thread of its own, so
+        the moves overlap with the encodes still running and next to nothing is left to do after the last one.
+        A source is only archived while its converted file exists and is newer than it and, when the job knows what
+        the scan found, it still has the size and modification time it was converted with. """
+    modes = ('move', 'hardlink', 'reflink')
+    # errors of a filesystem that can't link or clone, the source is then copied instead
+    unsupportedErrors = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EINVAL, errno.ENOTTY, errno.ENOSYS,
+                         errno.EOPNOTSUPP)
+
+    def __init__(self, archiveDir, sourceDir, copier=None, mode='move'):
+        """ ArchivePipeline class constructor. copier moves sources to an archive on another drive.
+            move     - the source leaves the source directory (default).
+            hardlink - the source stays and the archive gets a hard link to it, on the same filesystem.
+            reflink  - the source stays and the archive gets a copy-on-write clone of it, on the same filesystem.
+            Where a link or clone is impossible (another drive, unsupported filesystem) the source is copied. """
+        if mode not in self.modes:
+            raise ValueError("Unknown archive mode: " + str(mode))
+        if copier == None:
+            copier = ArchiveCopier()
+        self.archiveDir         = archiveDir
+        self.sourceDir          = sourceDir
+        self.copier             = copier
+        self.mode               = mode
+        self.queue              = Queue()
+        self.threads            = []
+        self.lock               = threading.Lock()
+        self.differentDrives    = None # archive on another drive than the sources, decided on the first move
+        self.archivedSources    = []
+        self.failedSources      = [] # (source, error) of the moves that went wrong
+        self.admission          = None # StorageAdmission holding space on the archive drive until a source is archived
+        self.stager             = None # SourceStager whose local copies are read instead of the sources, then removed
+        self.insufficientSpace  = False
+
+    def Start(self):
+        """ Starts the archive workers, as many as the copier runs transfers at once. """
+        for workerCount in range(max(1, self.copier.transfers)):
+            thread = threading.Thread(target=self.__Work)
+            thread.daemon = True
+            self.threads.append(thread)
+            thread.start()
+
+    def Submit(self, job):
+        """ Hands over a job whose conversion succeeded, returns at once. """
+        self.queue.put(job)
+
+    def Finish(self):
+        """ Waits until every submitted source is archived. Returns 0, or -1 when sources were held back because the
+            archive drive is full (they are left in Progress.listOfSourceVideos for ArchiveSourceVideo to retry). """
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.insufficientSpace:
+            Progress.statuses['BatchStatus'] = 'Insufficient Drive Space'
+            return -1
+        Progress.statuses['BatchStatus'] = 'Completed'
+        return 0
+
+    def __Work(self):
+        while True:
+            job = self.queue.get()
+            if job == None:
+                return
+            try:
+                self.Archive(job)
+            except OSError as error:
+                # the source stays where it is, nothing is lost
+                with self.lock:
+                    self.failedSources.append((job.sourcePath, error))
+                with Threads.lock:
+                    print("ERROR: Could not archive " + job.sourcePath + ": " + str(error))
+            finally:
+                if self.admission != None:
+                    self.admission.ReleaseSource(job.sourcePath)
+                if self.stager != None:
+                    self.stager.Release(job.sourcePath)
+
+    def Archive(self, job):
+        """ Verifies and moves the source of one job. Returns True once it is in the archive. """
+        with Tracer.Span('ArchiveSource', 'archive', {'source' : job.sourcePath}):
+            try:
+                sourceStat = os.stat(job.sourcePath)
+                outputStat = os.stat(job.destinationPath)
+            except OSError:
+                return False
+            if outputStat.st_mtime < sourceStat.st_mtime:
+                return False # changed after it was converted
+            fm = FileManip()
+            if job.modifiedTime and (sourceStat.st_mtime != job.modifiedTime or
+                                     sourceStat.st_size / 1024 / 1024 != job.sizeInMB):
+                return False
+
+            if self.differentDrives == None:
+                if sys.platform[:5] == "win32":
+                    self.differentDrives = self.archiveDir[0] != self.sourceDir[0]
+                else:
+                    self.differentDrives = os.stat(self.archiveDir).st_dev != os.stat(self.sourceDir).st_dev
+            if self.differentDrives and fm.GetFreeSpaceInMB(self.archiveDir) < sourceStat.st_size / 1024 / 1024:
+                self.insufficientSpace = True
+                with self.lock:
+                    Progress.listOfSourceVideos.append(job.sourcePath)
+                    Progress.listOfSourceVideosArchiving = (self.copier, self.mode)
+                return False
+
+            relativePath = os.path.relpath(job.sourcePath, self.sourceDir)
+            if relativePath.startswith(os.pardir):
+                relativePath = fm.GetFileNameOnlyFromPathWithFile(job.sourcePath)
+            archivedPath = os.path.join(self.archiveDir, relativePath)
+            readFrom = None
+            if self.stager != None:
+                readFrom = self.stager.GetStagedPath(job.sourcePath)
+            if self.mode != 'move':
+                with Tracer.Span('KeepFile', 'archive', {'file' : relativePath, 'mode' : self.mode}):
+                    self.__Keep(job.sourcePath, archivedPath, readFrom)
+            else:
+                with Tracer.Span('MoveFile', 'archive', {'file' : relativePath}):
+                    if self.differentDrives:
+                        self.copier.Move(job.sourcePath, archivedPath, readFrom)
+                    else:
+                        fm.MoveFile(self.sourceDir, relativePath, self.archiveDir)
+            with self.lock:
+                self.archivedSources.append(job.sourcePath)
+        Progress.statuses.Notify('sourceArchived', archivedPath)
+        return True
+
+    def __Keep(self, source, target, readFrom=None):
+        """ Archives a source that stays where it is: linked or cloned when possible, copied otherwise. """
+        if not self.differentDrives:
+            try:
+                if self.mode == 'hardlink':
+                    self.copier.Link(source, target)
+                else:
+                    self.copier.Clone(source, target)
+                return
+            except OSError as error:
+                if error.errno not in self.unsupportedErrors:
+                    raise
+        self.copier.Copy(source, target, readFrom)
+
+class StorageAdmission():
+    """ Starts a job only while the space it is going to need fits on the destination and archive drives, on top of
+        what the jobs already admitted still need, so a batch waits instead of filling a disk and leaving half its
+        videos truncated. A job reserves its estimated output on the destination drive until its encode is over (less
+        what it has written so far) and, when the archive is on another drive than the sources, its source size there
+        until it is archived. Outputs are estimated from the ThroughputHistory, else as a quarter of the source (720p
+        encodes are 1/4 to 1/6 of their 1080p sources). A job that does not fit is held out of the queue, leaving its
+        worker to smaller jobs, and put back whenever a reservation is released. One that does not fit even though
+        nothing is reserved any more is refused, no job of the batch is going to make room for it. """
+    defaultOutputRatio = 0.25
+    marginInMB         = 1024 # always left free on every drive
+
+    def __init__(self, destinationDir, archiveDir=None, sourceDir=None, history=None, marginInMB=None):
+        """ StorageAdmission class constructor, by default marginInMB is 1 GB. """
+        if marginInMB != None:
+            self.marginInMB = marginInMB
+        self.destinationDir   = destinationDir
+        self.archiveDir       = archiveDir
+        self.history          = history
+        self.condition        = threading.Condition()
+        self.outputs          = {} # job -> estimated output in MB, until its encode is over
+        self.sources          = {} # source path -> MB reserved on the archive drive, until it is archived
+        self.heldJobs         = [] # (queue, priority, job) taken out of their queue until a reservation is released
+        self.cancelled        = False
+        self.archiveCopies    = bool(archiveDir) and bool(sourceDir) and not self.__SameDrive(archiveDir, sourceDir)
+
+    def EstimateOutputMB(self, job):
+        """ Expected size of the converted video. """
+        ratio = None
+        if self.history != None:
+            ratio = self.history.OutputRatio(job.preset)
+        if ratio == None:
+            ratio = self.defaultOutputRatio
+        return job.sizeInMB * ratio
+
+    def Admit(self, job, activeQueue, priority):
+        """ Called by the worker that took the job from activeQueue (where it had priority). Returns 'admitted' once
+            its space is reserved, 'held' when it waits for space (the worker goes on without calling task_done, the
+            job is put back in the queue later), 'refused' when it can never fit or 'cancelled' after Cancel(). """
+        outputMB = self.EstimateOutputMB(job)
+        with self.condition:
+            if self.cancelled:
+                return 'cancelled'
+            if not self.__Fits(outputMB, job.sizeInMB if self.archiveCopies else 0):
+                if not self.outputs and not self.sources:
+                    return 'refused'
+                self.heldJobs.append((activeQueue, priority, job))
+                Progress.statuses['VideosHeld'] = len(self.heldJobs)
+                return 'held'
+            self.outputs[job] = outputMB
+            if self.archiveCopies:
+                self.sources[job.sourcePath] = self.sources.get(job.sourcePath, 0.0) + job.sizeInMB
+        return 'admitted'
+
+    def __Fits(self, outputMB, sourceMB):
+        """ Private method, compares what the job needs with free space less the outstanding reservations, per drive.
+            Call with the condition held. """
+        fm = FileManip()
+        needs = [(self.destinationDir, outputMB, self.__OutstandingOutputMB())]
+        if sourceMB > 0:
+            needs.append((self.archiveDir, sourceMB, sum(self.sources.values())))
+        if len(needs) == 2 and self.__SameDrive(self.destinationDir, self.archiveDir):
+            needs = [(self.destinationDir, outputMB + sourceMB, needs[0][2] + needs[1][2])]
+        for directory, neededMB, reservedMB in needs:
+            if fm.GetFreeSpaceInMB(directory) - reservedMB - self.marginInMB < neededMB:
+                return False
+        return True
+
+    def __OutstandingOutputMB(self):
+        """ Private method, what the running encodes are still expected to write. Call with the condition held. """
+        fm = FileManip()
+        outstanding = 0.0
+        for job, outputMB in self.outputs.items():
+            outstanding += max(0.0, outputMB - fm.GetFileSizeInMegabytes(job.temporaryPath or job.destinationPath))
+        return outstanding
+
+    @staticmethod
+    def __SameDrive(firstPath, secondPath):
+        """ Private method, False also when either path can't be examined. """
+        try:
+            if sys.platform[:5] == "win32":
+                return os.path.abspath(firstPath)[0].lower() == os.path.abspath(secondPath)[0].lower()
+            return os.stat(firstPath).st_dev == os.stat(secondPath).st_dev
+        except OSError:
+            return False
+
+    def ReserveOutput(self, job, outputMB):
+        """ Reserves space for output written outside of an admitted encode, such as the join of a split video. """
+        with self.condition:
+            self.outputs[job] = outputMB
+
+    def ReleaseOutput(self, job):
+        """ The encode of a job is over, its output now shows in the free space (or is gone). """
+        with self.condition:
+            if self.outputs.pop(job, None) != None:
+                self.__RequeueHeldJobs()
+
+    def ReleaseSource(self, sourcePath):
+        """ A source was archived, or is not going to be. """
+        with self.condition:
+            if self.sources.pop(sourcePath, None) != None:
+                self.__RequeueHeldJobs()
+
+    def __RequeueHeldJobs(self):
+        """ Private method, gives the held jobs another try now that space was freed. Call with the condition held. """
+        for activeQueue, priority, job in self.heldJobs:
+            activeQueue.put((priority, job))
+            activeQueue.task_done() # balances the get of the worker that held it
+        self.heldJobs = []
+        Progress.statuses['VideosHeld'] = 0
+
+    def Cancel(self):
+        """ Lets every held job go, unconverted. """
+        with self.condition:
+            self.cancelled = True
+            for activeQueue, priority, job in self.heldJobs:
+                job.state = "cancelled"
+                job.finished.set()
+                activeQueue.task_done()
+            self.heldJobs = []
+            Progress.statuses['VideosHeld'] = 0
+
+class ArchiveCopier():
+    """ Moves sources to an archive on another drive: copies into a hidden partial file with large chunks, flushes it
+        to disk, verifies it and only then renames it into place and deletes the source. Several transfers may run at
+        once and together they are held to an optional MB/s cap, so archiving does not starve the encoders' reads.
+        With verify, the SHA-1 of the source is taken while it streams through and compared with the copy read back
+        from disk. Without, the kernel copies (copy_file_range, else sendfile) and the data never enters Python. """
+    chunkSize = 8 * 1024 * 1024
+    FICLONE   = 0x40049409 # _IOW(0x94, 9, int) from linux/fs.h
+
+    def __init__(self, transfers=1, verify=True, limitInMBperSecond=0):
+        """ ArchiveCopier class constructor. """
+        self.transfers       = max(1, transfers)
+        self.verify          = verify
+        self.bytesPerSecond  = limitInMBperSecond * 1024 * 1024
+        self.throttleLock    = threading.Lock()
+        self.nextChunkAt     = 0.0 # when the bandwidth cap lets the next chunk go, shared by all transfers
+
+    @staticmethod
+    def FromParameters(cliParameters):
+        """ Creates the copier the parameters ask for (k=<transfers>, l=<MB/s>, y=0 to skip verification). """
+        return ArchiveCopier(int(cliParameters.get('archiveTransfers', 0) or 1),
+                             str(cliParameters.get('archiveVerify', "1")) != "0",
+                             float(cliParameters.get('archiveLimitInMBperSecond', 0) or 0))
+
+    def Move(self, source, target, readFrom=None):
+        """ Moves source to target (another drive). Raises OSError when it could not, the source is then untouched.
+            readFrom is an identical copy of the source that is faster to read, such as the one a SourceStager made. """
+        self.Copy(source, target, readFrom)
+        os.remove(source)
+
+    @staticmethod
+    def GetPartialPath(target):
+        """ Returns the hidden file a copy is written to before it is renamed to target. """
+        directory, fileName = os.path.split(target)
+        os.makedirs(directory, exist_ok=True)
+        partialName = "." + fileName + ".partial"
+        if Handbrake.IsFileNameTooLong(partialName):
+            partialName = "." + hashlib.sha1(fileName.encode('utf-8', 'surrogateescape')).hexdigest() + ".partial"
+        return os.path.join(directory, partialName)
+
+    def Copy(self, source, target, readFrom=None):
+        """ Copies source to target the way Move does, leaving the source in place. """
+        partialTarget = self.GetPartialPath(target)
+        try:
+            with open(readFrom or source, 'rb') as sourceFile, open(partialTarget, 'wb') as targetFile:
+                self.Advise(sourceFile.fileno(), 0, 0, 'POSIX_FADV_SEQUENTIAL')
+                if self.verify:
+                    sourceHash = self.__CopyStreaming(sourceFile, targetFile)
+                else:
+                    self.__CopyInKernel(sourceFile, targetFile)
+                targetFile.flush()
+                os.fsync(targetFile.fileno())
+                if os.fstat(targetFile.fileno()).st_size != os.fstat(sourceFile.fileno()).st_size:
+                    raise OSError("copy of " + source + " is incomplete")
+                # read once, its cached pages would only push out what the encoders read
+                self.Advise(sourceFile.fileno(), 0, 0, 'POSIX_FADV_DONTNEED')
+            if self.verify and self.__HashFile(partialTarget) != sourceHash:
+                raise OSError("copy of " + source + " does not match its checksum")
+            shutil.copystat(source, partialTarget)
+            os.replace(partialTarget, target)
+        except:
+            if os.path.exists(partialTarget):
+                os.remove(partialTarget)
+            raise
+
+    def Link(self, source, target):
+        """ Makes target a hard link to source (same filesystem). Raises OSError when it could not. """
+        partialTarget = self.GetPartialPath(target)
+        if os.path.lexists(partialTarget):
+            os.remove(partialTarget)
+        os.link(source, partialTarget)
+        try:
+            os.replace(partialTarget, target)
+        except:
+            os.remove(partialTarget)
+            raise
+
+    def Clone(self, source, target):
+        """ Makes target a copy-on-write clone of source (same filesystem, Linux btrfs, XFS...), which shares the
+            data blocks until either is modified. Raises OSError when the filesystem can't clone. """
+        if fcntl == None or sys.platform[:5] != "linux":
+            raise OSError(errno.EOPNOTSUPP, "reflink clones are only supported on Linux")
+        partialTarget = self.GetPartialPath(target)
+        try:
+            with open(source, 'rb') as sourceFile, open(partialTarget, 'wb') as targetFile:
+                fcntl.ioctl(targetFile.fileno(), self.FICLONE, sourceFile.fileno())
+            shutil.copystat(source, partialTarget)
+            os.replace(partialTarget, target)
+        except:
+            if os.path.exists(partialTarget):
+                os.remove(partialTarget)
+            raise
+
+    @staticmethod
+    def Advise(fd, offset, length, advice):
+        """ Passes an access pattern hint (a POSIX_FADV_* name) to the OS, where it takes them. """
+        if hasattr(os, 'posix_fadvise'):
+            try:
+                os.posix_fadvise(fd, offset, length, getattr(os, advice))
+            except OSError:
+                pass # only a hint, some filesystems refuse it
+
+    def __Throttle(self, byteCount):
+        """ Waits until byteCount more bytes fit in the bandwidth cap. """
+        if self.bytesPerSecond <= 0:
+            return
+        with self.throttleLock:
+            now = time()
+            sendAt = max(now, self.nextChunkAt)
+            self.nextChunkAt = sendAt + byteCount / self.bytesPerSecond
+        if sendAt > now:
+            sleep(sendAt - now)
+
+    def __CopyStreaming(self, sourceFile, targetFile):
+        """ Copies through one reusable buffer, hashing on the way. Returns the SHA-1 of the data. """
+        sourceHash = hashlib.sha1()
+        buffer = bytearray(self.chunkSize)
+        view = memoryview(buffer)
+        offset = sourceFile.tell()
+        while True:
+            self.__Throttle(self.chunkSize)
+            # the next chunk is fetched while this one is written
+            self.Advise(sourceFile.fileno(), offset + self.chunkSize, self.chunkSize, 'POSIX_FADV_WILLNEED')
+            byteCount = sourceFile.readinto(buffer)
+            if not byteCount:
+                return sourceHash.hexdigest()
+            offset += byteCount
+            sourceHash.update(view[:byteCount])
+            targetFile.write(view[:byteCount])
+
+    def __CopyInKernel(self, sourceFile, targetFile):
+        """ Copies without passing the data through user space, falling back to streaming where the kernel can't. """
+        sourceFd, targetFd = sourceFile.fileno(), targetFile.fileno()
+        offset = 0
+        while True:
+            self.__Throttle(self.chunkSize)
+            self.Advise(sourceFd, offset + self.chunkSize, self.chunkSize, 'POSIX_FADV_WILLNEED')
+            try:
+                if hasattr(os, 'copy_file_range'):
+                    byteCount = os.copy_file_range(sourceFd, targetFd, self.chunkSize)
+                elif hasattr(os, 'sendfile') and sys.platform[:5] == "linux":
+                    byteCount = os.sendfile(targetFd, sourceFd, offset, self.chunkSize)
+                else:
+                    raise OSError(errno.ENOSYS, "no kernel copy")
+            except OSError as error:
+                if offset != 0 or error.errno not in (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+                self.__CopyStreaming(sourceFile, targetFile)
+                return
+            if byteCount == 0:
+                return
+            offset += byteCount
+
+    def __HashFile(self, fileName):
+        """ SHA-1 of a file as it is on disk: its pages are dropped from the cache first where the OS allows. """
+        fileHash = hashlib.sha1()
+        buffer = bytearray(self.chunkSize)
+        view = memoryview(buffer)
+        with open(fileName, 'rb') as checkedFile:
+            self.Advise(checkedFile.fileno(), 0, 0, 'POSIX_FADV_DONTNEED')
+            while True:
+                byteCount = checkedFile.readinto(buffer)
+                if not byteCount:
+                    return fileHash.hexdigest()
+                fileHash.update(view[:byteCount])
+
+class SourceStager():
+    """ Copies the sources of the next jobs to fast local scratch space ahead of their turn, so Handbrake reads them
+        from local disk instead of a network share that concurrent encodes would saturate. Jobs are registered in
+        queue order; one copy at a time (the share is the bottleneck) runs until lookAhead sources are waiting to be
+        encoded or budgetInMB of scratch space is in use. A job whose source is not staged when its turn comes reads
+        it from the share as usual. The copy is removed once its source is archived, or once its video is finished
+        when there is nothing to archive; the archive reads from it instead of the share. """
+    directoryName = 'ManageHD-staging'
+    marginInMB    = 1024 # always left free on the scratch drive
+
+    def __init__(self, scratchDir, lookAhead=4, budgetInMB=None, copier=None):
+        """ SourceStager class constructor, by default the budget is half the scratch space free now. """
+        self.directory  = os.path.join(scratchDir, self.directoryName)
+        os.makedirs(self.directory, exist_ok=True)
+        if budgetInMB == None:
+            budgetInMB = FileManip().GetFreeSpaceInMB(self.directory) / 2
+        if copier == None:
+            copier = ArchiveCopier(verify=False)
+        self.lookAhead  = max(1, lookAhead)
+        self.budgetInMB = budgetInMB
+        self.copier     = copier
+        self.condition  = threading.Condition()
+        self.upcoming   = [] # heap of (queue priority, tiebreak, job) not started yet
+        self.staged     = {} # source path -> (staged path or None while copying, size in MB)
+        self.waiting    = set() # source paths staged (or being staged) whose first job has not started
+        self.stopping   = False
+        self.thread     = None
+
+    def Start(self):
+        """ Starts the copying thread. """
+        self.thread = threading.Thread(target=self.__Work)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def Add(self, priority, job):
+        """ Registers a queued job, priority being its key in the worker queue. """
+        with self.condition:
+            heapq.heappush(self.upcoming, (priority, id(job), job))
+            self.condition.notify_all()
+
+    def Use(self, job):
+        """ Called as the job starts. Returns the staged copy of its source, or None to read the original. Waits when
+            the copy is under way, reading the share at the same time would only slow both down. """
+        with self.condition:
+            self.waiting.discard(job.sourcePath)
+            self.condition.notify_all()
+            while job.sourcePath in self.staged and self.staged[job.sourcePath][0] == None and not self.stopping:
+                self.condition.wait()
+            return self.GetStagedPath(job.sourcePath)
+
+    def GetStagedPath(self, sourcePath):
+        """ Returns the finished staged copy of a source, None if there is none. """
+        with self.condition:
+            return self.staged.get(sourcePath, (None, 0))[0]
+
+    def Release(self, sourcePath):
+        """ Removes the staged copy of a source, it is no longer needed. """
+        with self.condition:
+            stagedPath, sizeInMB = self.staged.pop(sourcePath, (None, 0))
+            self.waiting.discard(sourcePath)
+            self.condition.notify_all()
+        if stagedPath != None and os.path.exists(stagedPath):
+            os.remove(stagedPath)
+
+    def Close(self):
+        """ Stops staging and removes whatever is left on the scratch space. Call once the workers and the archive
+            are done with the staged copies. """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        if self.thread != None:
+            self.thread.join()
+        for sourcePath in list(self.staged):
+            self.Release(sourcePath)
+
+    def GetStagingPath(self, sourcePath):
+        """ Where the staged copy of a source goes: its name, prefixed with a hash of its full path. Only the hash
+            and extension when the name is too long to take the prefix. """
+        pathHash = hashlib.sha1(sourcePath.encode('utf-8', 'surrogateescape')).hexdigest()
+        stagingName = pathHash[:8] + "-" + os.path.basename(sourcePath)
+        if Handbrake.IsFileNameTooLong(stagingName):
+            stagingName = pathHash + os.path.splitext(sourcePath)[1]
+        return os.path.join(self.directory, stagingName)
+
+    def __NextJob(self):
+        """ Private method, the first upcoming job that is worth staging and fits. Call with the condition held. """
+        while self.upcoming:
+            priority, jobId, job = self.upcoming[0]
+            if job.state != "queued":
+                heapq.heappop(self.upcoming)
+                continue
+            if job.sourcePath in self.staged:
+                heapq.heappop(self.upcoming) # another segment of the same source
+                continue
+            if len(self.waiting) >= self.lookAhead:
+                return None
+            usedMB = sum(sizeInMB for stagedPath, sizeInMB in self.staged.values())
+            sourceMB = job.sizeInMB if job.parent == None else job.parent.job.sizeInMB
+            if sourceMB > self.budgetInMB:
+                heapq.heappop(self.upcoming) # never fits, read from the share
+                continue
+            if usedMB + sourceMB > self.budgetInMB or \
+               FileManip().GetFreeSpaceInMB(self.directory) - self.marginInMB < sourceMB:
+                return None
+            heapq.heappop(self.upcoming)
+            return job, sourceMB
+        return None
+
+    def __Work(self):
+        while True:
+            with self.condition:
+                nextJob = self.__NextJob()
+                while nextJob == None and not self.stopping:
+                    self.condition.wait()
+                    nextJob = self.__NextJob()
+                if self.stopping:
+                    return
+                job, sourceMB = nextJob
+                self.staged[job.sourcePath] = (None, sourceMB)
+                self.waiting.add(job.sourcePath)
+            stagingPath = self.GetStagingPath(job.sourcePath)
+            try:
+                with Tracer.Span('StageSource', 'staging', {'source' : job.sourcePath, 'sizeInMB' : sourceMB}):
+                    self.copier.Copy(job.sourcePath, stagingPath)
+            except OSError:
+                stagingPath = None # the job reads the original
+            with self.condition:
+                if job.sourcePath in self.staged and stagingPath != None:
+                    self.staged[job.sourcePath] = (stagingPath, sourceMB)
+                else:
+                    self.staged.pop(job.sourcePath, None)
+                    self.waiting.discard(job.sourcePath)
+                    if stagingPath != None:
+                        os.remove(stagingPath) # released while it was being copied
+                self.condition.notify_all()
+
+class JobJournal():
+    """ Write-ahead journal of the current batch, one JSON record per line: the batch parameters followed by
+        queued, running, done and failed events for every job. Job state changes are fsync'd before the
+        work they describe goes ahead, so after a crash Replay() knows exactly which videos still need work. """
+    fileName = 'ManageHD.journal'
+
+    def __init__(self, fileName=None):
+        """ JobJournal class constructor. """
+        if fileName != None:
+            self.fileName = fileName
+        self.lock = threading.Lock()
+        self.journalFile = None
+
+    def Begin(self, cliParameters):
+        """ Starts the journal of a new batch, replacing the one of the previous batch. """
+        self.Close()
+        self.journalFile = open(self.fileName, 'w')
+        self.__Write({'event' : 'batch',
+                      'cliParameters' : cliParameters,
+                      'HandbrakeOptionsString' : Progress.statuses['HandbrakeOptionsString'],
+                      'OutputExtension' : Progress.statuses['OutputExtension']}, True)
+
+    def Continue(self):
+        """ Re-opens the journal of an interrupted batch so a resumed run keeps appending to it. """
+        self.Close()
+        self.journalFile = open(self.fileName, 'a')
+
+    def RecordJob(self, event, job):
+        """ Appends a job event. Only queued events skip the fsync, Resume() scans again for the videos they miss. """
+        self.__Write({'event' : event,
+                      'sourcePath' : job.sourcePath,
+                      'destinationPath' : job.destinationPath,
+                      'sizeInMB' : job.sizeInMB,
+                      'modifiedTime' : job.modifiedTime,
+                      'exitCode' : job.exitCode}, event != 'queued')
+
+    def End(self):
+        """ Marks the batch, archiving included, as complete. """
+        self.__Write({'event' : 'batchdone'}, True)
+        self.Close()
+
+    def Close(self):
+        with self.lock:
+            if self.journalFile != None:
+                self.journalFile.close()
+                self.journalFile = None
+
+    def __Write(self, record, sync):
+        if self.journalFile == None:
+            return
+        record['time'] = time()
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            self.journalFile.write(line)
+            self.journalFile.flush()
+            if sync:
+                os.fsync(self.journalFile.fileno())
+
+    def Replay(self):
+        """ Reads the journal back. Returns (batch record, {sourcePath : last job record}, batch finished),
+            or (None, {}, True) if there is no journal. A torn last line from a crash is ignored. """
+        batch = None
+        jobs = {}
+        finished = True
+        if not os.path.exists(self.fileName):
+            return batch, jobs, finished
+        with open(self.fileName) as journalFile:
+            for line in journalFile:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record['event'] == 'batch':
+                    batch, jobs, finished = record, {}, False
+                elif record['event'] == 'batchdone':
+                    finished = True
+                else:
+                    jobs[record['sourcePath']] = record
+        return batch, jobs, finished
+
+class ConversionManifest():
+    """ On-disk record of every source video converted so far, kept in SQLite next to cliattribs.xm.
+        A source is considered done while its path, size, modification time and Handbrake preset are unchanged. """
+    fileName = 'cliattribs.db'
+
+    def __init__(self, fileName=None):
+        """ Constructor, opens (creating if needed) the manifest database. """
+        if fileName != None:
+            self.fileName = fileName
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.fileName, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS converted ('
+                                    'path TEXT PRIMARY KEY, '
+                                    'sizeInMB REAL, '
+                                    'modifiedTime REAL, '
+                                    'preset TEXT, '
+                                    'destinationPath TEXT, '
+                                    'convertedAt REAL)')
+        self.entries = {}
+
+    def LoadEntries(self):
+        """ Reads the whole manifest into memory with a single query so a re-scan costs one dict lookup per file. """
+        with self.lock:
+            rows = self.connection.execute('SELECT path, sizeInMB, modifiedTime, preset FROM converted').fetchall()
+        self.entries = {}
+        for path, sizeInMB, modifiedTime, preset in rows:
+            self.entries[path] = (sizeInMB, modifiedTime, preset)
+        return len(self.entries)
+
+    def IsConverted(self, job):
+        """ True if this exact version of the source was already converted with the same preset. """
+        return self.entries.get(job.sourcePath) == (job.sizeInMB, job.modifiedTime, job.preset)
+
+    def RecordConversion(self, job):
+        """ Stores a successfully converted job. """
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO converted VALUES (?, ?, ?, ?, ?, ?)',
+                                    (job.sourcePath, job.sizeInMB, job.modifiedTime, job.preset,
+                                     job.destinationPath, mktime(datetime.now().timetuple())))
+        self.entries[job.sourcePath] = (job.sizeInMB, job.modifiedTime, job.preset)
+
+    def Close(self):
+        """ Closes the database connection. """
+        with self.lock:
+            self.connection.close()
+
+class ThroughputHistory():
+    """ Wall time of every video converted so far, kept in the same SQLite database as the ConversionManifest, and the
+        model fitted on it to predict how long a video or a whole batch will take.
+        Per (preset, concurrency) the wall time is fitted as a straight line over the source size by least squares,
+        with a 95% prediction interval from the residuals. Concurrencies that were never measured borrow the fit of
+        the whole preset, with the wall time scaled by the number of videos sharing the machine. """
+    fileName       = 'cliattribs.db'
+    minimumSamples = 3  # fits with fewer points give no prediction
+    errorWindow    = 50 # number of recent predictions the measured error is averaged over
+
+    def __init__(self, fileName=None):
+        """ Constructor, opens (creating if needed) the history table. """
+        if fileName != None:
+            self.fileName = fileName
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.fileName, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS history ('
+                                    'preset TEXT, '
+                                    'sizeInMB REAL, '
+                                    'durationInSeconds REAL, '
+                                    'concurrency INTEGER, '
+                                    'wallSeconds REAL, '
+                                    'predictedSeconds REAL, '
+                                    'finishedAt REAL, '
+                                    'outputSizeInMB REAL)')
+            columns = [row[1] for row in self.connection.execute('PRAGMA table_info(history)')]
+            if 'outputSizeInMB' not in columns:
+                # history recorded before output sizes were kept
+                self.connection.execute('ALTER TABLE history ADD COLUMN outputSizeInMB REAL')
+        self.fits         = {} # (preset, concurrency) -> least squares sums, concurrency None for the pooled fit
+        self.predictions  = [] # (predicted, actual) wall times of the most recent predicted videos
+        self.outputRatios = {} # preset -> output size / source size of its most recent videos
+
+    def LoadHistory(self):
+        """ Fits the model on every recorded video. Returns the number of records. """
+        with self.lock:
+            rows = self.connection.execute('SELECT preset, sizeInMB, concurrency, wallSeconds, predictedSeconds, '
+                                           'outputSizeInMB FROM history ORDER BY finishedAt').fetchall()
+            self.fits = {}
+            self.predictions = []
+            self.outputRatios = {}
+            for preset, sizeInMB, concurrency, wallSeconds, predictedSeconds, outputSizeInMB in rows:
+                self.__AddSample(preset, sizeInMB, concurrency, wallSeconds, predictedSeconds, outputSizeInMB)
+        return len(rows)
+
+    def RecordJob(self, job, wallSeconds, durationInSeconds=None):
+        """ Stores a successfully converted video and refits the model with it. """
+        outputSizeInMB = FileManip().GetFileSizeInMegabytes(job.destinationPath) or None
+        with self.lock, self.connection:
+            self.connection.execute('INSERT INTO history (preset, sizeInMB, durationInSeconds, concurrency, wallSeconds, '
+                                    'predictedSeconds, finishedAt, outputSizeInMB) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                    (job.preset, job.sizeInMB, durationInSeconds, job.concurrency, wallSeconds,
+                                     job.predictedSeconds, mktime(datetime.now().timetuple()), outputSizeInMB))
+            self.__AddSample(job.preset, job.sizeInMB, job.concurrency, wallSeconds, job.predictedSeconds, outputSizeInMB)
+
+    def __AddSample(self, preset, sizeInMB, concurrency, wallSeconds, predictedSeconds, outputSizeInMB=None):
+        """ Private method, adds one record to the running sums. Call with the lock held. """
+        if outputSizeInMB != None and sizeInMB > 0:
+            ratios = self.outputRatios.get(preset, [])
+            self.outputRatios[preset] = ratios[-(self.errorWindow - 1):] + [outputSizeInMB / sizeInMB]
+        for key, y in (((preset, concurrency), wallSeconds), ((preset, None), wallSeconds / max(1, concurrency))):
+            sums = self.fits.setdefault(key, [0, 0.0, 0.0, 0.0, 0.0, 0.0]) # n, sum x, sum y, sum xx, sum xy, sum yy
+            sums[0] += 1
+            sums[1] += sizeInMB
+            sums[2] += y
+            sums[3] += sizeInMB * sizeInMB
+            sums[4] += sizeInMB * y
+            sums[5] += y * y
+        if predictedSeconds != None:
+            self.predictions = self.predictions[-(self.errorWindow - 1):] + [(predictedSeconds, wallSeconds)]
+
+    @staticmethod
+    def __Evaluate(sums, x):
+        """ Private method, returns (prediction, half width of its 95% interval) of a least squares fit at x. """
+        n, sx, sy, sxx, sxy, syy = sums
+        sxxCentered = sxx - sx * sx / n
+        if sxxCentered <= 1e-9 * max(1.0, sxx):
+            # every sample had the same size, only the mean is known
+            slope = 0.0
+        else:
+            slope = (sxy - sx * sy / n) / sxxCentered
+        intercept = (sy - slope * sx) / n
+        residual = max(0.0, syy - intercept * sy - slope * sxy)
+        stdError = math.sqrt(residual / (n - 2)) if n > 2 else 0.0
+        leverage = 1.0 + 1.0 / n
+        if sxxCentered > 1e-9 * max(1.0, sxx):
+            leverage += (x - sx / n) ** 2 / sxxCentered
+        return max(0.0, intercept + slope * x), 1.96 * stdError * math.sqrt(leverage)
+
+    def PredictSeconds(self, preset, sizeInMB, concurrency):
+        """ Predicted wall time of a single video as (seconds, +/- seconds at 95%), or None without enough history. """
+        concurrency = max(1, concurrency)
+        with self.lock:
+            sums = self.fits.get((preset, concurrency))
+            if sums != None and sums[0] >= self.minimumSamples:
+                return self.__Evaluate(sums, sizeInMB)
+            sums = self.fits.get((preset, None))
+            if sums == None or sums[0] < self.minimumSamples:
+                return None
+            seconds, error = self.__Evaluate(sums, sizeInMB)
+        return seconds * concurrency, error * concurrency
+
+    def PredictBatch(self, preset, sizes, numWorkers):
+        """ Predicted wall time of a whole batch as (seconds, +/- seconds at 95%), scheduling the predicted video times
+            largest first on numWorkers workers. None without enough history. """
+        numWorkers = max(1, numWorkers)
+        times = []
+        for sizeInMB in sizes:
+            prediction = self.PredictSeconds(preset, sizeInMB, min(numWorkers, len(sizes)))
+            if prediction == None:
+                return None
+            times.append(prediction)
+        workerLoads = [(0.0, 0.0)] * numWorkers # (seconds, variance)
+        for seconds, error in sorted(times, reverse=True):
+            load, variance = workerLoads[0]
+            heapq.heapreplace(workerLoads, (load + seconds, variance + (error / 1.96) ** 2))
+        seconds, variance = max(workerLoads)
+        return seconds, 1.96 * math.sqrt(variance)
+
+    def OutputRatio(self, preset):
+        """ Output size over source size to expect from the preset: the largest of its recent videos, so estimates
+            err on the side of too much space. None before any video of the preset was converted. """
+        with self.lock:
+            ratios = self.outputRatios.get(preset)
+        if not ratios:
+            return None
+        return max(ratios)
+
+    def MeasuredError(self):
+        """ Mean absolute relative error of the recent predictions against the real wall times, None before any. """
+        with self.lock:
+            pairs = [(predicted, actual) for predicted, actual in self.predictions if actual > 0]
+        if len(pairs) == 0:
+            return None
+        return sum(abs(predicted - actual) / actual for predicted, actual in pairs) / len(pairs)
+
+    def Close(self):
+        """ Closes the database connection. """
+        with self.lock:
+            self.connection.close()
+
+class MetricsExporter():
+    """ Publishes the engine's progress in the Prometheus text format, on a local HTTP endpoint (/metrics) and/or as
+        a file for node_exporter's textfile collector. Gauges are read from the Progress statistics, counters and the
+        encode time histogram are accumulated from the engine events for as long as the process runs. """
+    fileName       = 'managehd.prom'
+    writeSeconds   = 15 # interval between textfile rewrites
+    encodeBuckets  = (60, 300, 600, 1800, 3600, 7200, 14400, 28800) # seconds
+
+    def __init__(self, address=None, textfileDirectory=None):
+        """ MetricsExporter class constructor. address is a (host, port) tuple, None for no HTTP endpoint. """
+        self.address           = address
+        self.textfileDirectory = textfileDirectory
+        self.lock              = threading.Lock()
+        self.stopEvent         = threading.Event()
+        self.server            = None
+        self.jobsCompleted     = 0
+        self.jobsFailed        = 0
+        self.jobsRefused       = 0
+        self.sourceBytes       = 0
+        self.outputBytes       = 0
+        self.archivedBytes     = 0
+        self.bucketCounts      = [0] * (len(self.encodeBuckets) + 1) # the last one is +Inf
+        self.encodeSecondsSum  = 0.0
+
+    @staticmethod
+    def FromParameters(cliParameters):
+        """ Starts an exporter when the parameters ask for one (p=[host:]port, e=<directory>), returns None otherwise. """
+        address = None
+        metricsPort = str(cliParameters.get('metricsPort', ""))
+        if metricsPort != "":
+            host, separator, port = metricsPort.rpartition(':')
+            address = (host if separator else '127.0.0.1', int(port))
+        textfileDirectory = cliParameters.get('metricsDirectory', "")
+        if address == None and not textfileDirectory:
+            return None
+        exporter = MetricsExporter(address, textfileDirectory or None)
+        exporter.Start()
+        return exporter
+
+    def Start(self):
+        """ Subscribes to the engine events and starts the HTTP server and textfile writer. """
+        Progress.Subscribe(self.OnEngineEvent)
+        if self.address != None:
+            self.server = MetricsServer(self.address, MetricsRequestHandler)
+            self.server.exporter = self
+            thread = threading.Thread(target=self.server.serve_forever)
+            thread.daemon = True
+            thread.start()
+        if self.textfileDirectory != None:
+            thread = threading.Thread(target=self.__WriteTextfilePeriodically)
+            thread.daemon = True
+            thread.start()
+
+    def Stop(self):
+        """ Writes the textfile a last time and shuts the HTTP server down. """
+        self.stopEvent.set()
+        Progress.Unsubscribe(self.OnEngineEvent)
+        if self.textfileDirectory != None:
+            self.WriteTextfile()
+        if self.server != None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def OnEngineEvent(self, event, subject):
+        """ Progress listener, accumulates the counters. """
+        if event == 'jobFinished':
+            job = subject
+            outputBytes = 0
+            if job.state == "done":
+                try:
+                    outputBytes = os.path.getsize(job.destinationPath)
+                except OSError:
+                    pass
+            with self.lock:
+                if job.state == "done":
+                    self.jobsCompleted += 1
+                    self.sourceBytes += int(job.sizeInMB * 1024 * 1024)
+                    self.outputBytes += outputBytes
+                elif job.state == "failed":
+                    self.jobsFailed += 1
+                elif job.state == "refused":
+                    self.jobsRefused += 1
+                # a video split into segments never ran as a whole, it has no encode time of its own
+                if job.state == "done" and job.startTime != None:
+                    self.__ObserveEncodeSeconds(time() - job.startTime)
+        elif event == 'sourceArchived':
+            try:
+                archivedBytes = os.path.getsize(subject)
+            except OSError:
+                return
+            with self.lock:
+                self.archivedBytes += archivedBytes
+
+    def __ObserveEncodeSeconds(self, seconds):
+        """ Private method, adds one encode to the histogram. Call with the lock held. """
+        bucket = 0
+        while bucket < len(self.encodeBuckets) and seconds > self.encodeBuckets[bucket]:
+            bucket += 1
+        self.bucketCounts[bucket] += 1
+        self.encodeSecondsSum += seconds
+
+    def Render(self):
+        """ Returns every metric in the Prometheus text exposition format. """
+        statuses = Progress.statuses.Snapshot()
+        inFlight = statuses['VideosCurrent']
+        queued = max(0, statuses['VideosTotal'] - statuses['VideosCompleted'] - inFlight)
+        lines = []
+        def Metric(name, metricType, helpText, value):
+            lines.append("# HELP managehd_{} {}".format(name, helpText))
+            lines.append("# TYPE managehd_{} {}".format(name, metricType))
+            lines.append("managehd_{} {}".format(name, value))
+        Metric('queue_depth', 'gauge', "Videos of the batch waiting for a worker.", queued)
+        Metric('jobs_in_flight', 'gauge', "Videos (or segments of videos) being encoded.", inFlight)
+        Metric('jobs_held', 'gauge', "Videos waiting for space on the destination or archive drive.", statuses['VideosHeld'])
+        Metric('throughput_gb_per_hour', 'gauge', "Aggregate processing speed of the batch.", float(statuses['ProcessingSpeedInGBperHour']))
+        Metric('live_throughput_bytes_per_second', 'gauge', "Processing speed of the encodes now running.",
+               float(statuses['LiveSpeedInMBperSecond']) * 1024 * 1024)
+        with self.lock:
+            Metric('jobs_completed_total', 'counter', "Videos converted successfully.", self.jobsCompleted)
+            Metric('jobs_failed_total', 'counter', "Videos whose conversion failed.", self.jobsFailed)
+            Metric('jobs_refused_total', 'counter', "Videos skipped because their output could never fit on the drive.",
+                   self.jobsRefused)
+            Metric('source_bytes_total', 'counter', "Bytes of the successfully converted source videos.", self.sourceBytes)
+            Metric('output_bytes_total', 'counter', "Bytes of the converted videos written.", self.outputBytes)
+            Metric('archived_bytes_total', 'counter', "Bytes of source videos moved to the archive.", self.archivedBytes)
+            lines.append("# HELP managehd_encode_seconds Wall time of a single successful encode.")
+            lines.append("# TYPE managehd_encode_seconds histogram")
+            cumulative = 0
+            for bucket, upperBound in enumerate(self.encodeBuckets):
+                cumulative += self.bucketCounts[bucket]
+                lines.append('managehd_encode_seconds_bucket{{le="{}"}} {}'.format(upperBound, cumulative))
+            cumulative += self.bucketCounts[-1]
+            lines.append('managehd_encode_seconds_bucket{{le="+Inf"}} {}'.format(cumulative))
+            lines.append("managehd_encode_seconds_sum {}".format(self.encodeSecondsSum))
+            lines.append("managehd_encode_seconds_count {}".format(cumulative))
+        return "\n".join(lines) + "\n"
+
+    def WriteTextfile(self):
+        """ Atomically replaces the textfile, the collector must never read half a file. """
+        path = os.path.join(self.textfileDirectory, self.fileName)
+        temporaryPath = path + ".tmp"
+        try:
+            with open(temporaryPath, 'w') as textfile:
+                textfile.write(self.Render())
+            os.replace(temporaryPath, path)
+        except OSError:
+            pass
+
+    def __WriteTextfilePeriodically(self):
+        while not self.stopEvent.is_set():
+            self.WriteTextfile()
+            self.stopEvent.wait(self.writeSeconds)
+
+class MetricsServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """ One thread per scrape. """
+    daemon_threads      = True
+    allow_reuse_address = True
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ Answers GET /metrics with the exporter's current metrics. """
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.server.exporter.Render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # scrapes every few seconds would flood the console
+
+class JobSummaryLog():
+    """ One JSON record per Handbrake run (timings, fps, exit code, sizes, log file), appended to jobs.jsonl in the
+        log directory through a size rotated logging handler, so a batch of any length keeps a bounded history. """
+    fileName    = 'jobs.jsonl'
+    maxBytes    = 10 * 1024 * 1024
+    backupCount = 5
+
+    def __init__(self, directory=None):
+        """ JobSummaryLog class constructor. """
+        if directory == None:
+            directory = Handbrake.GetLogDirectory()
+        os.makedirs(directory, exist_ok=True)
+        self.handler = logging.handlers.RotatingFileHandler(os.path.join(directory, self.fileName),
+                                                            maxBytes=self.maxBytes, backupCount=self.backupCount)
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+        # not registered with logging.getLogger(), which would keep every batch's logger for good
+        self.logger = logging.Logger('ManageHD.jobs')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+
+    def RecordJob(self, job, logFile=None, segmentOf=None, startTime=None):
+        """ Appends the summary of a finished job, or of one segment of it when segmentOf is the whole job.
+            startTime overrides the job's own, for a split video that never ran as a whole. """
+        if startTime == None:
+            startTime = job.startTime
+        outputBytes = None
+        if job.state == "done":
+            try:
+                outputBytes = os.path.getsize(job.destinationPath)
+            except OSError:
+                pass
+        endTime = time()
+        record = {'source' : job.sourcePath,
+                  'destination' : job.destinationPath,
+                  'state' : job.state,
+                  'exitCode' : job.exitCode,
+                  'startedAt' : startTime,
+                  'finishedAt' : endTime,
+                  'wallSeconds' : endTime - startTime if startTime != None else None,
+                  'predictedSeconds' : job.predictedSeconds,
+                  'concurrency' : job.concurrency,
+                  'percent' : 100.0 if job.state == "done" else job.percent,
+                  'averageFps' : job.averageFps,
+                  'inputBytes' : int(job.sizeInMB * 1024 * 1024),
+                  'outputBytes' : outputBytes,
+                  'log' : logFile}
+        if segmentOf != None:
+            record['segmentOf'] = segmentOf.destinationPath
+        self.logger.info(json.dumps(record))
+
+    def Close(self):
+        """ Flushes and closes the summary file. """
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+
+class WatchFolder():
+    """ Watches a source directory tree and reports video files once they have stopped changing.
+        Uses inotify on Linux and falls back to periodic re-scans everywhere else. """
+    IN_MODIFY      = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_Q_OVERFLOW  = 0x00004000
+    IN_ISDIR       = 0x40000000
+    IN_NONBLOCK    = 0o4000
+    IN_CLOEXEC     = 0o2000000
+    eventHeader    = struct.Struct('iIII')
+
+    def __init__(self, directoryPath, fileTypes, excludeDirectories=(), settleSeconds=30, pollSeconds=10):
+        """ WatchFolder class constructor. """
+        self.directoryPath      = directoryPath
+        self.fileTypes          = fileTypes
+        self.excludeDirectories = excludeDirectories
+        self.settleSeconds      = settleSeconds
+        self.pollSeconds        = pollSeconds
+        self.pending            = {} # path -> (size, mtime, time of last change)
+        self.reported           = {} # path -> (size, mtime) already handed over
+        self.watchDescriptors   = {} # inotify watch descriptor -> directory
+        self.inotifyFd          = None
+        self.libc               = None
+
+    def Watch(self, onStable, stopEvent, onTick=None):
+        """ Blocks until stopEvent is set, calling onStable(path, sizeInMB, modifiedTime) for every settled video. """
+        self.__OpenInotify()
+        try:
+            self.__Rescan()
+            while not stopEvent.is_set():
+                if self.inotifyFd != None:
+                    timeout = 1 if self.pending else self.pollSeconds
+                    self.__ReadInotifyEvents(timeout)
+                else:
+                    stopEvent.wait(1 if self.pending else self.pollSeconds)
+                    self.__Rescan()
+                self.__ReportSettledFiles(onStable)
+                if onTick != None:
+                    onTick()
+        finally:
+            self.__CloseInotify()
+
+    def __Rescan(self):
+        """ Full scan of the tree, any new or modified video is (re)added to the pending list. """
+        fm = FileManip()
+        for path, sizeInMB, modifiedTime in fm.ScanForVideos(self.directoryPath, self.fileTypes,
+                                                             excludeDirectories=self.excludeDirectories):
+            self.__Candidate(path, sizeInMB, modifiedTime)
+        if self.inotifyFd != None:
+            self.__AddWatchesBelow(self.directoryPath)
+
+    def __Candidate(self, path, sizeInMB, modifiedTime):
+        """ Start (or restart) the settle clock of a file whose size or mtime changed. """
+        if self.reported.get(path) == (sizeInMB, modifiedTime):
+            return
+        pendingEntry = self.pending.get(path)
+        if pendingEntry == None or pendingEntry[:2] != (sizeInMB, modifiedTime):
+            self.pending[path] = (sizeInMB, modifiedTime, time())
+
+    def __ReportSettledFiles(self, onStable):
+        """ Hand over every pending file whose size and mtime have not changed for settleSeconds. """
+        now = time()
+        for path in list(self.pending):
+            sizeInMB, modifiedTime, lastChange = self.pending[path]
+            try:
+                fileStat = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            currentSize = fileStat.st_size / 1024 / 1024
+            if (currentSize, fileStat.st_mtime) != (sizeInMB, modifiedTime):
+                self.pending[path] = (currentSize, fileStat.st_mtime, now)
+            elif now - lastChange >= self.settleSeconds:
+                del self.pending[path]
+                self.reported[path] = (sizeInMB, modifiedTime)
+                onStable(path, sizeInMB, modifiedTime)
+
+    def __OpenInotify(self):
+        """ Sets up inotify when running on Linux, leaves polling mode enabled otherwise. """
+        if sys.platform[:5] != "linux":
+            return
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd >= 0:
+            self.inotifyFd = fd
+
+    def __CloseInotify(self):
+        if self.inotifyFd != None:
+            os.close(self.inotifyFd)
+            self.inotifyFd = None
+            self.watchDescriptors = {}
+
+    def __AddWatchesBelow(self, directory):
+        """ Adds an inotify watch to directory and every directory below it that is not yet watched. """
+        watched = set(self.watchDescriptors.values())
+        excluded = set(os.path.normcase(os.path.realpath(d)) for d in self.excludeDirectories if d)
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE | self.IN_MODIFY
+        for current, subDirectories, files in os.walk(directory):
+            subDirectories[:] = [d for d in subDirectories
+                                 if os.path.normcase(os.path.realpath(os.path.join(current, d))) not in excluded]
+            if current in watched:
+                continue
+            wd = self.libc.inotify_add_watch(self.inotifyFd, os.fsencode(current), mask)
+            if wd >= 0:
+                self.watchDescriptors[wd] = current
+
+    def __ReadInotifyEvents(self, timeout):
+        """ Waits up to timeout seconds for inotify events and turns them into pending candidates. """
+        readable, writable, failed = select.select([self.inotifyFd], [], [], timeout)
+        if not readable:
+            return
+        try:
+            buffer = os.read(self.inotifyFd, 64 * 1024)
+        except BlockingIOError:
+            return
+        extensions = set(os.path.normcase("." + t.strip().lstrip(".")) for t in self.fileTypes if t.strip() != "")
+        offset = 0
+        while offset + self.eventHeader.size <= len(buffer):
+            wd, mask, cookie, nameLength = self.eventHeader.unpack_from(buffer, offset)
+            offset += self.eventHeader.size
+            name = os.fsdecode(buffer[offset:offset + nameLength].rstrip(b'\0'))
+            offset += nameLength
+            if mask & self.IN_Q_OVERFLOW:
+                # events were dropped by the kernel, fall back to a full scan
+                self.__Rescan()
+                continue
+            directory = self.watchDescriptors.get(wd)
+            if directory == None or name == "":
+                continue
+            path = os.path.join(directory, name)
+            if mask & self.IN_ISDIR:
+                self.__AddWatchesBelow(path)
+                fm = FileManip()
+                for item in fm.ScanForVideos(path, self.fileTypes, excludeDirectories=self.excludeDirectories):
+                    self.__Candidate(*item)
+            elif os.path.normcase(os.path.splitext(name)[1]) in extensions:
+                try:
+                    fileStat = os.stat(path)
+                except OSError:
+                    continue
+                self.__Candidate(path, fileStat.st_size / 1024 / 1024, fileStat.st_mtime)
+
+class JobRunner():
+    """ Runs one external command from an argument list through subprocess.Popen (no shell), keeping its
+        exit status and allowing it to be cancelled or timed out from another thread. """
+    def __init__(self, argv, timeout=None):
+        """ JobRunner class constructor, timeout is in seconds. """
+        self.argv       = argv
+        self.timeout    = timeout
+        self.process    = None
+        self.returnCode = None
+        self.cancelled  = False
+        self.timedOut   = False
+        self.lock       = threading.Lock()
+
+    def Run(self, stdout=None, stderr=None, onOutputLine=None):
+        """ Starts the command and waits for it. Returns the exit code, or -1 if it could not be started.
+            With onOutputLine, standard output is captured and handed over one line at a time as it is
+            produced; carriage returns end a line too, as used by Handbrake's progress display. """
+        if onOutputLine != None:
+            stdout = subprocess.PIPE
+        with self.lock:
+            if self.cancelled:
+                return self.returnCode
+            try:
+                self.process = subprocess.Popen(self.argv, stdin=subprocess.DEVNULL, stdout=stdout, stderr=stderr)
+            except OSError:
+                self.returnCode = -1
+                return self.returnCode
+        timer = None
+        if self.timeout != None:
+            timer = threading.Timer(self.timeout, self.__TimedOut)
+            timer.daemon = True
+            timer.start()
+        try:
+            if onOutputLine != None:
+                self.__ReadLines(onOutputLine)
+            self.returnCode = self.process.wait()
+        finally:
+            if timer != None:
+                timer.cancel()
+        return self.returnCode
+
+    def __ReadLines(self, onOutputLine):
+        pending = b""
+        fd = self.process.stdout.fileno()
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            lines = re.split(b"[\r\n]", pending + chunk)
+            pending = lines.pop()
+            for line in lines:
+                if line:
+                    onOutputLine(line.decode('utf-8', 'replace'))
+        if pending:
+            onOutputLine(pending.decode('utf-8', 'replace'))
+        self.process.stdout.close()
+
+    def __TimedOut(self):
+        self.timedOut = True
+        self.Cancel()
+
+    def Cancel(self, gracePeriod=10):
+        """ Stops the command, politely first and forcefully after gracePeriod seconds. """
+        with self.lock:
+            self.cancelled = True
+            process = self.process
+        if process == None or process.poll() != None:
+            return
+        process.terminate()
+        try:
+            process.wait(gracePeriod)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
 class ShellCmd():
     def __init__(self): # Not Implemented
         pass
@@ -547,60 +2253,694 @@ class ShellCmd():
         """ Called to Execute a command against the operating system via a call to the private method __IssueCmd. """
         return self.__IssueCmd(command)
         
+class JobScheduler():
+    """ Decides the order in which queued jobs are handed to the workers and predicts the resulting makespan.
+        fifo - jobs run in the order they were found.
+        lpt  - longest (largest) processing time first: whenever a worker frees up it takes the largest waiting job,
+               so a huge video can no longer land at the end of the batch and run alone while the other workers idle. """
+    policies = ('fifo', 'lpt')
+
+    def __init__(self, policy='lpt'):
+        """ JobScheduler class constructor. """
+        if policy not in self.policies:
+            raise ValueError("Unknown scheduling policy: " + str(policy))
+        self.policy   = policy
+        self.sequence = itertools.count()
+
+    def Priority(self, job):
+        """ Returns the sort key of a job for the worker PriorityQueue, lowest runs first. """
+        if self.policy == 'lpt':
+            return (-job.sizeInMB, next(self.sequence))
+        return (next(self.sequence),)
+
+    @staticmethod
+    def OrderSizes(sizes, policy):
+        """ Returns the list of job sizes in the order the given policy would dispatch them. """
+        if policy == 'lpt':
+            return sorted(sizes, reverse=True)
+        return list(sizes)
+
+    @staticmethod
+    def PredictMakespan(sizes, numWorkers, policy='lpt'):
+        """ Simulates greedy list scheduling of the given job sizes on numWorkers equal workers.
+            Returns the makespan in megabytes per worker (divide by a single worker's MB/hour to get hours). """
+        numWorkers = max(1, numWorkers)
+        workerLoads = [0.0] * numWorkers
+        for size in JobScheduler.OrderSizes(sizes, policy):
+            heapq.heapreplace(workerLoads, workerLoads[0] + size)
+        return max(workerLoads)
+
+    @staticmethod
+    def MakespanLowerBound(sizes, numWorkers):
+        """ No schedule can finish before the largest job or before a perfectly balanced share of the total. """
+        if len(sizes) == 0:
+            return 0.0
+        return max(max(sizes), sum(sizes) / max(1, numWorkers))
+
+    @staticmethod
+    def ComparePolicies(sizes, numWorkers):
+        """ Predicted makespan (MB per worker) of every policy plus the theoretical lower bound. """
+        sizes = list(sizes)
+        predictions = {}
+        for policy in JobScheduler.policies:
+            predictions[policy] = JobScheduler.PredictMakespan(sizes, numWorkers, policy)
+        predictions['lowerBound'] = JobScheduler.MakespanLowerBound(sizes, numWorkers)
+        return predictions
+
+    @staticmethod
+    def MakespanInHours(makespanInMB, gbPerHour, numWorkers):
+        """ Converts a makespan in MB per worker into hours using the pool wide processing speed. """
+        if gbPerHour == 0:
+            return None
+        return makespanInMB / ((gbPerHour * 1024) / max(1, numWorkers))
+
+class ConcurrencyAutotuner():
+    """ Searches for the number of concurrent Handbrake processes that gives the highest aggregate throughput
+        (MB of source video processed per second) on this host, resizing the running Threads pool as it goes.
+        The pool is doubled while throughput keeps improving, halved if the first doubling did not help,
+        and the best level is finally refined half way towards the next larger level tried. """
+    def __init__(self, threads, minWorkers=1, maxWorkers=None, sampleSeconds=300, improvement=0.05):
+        """ ConcurrencyAutotuner class constructor. """
+        if maxWorkers == None:
+            maxWorkers = os.cpu_count() or 1
+        self.threads       = threads
+        self.minWorkers    = minWorkers
+        self.maxWorkers    = max(minWorkers, maxWorkers)
+        self.sampleSeconds = sampleSeconds
+        self.improvement   = improvement
+        self.lock          = threading.Lock()
+        self.stopEvent     = threading.Event()
+        self.processedMB   = 0.0
+        self.results       = {} # concurrency level -> MB per second
+        self.bestLevel     = None
+
+    def AddProcessedMegabytes(self, megabytes):
+        """ Called by the workers with the amount of source video they just got through. """
+        with self.lock:
+            self.processedMB += megabytes
+
+    def Start(self):
+        """ Run the search in a background thread. """
+        thread = threading.Thread(target=self.Tune)
+        thread.daemon = True
+        thread.start()
+
+    def Stop(self):
+        self.stopEvent.set()
+
+    def Measure(self, level):
+        """ Runs the pool at the given level for at least one sample period and returns the measured MB/s. """
+        self.threads.Resize(level)
+        with self.lock:
+            startMB = self.processedMB
+        startTime = time()
+        while not self.stopEvent.wait(self.sampleSeconds):
+            elapsed = time() - startTime
+            with self.lock:
+                processed = self.processedMB - startMB
+            # keep sampling until at least one video has finished at this level
+            if processed > 0 or elapsed >= self.sampleSeconds * 4:
+                break
+        elapsed = max(time() - startTime, 1e-6)
+        with self.lock:
+            rate = (self.processedMB - startMB) / elapsed
+        self.results[level] = rate
+        Progress.statuses['ThroughputByConcurrency'] = dict(self.results)
+        return rate
+
+    def Tune(self):
+        """ The search itself, leaves the pool at the best level found. """
+        startLevel = self.threads.NumberOfThreads
+        bestLevel = startLevel
+        bestRate = self.Measure(startLevel)
+        for grow in (True, False):
+            while not self.stopEvent.is_set():
+                if grow:
+                    candidate = min(self.maxWorkers, bestLevel * 2)
+                else:
+                    candidate = max(self.minWorkers, bestLevel // 2)
+                if candidate == bestLevel or candidate in self.results:
+                    break
+                rate = self.Measure(candidate)
+                if rate <= bestRate * (1 + self.improvement):
+                    break
+                bestLevel, bestRate = candidate, rate
+            if bestLevel > startLevel:
+                break
+
+        higherLevels = [level for level in self.results if level > bestLevel]
+        if higherLevels and not self.stopEvent.is_set():
+            candidate = (bestLevel + min(higherLevels)) // 2
+            if candidate != bestLevel and candidate not in self.results:
+                rate = self.Measure(candidate)
+                if rate > bestRate * (1 + self.improvement):
+                    bestLevel, bestRate = candidate, rate
+
+        self.bestLevel = bestLevel
+        if not self.stopEvent.is_set():
+            self.threads.Resize(bestLevel)
+        Progress.statuses['TunedConcurrency'] = bestLevel
+
+class HostCalibration():
+    """ Measures, once per machine, how fast every preset converts at several numbers of concurrent encodes
+        (doubling from 1 while the aggregate throughput keeps improving, as the ConcurrencyAutotuner does), by encoding
+        the same short range from the middle of a sample video level times at once. The GB/hour figures are kept in
+        cliattribs.xm and give the time remaining and the default number of workers of a batch before it has
+        measured anything itself. """
+    def __init__(self, sampleVideo, sampleSeconds=60, maxWorkers=None, improvement=0.05):
+        """ HostCalibration class constructor. """
+        if maxWorkers == None:
+            maxWorkers = os.cpu_count() or 1
+        self.sampleVideo   = sampleVideo
+        self.sampleSeconds = sampleSeconds
+        self.maxWorkers    = max(1, maxWorkers)
+        self.improvement   = improvement
+        self.sampleRange   = []  # --start-at/--stop-at options selecting the sample
+        self.sampleMB      = 0.0 # share of the source file the sample range stands for
+
+    def PrepareSample(self):
+        """ Picks the range of the sample video that is encoded. """
+        sizeInMB = FileManip().GetFileSizeInMegabytes(self.sampleVideo)
+        duration = SegmentedEncoder.GetDurationInSeconds(self.sampleVideo)
+        if duration == None or duration <= self.sampleSeconds:
+            self.sampleRange = []
+            self.sampleMB    = sizeInMB
+            return
+        self.sampleRange = ["--start-at", "duration:{}".format(int((duration - self.sampleSeconds) / 2)),
+                            "--stop-at", "duration:{}".format(self.sampleSeconds)]
+        self.sampleMB    = sizeInMB * self.sampleSeconds / duration
+
+    def Measure(self, presetName, level):
+        """ Encodes the sample level times at once with the given preset. Returns the aggregate GB/hour, or None when
+            an encode failed. """
+        hb = Handbrake()
+        optionsString, extension = Handbrake.presets[presetName]
+        with tempfile.TemporaryDirectory(prefix="ManageHD-calibrate-") as directory:
+            runners = []
+            for index in range(level):
+                outputFile = os.path.join(directory, "sample{:03d}.{}".format(index, extension))
+                runners.append(JobRunner(hb.BuildHandBrakeParameterList(self.sampleVideo, outputFile, optionsString) +
+                                         self.sampleRange))
+            encodes = []
+            for runner in runners:
+                encode = threading.Thread(target=runner.Run, args=(subprocess.DEVNULL, subprocess.DEVNULL))
+                encode.daemon = True
+                encodes.append(encode)
+            startTime = time()
+            for encode in encodes:
+                encode.start()
+            for encode in encodes:
+                encode.join()
+            elapsed = max(time() - startTime, 1e-6)
+        if any(runner.returnCode != 0 for runner in runners):
+            return None
+        return (level * self.sampleMB / 1024) / (elapsed / 3600)
+
+    def CalibratePreset(self, presetName):
+        """ Returns {number of workers : GB/hour} for one preset, None when the sample could not be encoded. """
+        results = {}
+        bestRate = 0.0
+        level = 1
+        while True:
+            rate = self.Measure(presetName, level)
+            if rate == None:
+                return None
+            results[level] = rate
+            print("    " + presetName + ", " + str(level) + " at once: " + '%.2f' % rate + " GB/hour")
+            if rate <= bestRate * (1 + self.improvement) or level == self.maxWorkers:
+                return results
+            bestRate = rate
+            level = min(self.maxWorkers, level * 2)
+
+    def Run(self):
+        """ Calibrates every preset and stores the results. Returns {preset name : {workers : GB/hour}}. """
+        self.PrepareSample()
+        calibration = {}
+        fm = FileManip()
+        for presetName in sorted(Handbrake.presets):
+            results = self.CalibratePreset(presetName)
+            if results == None:
+                print("ERROR: Handbrake could not convert " + self.sampleVideo + " with the " + presetName + " preset.")
+                continue
+            calibration[presetName] = results
+            fm.WriteCalibration(presetName, results)
+        return calibration
+
+    @staticmethod
+    def BestWorkers(throughputByWorkers):
+        """ The calibrated number of workers with the highest throughput. """
+        return max(throughputByWorkers, key=lambda workers: (throughputByWorkers[workers], -workers))
+
+    @staticmethod
+    def Throughput(throughputByWorkers, numWorkers):
+        """ Calibrated GB/hour for numWorkers concurrent encodes: the largest calibrated level not above it
+            (beyond the levels measured the machine was already saturated). 0 when nothing was calibrated. """
+        levels = [level for level in throughputByWorkers if level <= numWorkers]
+        if len(levels) == 0:
+            return 0
+        return throughputByWorkers[max(levels)]
+
+class SegmentGroup():
+    """ Keeps track of the segments a large video was split into and joins them once the last one is encoded. """
+    def __init__(self, job, segments, concatenator):
+        """ SegmentGroup class constructor. """
+        self.job          = job
+        self.segments     = segments
+        self.concatenator = concatenator
+        self.remaining    = len(segments)
+        self.startTime    = time()
+        self.lock         = threading.Lock()
+
+    def SegmentFinished(self, segment, admission=None):
+        """ Called by the worker that finished a segment. Returns the original job once every segment is done
+            (joined into its output, or failed), None while other segments are still running. The joined output
+            is written while the segments are still on disk, admission (a StorageAdmission) reserves it meanwhile. """
+        with self.lock:
+            self.remaining -= 1
+            if self.remaining > 0:
+                return None
+        job = self.job
+        if all(part.state == "done" for part in self.segments):
+            if admission != None:
+                fm = FileManip()
+                admission.ReserveOutput(job, sum(fm.GetFileSizeInMegabytes(part.destinationPath) for part in self.segments))
+            try:
+                job.exitCode = self.concatenator.Join([part.destinationPath for part in self.segments], job.temporaryPath)
+            finally:
+                if admission != None:
+                    admission.ReleaseOutput(job)
+            job.state = "done" if job.exitCode == 0 else "failed"
+        elif any(part.state == "cancelled" for part in self.segments):
+            job.state = "cancelled"
+        elif any(part.state == "refused" for part in self.segments):
+            job.state = "refused"
+            job.exitCode = -1
+        else:
+            job.state = "failed"
+            job.exitCode = [part.exitCode for part in self.segments if part.state == "failed"][0]
+        job.CommitOutput()
+        for part in self.segments:
+            if os.path.exists(part.destinationPath):
+                os.remove(part.destinationPath)
+        return job
+
+class SegmentedEncoder():
+    """ Splits videos of thresholdInMB or more into time ranges that are encoded concurrently with Handbrake's
+        --start-at/--stop-at options and then losslessly joined (mkvmerge for mkv when available, else ffmpeg). """
+    def __init__(self, thresholdInMB):
+        """ SegmentedEncoder class constructor. """
+        self.thresholdInMB = thresholdInMB
+        self.mkvmerge      = shutil.which("mkvmerge")
+        self.ffmpeg        = shutil.which("ffmpeg")
+
+    def IsAvailable(self):
+        """ Splitting is only possible with a tool to join the segments. """
+        return self.mkvmerge != None or self.ffmpeg != None
+
+    @staticmethod
+    def GetDurationInSeconds(movie):
+        """ Asks Handbrake to scan the movie and returns the duration of its main title, None if unknown. """
+        try:
+            scan = subprocess.run([Handbrake.GetHandBrakeCLIPath(), "-i", movie, "--scan", "-t", "1"],
+                                  stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=300)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        match = re.search(r"\+ duration: (\d+):(\d\d):(\d\d)", scan.stdout.decode('utf-8', 'replace'))
+        if match == None:
+            return None
+        return int(match.group(1)) * 3600 + int(match.group(2)) * 60 + int(match.group(3))
+
+    def Split(self, job, numWorkers):
+        """ Returns the segment jobs for a large video, or [job] if it is small or cannot be split. """
+        if job.sizeInMB < self.thresholdInMB or numWorkers < 2 or job.parent != None or not self.IsAvailable():
+            return [job]
+        segmentCount = max(2, min(numWorkers, int(math.ceil(job.sizeInMB / self.thresholdInMB))))
+        duration = self.GetDurationInSeconds(job.sourcePath)
+        if duration == None or duration < segmentCount * 60:
+            return [job]
+
+        hb = Handbrake()
+        directory, fileName = os.path.split(job.temporaryPath)
+        baseName, extension = os.path.splitext(fileName)
+        segmentLength = int(math.ceil(duration / segmentCount))
+        segments = []
+        for index in range(segmentCount):
+            segment = VideoJob(job.sourcePath, job.sizeInMB / segmentCount, job.modifiedTime)
+            segment.preset          = job.preset
+            segmentName = "{}.seg{:02d}{}".format(baseName, index, extension)
+            if Handbrake.IsFileNameTooLong(segmentName):
+                segmentName = "{}.seg{:02d}{}".format(hashlib.sha1(baseName.encode('utf-8', 'surrogateescape')).hexdigest(), index, extension)
+            segment.destinationPath = os.path.join(directory, segmentName)
+            segment.argv            = hb.BuildHandBrakeParameterList(job.sourcePath, segment.destinationPath) + \
+                                      ["--start-at", "duration:{}".format(index * segmentLength),
+                                       "--stop-at", "duration:{}".format(segmentLength)]
+            segments.append(segment)
+        group = SegmentGroup(job, segments, self)
+        for segment in segments:
+            segment.parent = group
+        return segments
+
+    @Tracer.Traced('JoinSegments', 'worker')
+    def Join(self, segmentFiles, outputFile):
+        """ Concatenates the encoded segments without re-encoding. Returns the exit code of the joining tool. """
+        if self.mkvmerge != None and outputFile.lower().endswith(".mkv"):
+            argv = [self.mkvmerge, "-q", "-o", outputFile, segmentFiles[0]]
+            for segmentFile in segmentFiles[1:]:
+                argv += ["+", segmentFile]
+            status = JobRunner(argv).Run(stdout=subprocess.DEVNULL)
+            return 0 if status == 1 else status # 1 means warnings only
+        listFile = outputFile + ".txt"
+        with open(listFile, "w") as concatList:
+            for segmentFile in segmentFiles:
+                concatList.write("file '" + segmentFile.replace("'", "'\\''") + "'\n")
+        try:
+            return JobRunner([self.ffmpeg, "-v", "error", "-y", "-f", "concat", "-safe", "0", "-i", listFile,
+                              "-map", "0", "-c", "copy", outputFile]).Run(stdout=subprocess.DEVNULL)
+        finally:
+            os.remove(listFile)
+
 class Threads():
     # lock to serialize console output
     lock = threading.Lock()
+    manifest = None # ConversionManifest updated as videos complete
+    scheduler = JobScheduler('fifo')
+    autotuner = None # ConcurrencyAutotuner fed with the megabytes of each finished video
+    jobTimeout = None # seconds a single Handbrake run may take, None for no limit
+    journal = None # JobJournal of the running batch
+    segmenter = None # SegmentedEncoder splitting very large videos across the workers
+    metrics = None # MetricsExporter publishing the progress for monitoring
+    summaryLog = None # JobSummaryLog getting a record for every Handbrake run
+    archiver = None # ArchivePipeline taking the sources of successful conversions
+    admission = None # StorageAdmission holding back jobs whose output would not fit
+    stager = None # SourceStager copying upcoming sources to local scratch space
+    history = None # ThroughputHistory learning how long each video takes
+
+    def __init__(self):
+        """ Threads class constructor. """
+        self.NumberOfThreads      = 0
+        self.runningJobs          = set()
+        self.convertedSources     = [] # sources whose conversion exited successfully, in completion order
     
     def CreateThreadPool(self, activeQueue, numThreads = 4):
         """ Create the queue and the thread pool. """
-        self.NumberOfThreads = numThreads
-        for threadCount in range(numThreads):
-            thread = threading.Thread(target=self.Worker,args=(activeQueue,))
-            thread.setDaemon(True)  # thread dies when main thread (only non-daemon thread) exits.
-            thread.start()
+        self.activeQueue          = activeQueue
+        self.poolLock             = threading.Lock()
+        self.retireSequence       = itertools.count()
+        self.aliveWorkers         = 0
+        self.pendingRetirements   = 0
+        self.Resize(numThreads)
+
+    def Resize(self, numThreads):
+        """ Grow or shrink the running pool to numThreads workers. Growing is immediate, a shrinking pool
+            retires workers as they finish their current video, through retire tokens queued ahead of every job. """
+        numThreads = max(1, numThreads)
+        with self.poolLock:
+            self.NumberOfThreads = numThreads
+            difference = numThreads - (self.aliveWorkers - self.pendingRetirements)
+            for threadCount in range(difference):
+                thread = threading.Thread(target=self.Worker,args=(self.activeQueue,))
+                thread.daemon = True  # thread dies when main thread (only non-daemon thread) exits.
+                self.aliveWorkers += 1
+                thread.start()
+            for threadCount in range(-difference):
+                self.pendingRetirements += 1
+                self.activeQueue.put(((float('-inf'), next(self.retireSequence)), None))
 
     def Worker(self, activeQueue):
         """ Worker thread. """
         while True:
-            item = activeQueue.get()
-            activeQueue.task_done()
+            with Tracer.Span('QueueWait', 'worker'):
+                priority, job = activeQueue.get()
 
-            with self.lock:
-                Progress.statuses['VideosCurrent'] += 1
-                Progress.statuses['StatusesHaveChanged'] = True
-           
+            if job == None:
+                # retire token from Resize()
+                with self.poolLock:
+                    self.pendingRetirements -= 1
+                    self.aliveWorkers -= 1
+                activeQueue.task_done()
+                return
+
+            admission = 'admitted'
+            if self.admission != None:
+                admission = self.admission.Admit(job, activeQueue, priority)
+                if admission == 'held':
+                    continue
+            try:
+                if admission == 'cancelled':
+                    job.state = "cancelled"
+                else:
+                    self.__ProcessJob(job, admission == 'refused')
+            except Exception as error:
+                # whatever went wrong with this job, the worker goes on with the next one
+                if job.state not in ("failed", "cancelled"):
+                    job.state = "failed"
+                with self.lock:
+                    print("ERROR: " + job.sourcePath + " failed: " + repr(error))
+            finally:
+                job.finished.set()
+                # only now may activeQueue.join() return for the last job
+                activeQueue.task_done()
+
+    def __ProcessJob(self, job, refused=False):
+        """ Runs a single job and accounts for it in the progress statistics. A job refused for lack of space is
+            accounted for as refused without running. """
+        Progress.statuses.Increment('VideosCurrent')
+        started = job
+        accounted = False
+        try:
             # convert start time to unix timestamp
             startTime = mktime(datetime.now().timetuple())
 
-            if sys.platform == 'win32':
-                os.system(item)
+            if self.stager != None and not refused:
+                stagedPath = self.stager.Use(job)
+                if stagedPath != None:
+                    job.argv = [stagedPath if argument == job.sourcePath else argument for argument in job.argv]
+            job.runner = JobRunner(job.argv, self.jobTimeout)
+            job.state  = "running"
+            job.startTime = time()
+            if self.journal != None:
+                self.journal.RecordJob('running', job)
+            with self.lock:
+                self.runningJobs.add(job)
+                job.concurrency = len(self.runningJobs)
+            if self.history != None and job.parent == None:
+                prediction = self.history.PredictSeconds(job.preset, job.sizeInMB, job.concurrency)
+                if prediction != None:
+                    job.predictedSeconds = prediction[0]
+            Progress.statuses.Notify('jobStarted', job)
+            logFileName = Handbrake.GetJobLogFile(job)
+            try:
+                if refused:
+                    raise OSError(errno.ENOSPC, "not enough free space for its output")
+                with Handbrake.OpenJobLog(job) as logFile:
+                    def OnOutputLine(line):
+                        progress = Handbrake.ParseProgressLine(line)
+                        if progress == None:
+                            logFile.write(line + "\n")
+                        else:
+                            self.UpdateLiveProgress(job, progress)
+                    with Tracer.Span('Encode', 'worker', {'source' : job.sourcePath, 'sizeInMB' : job.sizeInMB}):
+                        status = job.runner.Run(stderr=logFile, onOutputLine=OnOutputLine)
+            except OSError as error:
+                # the log could not be written, the job fails like any other
+                with self.lock:
+                    print("ERROR: Could not run Handbrake on " + job.sourcePath + ": " + str(error))
+                status = -1
+            job.exitCode = status
 
-            elif sys.platform == 'linux':
-                os.system(item)
+            if refused:
+                job.state = "refused"
+            elif job.runner.cancelled and not job.runner.timedOut:
+                job.state = "cancelled"
+            elif status == 0:
+                job.state = "done"
+            else:
+                job.state = "failed"
+            with Tracer.Span('CommitOutput', 'worker'):
+                job.CommitOutput()
+            if self.admission != None:
+                self.admission.ReleaseOutput(job)
 
             # convert end time to unix timestamp
             endTime = mktime(datetime.now().timetuple())
 
             # in seconds
             duration = int(endTime - startTime)
-            
-            with self.lock:
-                Progress.statuses['VideosCurrent'] -= 1
-                Progress.statuses['VideosCompleted'] += 1
-                
+
+            processedMB = job.sizeInMB
+            if job.parent != None:
+                segment = job
+                job = segment.parent.SegmentFinished(segment, self.admission)
+                if job == None:
+                    if self.summaryLog != None:
+                        self.summaryLog.RecordJob(segment, logFileName, segment.parent.job)
+                    accounted = True
+                    self.AccountForFinishedSegment(segment)
+                    return
+                duration = int(time() - segment.parent.startTime)
+                job.reportedMB = segment.reportedMB # what is left to count is the rest of the last segment
+                job.finished.set()
+                with self.lock:
+                    self.runningJobs.discard(segment)
+                if self.summaryLog != None:
+                    self.summaryLog.RecordJob(segment, logFileName, job)
+                    self.summaryLog.RecordJob(job, startTime=segment.parent.startTime)
+            elif self.summaryLog != None:
+                self.summaryLog.RecordJob(job, logFileName)
+
+            if self.journal != None and job.state != "cancelled":
+                self.journal.RecordJob(job.state, job)
+            accounted = True
+            self.AccountForFinishedJob(job, duration, processedMB)
+        finally:
+            if not accounted:
+                # something raised before the job was accounted for, it is not running any more either
+                with self.lock:
+                    self.runningJobs.discard(started)
+                Progress.statuses.Increment('VideosCurrent', -1)
+                if self.admission != None:
+                    self.admission.ReleaseOutput(started)
+
+    def UpdateLiveProgress(self, job, progress, reportInterval=0.5):
+        """ Stores a parsed Handbrake progress line on the job and, at most every reportInterval seconds,
+            refreshes the batch wide in-progress megabytes, live throughput and time remaining. """
+        job.percent, job.fps, job.averageFps, job.eta = progress
+        now = time()
+        if now - job.lastReport < reportInterval:
+            return
+        job.lastReport = now
+        if self.autotuner != None:
+            processedMB = job.sizeInMB * job.percent / 100
+            self.autotuner.AddProcessedMegabytes(processedMB - job.reportedMB)
+            job.reportedMB = processedMB
+        with self.lock:
+            self.__RefreshLiveStatistics(now)
+        Progress.statuses.Notify('jobProgress', job)
+
+    def __RefreshLiveStatistics(self, now):
+        """ Sums the live progress of the running jobs into the statistics. Call with the lock held. """
+        inProgressMB = 0.0
+        speedInMBperSecond = 0.0
+        for running in self.runningJobs:
+            doneMB = running.sizeInMB * running.percent / 100
+            inProgressMB += doneMB
+            if running.startTime != None and now > running.startTime:
+                speedInMBperSecond += doneMB / (now - running.startTime)
+        # ProcessingSpeedInGBperHour stays the speed measured on finished videos
+        Progress.statuses.Update({'InProgressMB' : inProgressMB, 'LiveSpeedInMBperSecond' : speedInMBperSecond})
+        Progress.statuses['TimeRemaining'] = Progress.CalculateTimeRemaining()
+
+    def AccountForFinishedSegment(self, segment):
+        """ A segment that is not the last one of its video only counts towards the processed megabytes. """
+        if self.autotuner != None:
+            self.autotuner.AddProcessedMegabytes(max(0.0, segment.sizeInMB - segment.reportedMB))
+        with self.lock:
+            self.runningJobs.discard(segment)
+            Progress.statuses.Update(increments={'VideosCurrent' : -1, 'ProcessedSoFarInMB' : segment.sizeInMB})
+            self.__RefreshLiveStatistics(time())
+
+    def AccountForFinishedJob(self, job, duration, processedMB=None):
+        """ Records a finished job (duration in seconds) in the manifest, autotuner and progress statistics.
+            processedMB is what is left to count of the job, its last segment when it was split. """
+        if processedMB == None:
+            processedMB = job.sizeInMB
+        if job.state == "done" and self.manifest != None:
+            self.manifest.RecordConversion(job)
+        if job.state == "done" and self.history != None and job.concurrency > 0:
+            # split videos and videos encoded elsewhere say nothing about a single encode on this machine
+            self.history.RecordJob(job, time() - job.startTime)
+        if self.autotuner != None:
+            self.autotuner.AddProcessedMegabytes(max(0.0, processedMB - job.reportedMB))
+        if job.state == "done" and self.archiver != None:
+            self.archiver.Submit(job)
+        else:
+            if self.admission != None:
+                self.admission.ReleaseSource(job.sourcePath)
+            if self.stager != None:
+                self.stager.Release(job.sourcePath)
+
+        with self.lock:
+            self.runningJobs.discard(job)
+            Progress.statuses.Update(increments={'VideosCurrent' : -1,
+                                                 'VideosCompleted' : 1,
+                                                 'VideosFailed' : 0 if job.state in ("done", "refused") else 1,
+                                                 'VideosRefused' : 1 if job.state == "refused" else 0,
+                                                 'ProcessedSoFarInMB' : processedMB})
+
+            if job.state == "done":
+                self.convertedSources.append(job.sourcePath)
                 #calculate rate of processing using the size of the just completed video
-                Progress.statuses['ProcessedSoFarInMB'] = Progress.statuses['ProcessedSoFarInMB'] + \
-                                                          Progress.statuses['ListOfVidsAndSizesInMB'][item]
-                Progress.statuses['ProcessingSpeedInGBperHour'] = Progress.CalculateGBperHour(item, duration, self.NumberOfThreads)
-                Progress.statuses['TimeRemaining'] = Progress.CalculateTimeRemaining()                
-                Progress.statuses['StatusesHaveChanged'] = True
-
-    def PopulateQueue(self, commandsAndSizes, activeQueue):
-        """Populate the work queue with data"""
-        self.CommandAndSizes = commandsAndSizes
-        for command in commandsAndSizes:
-            activeQueue.put(command)        
+                Progress.statuses['ProcessingSpeedInGBperHour'] = Progress.CalculateGBperHour(job.sizeInMB, duration, self.NumberOfThreads)
+            if self.history != None and Progress.statuses['EtaPrediction']:
+                Progress.statuses['EtaPrediction'] = dict(Progress.statuses['EtaPrediction'], measuredError=self.history.MeasuredError())
+            self.__RefreshLiveStatistics(time())
+        Progress.statuses.Notify('jobFinished', job)
+
+    def CloseRecords(self):
+        """ Closes the job summary log and the manifest and throughput history databases once the pool is done. """
+        for records in (self.summaryLog, self.manifest, self.history):
+            if records != None:
+                records.Close()
+
+    def CancelAll(self):
+        """ Drops every job still waiting in the queue and cancels the ones that are running. """
+        retireTokens = []
+        while True:
+            try:
+                priority, job = self.activeQueue.get_nowait()
+            except Empty:
+                break
+            if job == None:
+                # keep retire tokens, the pool still has to shrink
+                retireTokens.append((priority, job))
+                continue
+            job.state = "cancelled"
+            job.finished.set()
+            self.activeQueue.task_done()
+        for token in retireTokens:
+            self.activeQueue.put(token)
+            self.activeQueue.task_done()
+        if self.admission != None:
+            self.admission.Cancel()
+        with self.lock:
+            runningJobs = list(self.runningJobs)
+        for job in runningJobs:
+            job.runner.Cancel()
+
+    def QueueJob(self, job, activeQueue):
+        """ Hands a single job to the workers, ordered by the active scheduling policy. """
+        if self.journal != None:
+            self.journal.RecordJob('queued', job)
+        Progress.statuses.Notify('jobQueued', job)
+        segments = [job]
+        if self.segmenter != None:
+            segments = self.segmenter.Split(job, self.NumberOfThreads)
+        for segment in segments:
+            priority = self.scheduler.Priority(segment)
+            if self.stager != None:
+                self.stager.Add(priority, segment)
+            activeQueue.put((priority, segment))
+
+    def PopulateQueue(self, jobs, activeQueue):
+        """Populate the work queue with data. jobs may be a generator, each job is handed to the workers as soon as it is produced.
+           Returns once the last job has finished."""
+        sizes = []
+        preset = ""
+        for job in jobs:
+            self.QueueJob(job, activeQueue)
+            sizes.append(job.sizeInMB)
+            preset = job.preset
+        prediction = None
+        if self.history != None and len(sizes) > 0:
+            prediction = self.history.PredictBatch(preset, sizes, self.NumberOfThreads)
+        with self.lock:
+            Progress.statuses['PredictedMakespanInMB'] = JobScheduler.ComparePolicies(sizes, self.NumberOfThreads)
+            if prediction != None:
+                Progress.statuses['EtaPrediction'] = {'seconds' : prediction[0],
+                                                      'errorSeconds' : prediction[1],
+                                                      'measuredError' : self.history.MeasuredError()}
         activeQueue.join()
+        return len(sizes)
 
 class ProcessMovies():
     archiveDirectory = ""
@@ -626,42 +2966,51 @@ class ProcessMovies():
         if Params['videoTypes'] != None:            
             cliParameters['videoTypes'] = Params['videoTypes']
         
-        self.GetFilesAndFileStats(cliParameters)
-        
         archivingResult = self.Start(useGUI = True, cliParameters=cliParameters)
         
         return archivingResult # normal completion = 0, insufficient space = -1
 
 
-    def GetFilesAndFileStats(self, cliParameters):
+    def GenerateJobs(self, cliParameters, manifest=None, resumeList=(), journaledSources=()):
+        """ Generator, scans the source tree and yields a VideoJob for each video as soon as it is found.
+            Videos the manifest already lists as converted are skipped. A resumed batch passes the (path, sizeInMB,
+            modifiedTime) of its interrupted videos, which come first, and the sources its journal lists, which the
+            scan then leaves out. """
         fm = FileManip()
-        listOfSourceVideos = fm.GetFileList(cliParameters['sourceDir'], cliParameters['videoTypes'].split(','), cliParameters['maxNumberOfVideosToProcess'])
-        self.listOfSourceVideos = listOfSourceVideos
+        hb = Handbrake()
+        self.listOfSourceVideos = []
+        maxNumberOfVideos = int(cliParameters['maxNumberOfVideosToProcess'] or 0)
+        scanResults = fm.ScanForVideos(cliParameters['sourceDir'], cliParameters['videoTypes'].split(','),
+                                       excludeDirectories=(cliParameters['destinationDir'], cliParameters['archiveDir']))
+        scanResults = itertools.chain(resumeList, (result for result in scanResults if result[0] not in journaledSources))
+
+        for job in hb.CreateJobs(scanResults, cliParameters['sourceDir'], cliParameters['destinationDir']):
+            if not self.__AdmitJob(job, manifest):
+                continue
+            yield job
+            if maxNumberOfVideos > 0 and len(self.listOfSourceVideos) >= maxNumberOfVideos:
+                return
+
+    def __AdmitJob(self, job, manifest):
+        """ Private method, filters out already converted videos and registers the rest for progress tracking. """
+        if manifest != None and manifest.IsConverted(job):
+            Progress.statuses.Increment('VideosSkipped')
+            return False
+        Progress.statuses.Update(increments={'TotalSizeInMB' : job.sizeInMB, 'VideosTotal' : 1})
+        self.listOfSourceVideos.append(job.sourcePath)
+        return True
+
+    @Tracer.Traced('GetFilesAndFileStats', 'scan')
+    def GetFilesAndFileStats(self, cliParameters):
+        """ Scans the whole source tree up front and returns the list of VideoJobs, or 0 when there is nothing to do. """
+        listOfJobs = list(self.GenerateJobs(cliParameters))
 
-        if len(listOfSourceVideos) == 0:
+        if len(listOfJobs) == 0:
             Progress.statuses['NoVideoFilesFound'] = True
-            return 0
-        
-        for idx in range(0, len(listOfSourceVideos)):
-            if '\"' in listOfSourceVideos[idx]:
-                Progress.statuses['InvalidQuotingInFileName'] = True
-                del listOfSourceVideos[idx]
-                if len(listOfSourceVideos) == 0:            
-                    return 0
-
-        hb = Handbrake()    
-        commandsAndSizes = hb.CreateListOfCommandStrings(listOfSourceVideos, cliParameters['destinationDir'])
-        listOfCommands = []
-        
-        for command in commandsAndSizes:
-            listOfCommands.append(command)
-            (Progress.statuses['ListOfVidsAndSizesInMB'])[command] = commandsAndSizes[command]
-            
-        if len(listOfCommands) == 0:
             cliParameters['ProcessingComplete'] = True
             cliParameters['ProcessingCompleteStatus'] = "No videos found at given source location."
-            return
-        return commandsAndSizes
+            return 0
+        return listOfJobs
 
 
     def Start(self, useGUI=False, cliParameters=None):
@@ -673,38 +3022,225 @@ class ProcessMovies():
             #Gathers command line arguments if ManageHD.py is called directly from the CLI                
             cliParameters = self.__ProcessParameters()
         
-        fm = FileManip()
-        listOfSourceVideos = fm.GetFileList(cliParameters['sourceDir'], cliParameters['videoTypes'].split(','), cliParameters['maxNumberOfVideosToProcess'])        
-        commandsAndSizes = self.GetFilesAndFileStats(cliParameters)
-        
-        if commandsAndSizes == 0:
+        manifest = ConversionManifest()
+        manifest.LoadEntries()
+        q = PriorityQueue()
+        t = self.__CreateThreadPool(cliParameters, q, manifest)
+
+        Progress.statuses['StartTime'] = datetime.now()
+
+        if cliParameters.get('watchSettleSeconds', 0) > 0:
+            return self.Watch(cliParameters, t, q, manifest)
+
+        t.journal = JobJournal()
+        t.journal.Begin(cliParameters)
+
+        # Encoding starts with the first video found, while the rest of the tree is still being scanned
+        return self.__RunBatch(cliParameters, t, q, self.GenerateJobs(cliParameters, manifest))
+
+    def Resume(self):
+        """ Picks up the batch recorded in the job journal: videos that were queued or running when it stopped are
+            converted again from scratch, finished ones are only archived. The source directory is scanned again for
+            the videos the journal does not list, not scanned yet or not flushed when the batch stopped. """
+        self.__CheckForHandbrake()
+        journal = JobJournal()
+        batch, journaledJobs, finished = journal.Replay()
+        if batch == None or finished:
+            print("")
+            print("There is no interrupted batch to resume.")
+            print("")
             return 1
-        
-        q = Queue()
+
+        cliParameters = batch['cliParameters']
+        Progress.statuses['HandbrakeOptionsString'] = batch['HandbrakeOptionsString']
+        Progress.statuses['OutputExtension'] = batch['OutputExtension']
+        hb = Handbrake()
+        resumeList = []
+        alreadyConverted = []
+        for sourcePath, record in journaledJobs.items():
+            if record['event'] == 'done':
+                job = VideoJob(sourcePath, record['sizeInMB'], record['modifiedTime'])
+                job.destinationPath = record['destinationPath']
+                alreadyConverted.append(job)
+                continue
+            if record['event'] == 'failed' or not os.path.exists(sourcePath):
+                continue
+            # an interrupted encode leaves a partial file (or partial segments) behind
+            temporaryPath = hb.GetTemporaryPath(record['destinationPath'])
+            temporaryPrefix = os.path.splitext(os.path.basename(temporaryPath))[0]
+            if os.path.isdir(os.path.dirname(temporaryPath)):
+                for entry in os.scandir(os.path.dirname(temporaryPath)):
+                    if entry.name.startswith(temporaryPrefix):
+                        os.remove(entry.path)
+            resumeList.append((sourcePath, record['sizeInMB'], record['modifiedTime']))
+
+        manifest = ConversionManifest()
+        manifest.LoadEntries()
+        q = PriorityQueue()
+        t = self.__CreateThreadPool(cliParameters, q, manifest)
+        for job in alreadyConverted:
+            t.convertedSources.append(job.sourcePath)
+            if t.archiver != None:
+                t.archiver.Submit(job)
+        t.journal = journal
+        journal.Continue()
+        Progress.statuses['StartTime'] = datetime.now()
+        return self.__RunBatch(cliParameters, t, q, self.GenerateJobs(cliParameters, manifest, resumeList, journaledJobs))
+
+    def __CreateThreadPool(self, cliParameters, activeQueue, manifest):
+        """ Private method, starts the worker pool (and autotuner) configured by the parameters. """
+        if cliParameters.get('traceFile', ""):
+            # before the workers start, their first wait for a job is traced too
+            Tracer.Start(cliParameters['traceFile'])
         t = Threads()
+        t.scheduler = JobScheduler(cliParameters.get('schedulingPolicy', 'lpt'))
         numThreads = 4
         if sys.platform == 'win32':
             numThreads = 1
-        t.CreateThreadPool(q, numThreads)
+        numberOfWorkers = cliParameters.get('numberOfWorkers', 0)
+        calibration = FileManip().ReadCalibration().get(Handbrake.GetPresetName(Progress.statuses['HandbrakeOptionsString']), {})
+        if numberOfWorkers != 'auto' and int(numberOfWorkers) > 0:
+            numThreads = int(numberOfWorkers)
+        elif calibration:
+            # also where the autotuner starts its search
+            numThreads = HostCalibration.BestWorkers(calibration)
+        Progress.statuses['CalibratedGBperHour'] = HostCalibration.Throughput(calibration, numThreads)
+        t.manifest = manifest
+        if float(cliParameters.get('jobTimeoutInMinutes', 0)) > 0:
+            t.jobTimeout = float(cliParameters['jobTimeoutInMinutes']) * 60
+        t.history = ThroughputHistory()
+        t.history.LoadHistory()
+        if int(cliParameters.get('segmentThresholdInMB', 0)) > 0:
+            t.segmenter = SegmentedEncoder(int(cliParameters['segmentThresholdInMB']))
+        t.CreateThreadPool(activeQueue, numThreads)
+        t.metrics = MetricsExporter.FromParameters(cliParameters)
+        t.summaryLog = JobSummaryLog()
+        if cliParameters['archiveDir']:
+            t.archiver = ArchivePipeline(cliParameters['archiveDir'], cliParameters['sourceDir'],
+                                         ArchiveCopier.FromParameters(cliParameters), cliParameters.get('archiveMode', 'move'))
+            t.archiver.Start()
+        admissionMargin = str(cliParameters.get('admissionMarginInGB', ""))
+        if admissionMargin != "off":
+            marginInMB = None
+            if admissionMargin != "":
+                marginInMB = float(admissionMargin) * 1024
+            t.admission = StorageAdmission(cliParameters['destinationDir'], cliParameters['archiveDir'], cliParameters['sourceDir'],
+                                           t.history, marginInMB)
+        if t.archiver != None:
+            t.archiver.admission = t.admission
+        if cliParameters.get('stagingDir', ""):
+            budgetInMB = None
+            if float(cliParameters.get('stagingBudgetInGB', 0)) > 0:
+                budgetInMB = float(cliParameters['stagingBudgetInGB']) * 1024
+            t.stager = SourceStager(cliParameters['stagingDir'], int(cliParameters.get('stagingLookAhead', 0)) or numThreads,
+                                    budgetInMB)
+            t.stager.Start()
+            if t.archiver != None:
+                t.archiver.stager = t.stager
+        if numberOfWorkers == 'auto':
+            t.autotuner = ConcurrencyAutotuner(t)
+            t.autotuner.Start()
+        return t
 
-        Progress.statuses['StartTime'] = datetime.now()
+    def __RunBatch(self, cliParameters, t, q, jobs):
+        """ Private method, converts the jobs, waits for the last one and archives the sources. """
+        try:
+            try:
+                jobCount = t.PopulateQueue(jobs, q)
+            except KeyboardInterrupt:
+                # cancelled videos are not journaled as finished, resume converts them again
+                t.CancelAll()
+                q.join()
+                if t.autotuner != None:
+                    t.autotuner.Stop()
+                if t.archiver != None:
+                    t.archiver.Finish()
+                if t.stager != None:
+                    t.stager.Close()
+                raise
+            if t.autotuner != None:
+                t.autotuner.Stop()
 
-        t.PopulateQueue(commandsAndSizes, q)     
+            if jobCount == 0 and len(t.convertedSources) == 0:
+                if Progress.statuses['VideosSkipped'] == 0:
+                    Progress.statuses['NoVideoFilesFound'] = True
+                else:
+                    Progress.statuses['BatchStatus'] = 'Nothing New To Convert'
+                if t.archiver != None:
+                    t.archiver.Finish()
+                if t.stager != None:
+                    t.stager.Close()
+                if t.journal != None:
+                    t.journal.End()
+                Progress.SignalBatchComplete()
+                return 1
 
-        cliParameters['ProcessingComplete'] = True
-        
-        #Do not continue unless processing is complete
-        while True:
-            sleep(1)
-            if Progress.statuses['TimeRemaining'] == 'Done':
-                break
+            # PopulateQueue only returns after the last encode has exited
+            cliParameters['ProcessingComplete'] = True
+            Progress.statuses.Update({'TimeRemaining' : 'Done', 'EndTime' : datetime.now()})
+                
+            #Sources were archived as their videos finished, wait for the last ones
+            archiveResult = 0
+            if t.archiver != None:
+                archiveResult = t.archiver.Finish()
+            if t.stager != None:
+                t.stager.Close()
+            if t.journal != None:
+                t.journal.End()
+            Progress.SignalBatchComplete()
             
-        #Archive videos
-        archiveResult = Progress.ArchiveSourceVideo(cliParameters['archiveDir'], cliParameters['sourceDir'], 
-                                cliParameters['destinationDir'], listOfSourceVideos)
-        
-        return archiveResult # normal = 0, insufficient drive space = -1        
+            return archiveResult # normal = 0, insufficient drive space = -1        
+        finally:
+            t.CloseRecords()
+            if t.metrics != None:
+                t.metrics.Stop()
+            Tracer.Stop()
     
+    def Watch(self, cliParameters, threads, activeQueue, manifest, stopEvent=None):
+        """ Long running mode, keeps feeding settled new videos from the source directory to the running thread pool.
+            Sources are archived as soon as they are converted. Runs until stopEvent is set or the user presses Ctrl+C,
+            then waits for the queued videos and their archiving. """
+        hb = Handbrake()
+        self.listOfSourceVideos = []
+        if stopEvent == None:
+            stopEvent = threading.Event()
+        watcher = WatchFolder(cliParameters['sourceDir'], cliParameters['videoTypes'].split(','),
+                              excludeDirectories=(cliParameters['destinationDir'], cliParameters['archiveDir']),
+                              settleSeconds=cliParameters['watchSettleSeconds'])
+
+        def QueueSettledVideo(path, sizeInMB, modifiedTime):
+            for job in hb.CreateJobs([(path, sizeInMB, modifiedTime)], cliParameters['sourceDir'], cliParameters['destinationDir']):
+                if self.__AdmitJob(job, manifest):
+                    threads.QueueJob(job, activeQueue)
+
+        try:
+            try:
+                watcher.Watch(QueueSettledVideo, stopEvent)
+            except KeyboardInterrupt:
+                stopEvent.set()
+            # the videos already queued are still converted, a second Ctrl+C cancels them
+            try:
+                activeQueue.join()
+            except KeyboardInterrupt:
+                threads.CancelAll()
+                activeQueue.join()
+            archiveResult = 0
+            if threads.archiver != None:
+                archiveResult = threads.archiver.Finish()
+            if threads.stager != None:
+                # no worker or archive transfer reads the staged copies any more
+                threads.stager.Close()
+            return archiveResult
+        finally:
+            threads.CloseRecords()
+            if threads.metrics != None:
+                threads.metrics.Stop()
+            Tracer.Stop()
+
+    def ParseCommandLine(self):
+        """ Gathers the command line parameters (s=, d=, a= ...) the same way Start does. """
+        return self.__ProcessParameters()
+
     def __ProcessParameters(self):
         """ Private method, gathers and adds defaults where necessary to the command line parameters"""
         if sys.argv[0][-3:] == ".py":
@@ -715,14 +3251,30 @@ class ProcessMovies():
 
         if len(arguments) == 0 or arguments[0] == "-h" or \
                arguments[0] == "h" or arguments[0] == "--h":
-            __helpMessageCLI()
+            self.__helpMessageCLI()
             sys.exit()
             
         cliParameters = {'sourceDir' : None, \
                          'archiveDir' : None, \
                          'destinationDir' : None, \
                          'maxNumberOfVideosToProcess' : 0, \
-                         'videoTypes' : ""
+                         'videoTypes' : "", \
+                         'watchSettleSeconds' : 0, \
+                         'jobTimeoutInMinutes' : 0, \
+                         'schedulingPolicy' : "lpt", \
+                         'numberOfWorkers' : 0, \
+                         'segmentThresholdInMB' : 0, \
+                         'metricsPort' : "", \
+                         'metricsDirectory' : "", \
+                         'traceFile' : "", \
+                         'archiveTransfers' : 1, \
+                         'archiveLimitInMBperSecond' : 0, \
+                         'archiveVerify' : "1", \
+                         'archiveMode' : "move", \
+                         'stagingDir' : "", \
+                         'stagingLookAhead' : 0, \
+                         'stagingBudgetInGB' : 0, \
+                         'admissionMarginInGB' : ""
                         }            
         try:
             while arguments[0] == "":
@@ -737,11 +3289,43 @@ class ProcessMovies():
                 if argument[0]+argument[1] == "d=": cliParameters['destinationDir'] = argument[2:]
                 if argument[0]+argument[1] == "m=": cliParameters['maxNumberOfVideosToProcess']  = int(argument[2:])
                 if argument[0]+argument[1] == "v=": cliParameters['videoTypes']     = argument[2:]
+                if argument[0]+argument[1] == "w=": cliParameters['watchSettleSeconds'] = int(argument[2:])
+                if argument[0]+argument[1] == "j=": cliParameters['jobTimeoutInMinutes'] = float(argument[2:])
+                if argument[0]+argument[1] == "o=": cliParameters['schedulingPolicy'] = argument[2:]
+                if argument[0]+argument[1] == "n=": cliParameters['numberOfWorkers'] = argument[2:]
+                if argument[0]+argument[1] == "g=": cliParameters['segmentThresholdInMB'] = int(argument[2:])
+                if argument[0]+argument[1] == "p=": cliParameters['metricsPort'] = argument[2:]
+                if argument[0]+argument[1] == "e=": cliParameters['metricsDirectory'] = argument[2:]
+                if argument[0]+argument[1] == "r=": cliParameters['traceFile'] = argument[2:]
+                if argument[0]+argument[1] == "k=": cliParameters['archiveTransfers'] = int(argument[2:])
+                if argument[0]+argument[1] == "l=": cliParameters['archiveLimitInMBperSecond'] = float(argument[2:])
+                if argument[0]+argument[1] == "y=": cliParameters['archiveVerify'] = argument[2:]
+                if argument[0]+argument[1] == "b=": cliParameters['archiveMode'] = argument[2:]
+                if argument[0]+argument[1] == "i=": cliParameters['stagingDir'] = argument[2:]
+                if argument[0]+argument[1] == "f=": cliParameters['stagingLookAhead'] = int(argument[2:])
+                if argument[0]+argument[1] == "u=": cliParameters['stagingBudgetInGB'] = float(argument[2:])
+                if argument[0]+argument[1] == "x=": cliParameters['admissionMarginInGB'] = argument[2:]
                 if argument[0]+argument[1] != "s=" and \
                    argument[0]+argument[1] != "a=" and \
                    argument[0]+argument[1] != "d=" and \
                    argument[0]+argument[1] != "m=" and \
                    argument[0]+argument[1] != "v=" and \
+                   argument[0]+argument[1] != "w=" and \
+                   argument[0]+argument[1] != "j=" and \
+                   argument[0]+argument[1] != "o=" and \
+                   argument[0]+argument[1] != "n=" and \
+                   argument[0]+argument[1] != "g=" and \
+                   argument[0]+argument[1] != "p=" and \
+                   argument[0]+argument[1] != "e=" and \
+                   argument[0]+argument[1] != "r=" and \
+                   argument[0]+argument[1] != "k=" and \
+                   argument[0]+argument[1] != "l=" and \
+                   argument[0]+argument[1] != "y=" and \
+                   argument[0]+argument[1] != "b=" and \
+                   argument[0]+argument[1] != "i=" and \
+                   argument[0]+argument[1] != "f=" and \
+                   argument[0]+argument[1] != "u=" and \
+                   argument[0]+argument[1] != "x=" and \
                    argument[0]+argument[1] != None and \
                    argument[0]+argument[1] != "":
                     print("")
@@ -781,23 +3365,80 @@ class ProcessMovies():
         print("Changes the resolution of 1080p (or i) video files to 720.")
         print("Requires the HandbrakeCLI to be installed (rev5474 or above).")
         print("")
-        print("python ManageHD.py s=<video dir> a=<archive dir> t=<target dir> [c=...] [v=...]")
+        print("python ManageHD.py s=<video dir> a=<archive dir> t=<target dir> [c=...] [v=...] [w=...] [j=...] [o=...] [n=...] [g=...] [p=...] [e=...] [r=...] [k=...] [l=...] [y=...] [b=...]")
+        print("                   [i=...] [f=...] [u=...] [x=...]")
         print("")
         print("    s=   Source directory for videos.")
         print("    a=   Archive directory that original 1080p(i?) videos will be moved to.")
         print("    d=   Destination path that the converted videos will be placed in.")
         print("    c=   Optional. Maximum number of videos to convert. Default is all.")
         print("    v=   Optional. Format mkv, mp4...etc. Default is mkv,mp4,ogm,avi. No spaces.")
+        print("    w=   Optional. Keep running and convert new videos as they appear in the source")
+        print("         directory, once they have not changed for the given number of seconds.")
+        print("    j=   Optional. Minutes a single video may take to convert before it is stopped and counted")
+        print("         as failed. Default is no limit.")
+        print("    o=   Optional. Order videos are converted in, lpt (largest first) or fifo. Default is lpt.")
+        print("    n=   Optional. Number of videos converted at once, or auto to measure the best")
+        print("         number for this machine while the batch runs. Default is 4 (1 on Windows).")
+        print("    g=   Optional. Videos of this many MB or more are split in time ranges encoded at the")
+        print("         same time and joined afterwards. Needs mkvmerge or ffmpeg. Default is off.")
+        print("    p=   Optional. Serve Prometheus metrics at http://127.0.0.1:<port>/metrics. Use")
+        print("         <host>:<port> to listen on another address.")
+        print("    e=   Optional. Directory of node_exporter's textfile collector, managehd.prom is")
+        print("         kept up to date there.")
+        print("    r=   Optional. Record where the time goes (scan, stat, queue waits, encodes, archiving)")
+        print("         and write it to the given file as a Chrome trace (chrome://tracing, Perfetto).")
+        print("    k=   Optional. Number of sources copied to an archive on another drive at once. Default is 1.")
+        print("    l=   Optional. Limit, in MB/s, for all copies to an archive on another drive together.")
+        print("    y=   Optional. y=0 skips verifying the checksum of archive copies, letting the kernel")
+        print("         copy them instead. Default is to verify.")
+        print("    b=   Optional. How sources are archived: move (default), hardlink or reflink. hardlink and")
+        print("         reflink leave the source in place and link or clone it into the archive, which takes")
+        print("         no copying on the same filesystem (reflink needs btrfs, XFS... on Linux).")
+        print("    i=   Optional. Fast local directory the sources of the next videos are copied to ahead of")
+        print("         their turn, for sources on a slow network share. Default is to read them in place.")
+        print("    f=   Optional. Number of sources copied ahead with i=. Default is one per worker.")
+        print("    u=   Optional. GB of the i= directory staged sources may take. Default is half its free space.")
+        print("    x=   Optional. GB always kept free on the destination and archive drives, a video only starts")
+        print("         once its output fits besides. Default is 1. x=off starts videos without checking.")
+        print("")
+        print("    Ctrl+C cancels the videos being converted, resume picks them up again later.")
+        print("")
+        print("python ManageHD.py resume")
+        print("")
+        print("    Finishes a batch that was interrupted (crash, reboot...) where it stopped.")
+        print("")
+        print("python ManageHD.py calibrate <sample video> [maximum number of videos at once]")
+        print("")
+        print("    Measures how fast this machine converts with each preset, with 1, 2, 4... videos at once.")
+        print("    Batches then start with the best number of videos at once (unless n= is given) and know")
+        print("    the time remaining before the first video is done.")
         print("")
         print("")
     
+    def Calibrate(self, sampleVideo, maxWorkers=None):
+        """ Measures and stores the throughput of every preset on this machine, see HostCalibration. """
+        self.__CheckForHandbrake()
+        if not os.path.isfile(sampleVideo):
+            print("")
+            print("ERROR: Sample video " + sampleVideo + " does not exist.")
+            print("")
+            return 1
+        print("Calibrating with " + sampleVideo + ":")
+        calibration = HostCalibration(sampleVideo, maxWorkers=maxWorkers).Run()
+        for presetName in sorted(calibration):
+            bestWorkers = HostCalibration.BestWorkers(calibration[presetName])
+            print(presetName + ": best with " + str(bestWorkers) + " at once, " +
+                  '%.2f' % calibration[presetName][bestWorkers] + " GB/hour")
+        return 0 if len(calibration) == len(Handbrake.presets) else 1
+
     def __CheckForHandbrake(self):
         if sys.platform[:5] == "win32":
             self.__CheckForHandbrakeOnWindows()
         elif sys.platform[:5] == "linux":
             #Not win32? Probably linix or *nix varient branch to here
             self.__CheckForHandbrakeOnLinux()
-        elif sys.platform[:3] == "OSX":
+        elif sys.platform[:6] == "darwin":
             self.__CheckForHandbrakeOnMac()
         
     def __CheckForHandbrakeOnWindows(self):
@@ -808,15 +3449,33 @@ class ProcessMovies():
             print("       HandbrakeCLI is required for this software to work.")
             sys.exit()
     
-    def __CheckForHandbrakeOnLinux(self): # Not Implemented
-        pass
+    def __CheckForHandbrakeOnLinux(self):
+        handbrakePath = Handbrake.GetHandBrakeCLIPath()
+        if shutil.which(handbrakePath) == None:
+            print("")
+            print("ERROR: HandbrakeCLI (" + handbrakePath + ") is either not in the 'path' or is not installed.")
+            print("       HandbrakeCLI is required for this software to work.")
+            sys.exit()
     
-    def __CheckForHandbrakeOnMac(self): # Not Implemented
-        pass
+    def __CheckForHandbrakeOnMac(self):
+        self.__CheckForHandbrakeOnLinux()
          
 # ########################### #
 # Main Sentinel In Place Here #
 if __name__ == "__main__":
     pm = ProcessMovies()
-    pm.Start()
+    if len(sys.argv) > 2 and sys.argv[1] == "calibrate":
+        maxWorkers = None
+        if len(sys.argv) > 3:
+            maxWorkers = int(sys.argv[3])
+        sys.exit(pm.Calibrate(sys.argv[2], maxWorkers))
+    try:
+        if len(sys.argv) > 1 and sys.argv[1] == "resume":
+            pm.Resume()
+        else:
+            pm.Start()
+    except KeyboardInterrupt:
+        print("")
+        print("Cancelled. 'python ManageHD.py resume' converts the rest of the batch.")
+        sys.exit(130)
 # ########################### #
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3.4
+
+# #########################################################################
+# This file is part of ManageHD.
+#
+# ManageHD is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ManageHD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ManageHD.  If not, see <http://www.gnu.org/licenses/>.
+# #########################################################################
+
+import sys
+import os
+import json
+import math
+import random
+import shutil
+import tempfile
+import threading
+from time import time
+from ManageHD import ProcessMovies, Progress, FileManip, JobScheduler, ConversionManifest, JobSummaryLog
+
+# ######################################################################################################################################
+# Measures the engine without Handbrake or real videos: a stand-in HandBrakeCLI sleeps in proportion to the size of its
+# input while printing Handbrake's progress lines, and libraries of sparse files take the place of the videos.
+# Reports scan time, makespan against the ideal one, worker utilization, ETA error and archive time for every
+# scheduling policy, so regressions show up and policies can be compared offline.
+#
+#     python3 ManageHD_Bench.py l=100000 b=200 n=4 x=2000
+#
+class FakeHandbrake():
+    """ Stand-in HandBrakeCLI, installed through MANAGEHD_HANDBRAKECLI. An encode takes startupSeconds plus the input
+        size over mbPerSecond, varied by up to +/- jitter (the same way every run for the same input, so policies are
+        compared on identical work), and leaves a sparse output of outputRatio times the input size. """
+    script = r'''#!{python}
+import os, sys, time, random
+arguments = sys.argv[1:]
+def Option(name, default=None):
+    if name in arguments and arguments.index(name) + 1 < len(arguments):
+        return arguments[arguments.index(name) + 1]
+    return default
+source = Option("-i")
+sizeInMB = os.path.getsize(source) / 1048576.0
+durationInSeconds = max(60, int(sizeInMB * float(os.environ["MANAGEHD_FAKEHB_SECONDSOFVIDEOPERMB"])))
+if "--scan" in arguments:
+    sys.stderr.write("+ title 1:\n  + duration: %02d:%02d:%02d\n" % (durationInSeconds // 3600, durationInSeconds // 60 % 60, durationInSeconds % 60))
+    sys.exit(0)
+fraction = 1.0
+if Option("--stop-at") != None:
+    fraction = min(1.0, int(Option("--stop-at").split(":")[1]) / float(durationInSeconds))
+output = Option("-o")
+jitter = float(os.environ["MANAGEHD_FAKEHB_JITTER"])
+variation = 1 + jitter * (2 * random.Random(source + str(Option("--start-at"))).random() - 1)
+encodeSeconds = (sizeInMB * fraction / float(os.environ["MANAGEHD_FAKEHB_MBPERSECOND"])) * variation
+frames = durationInSeconds * fraction * 25
+sys.stderr.write("[bench] hb_init: starting libhb thread\n[bench] job configuration: %s\n" % " ".join(arguments))
+time.sleep(float(os.environ["MANAGEHD_FAKEHB_STARTUPSECONDS"]))
+started = time.time()
+interval = min(0.25, max(0.02, encodeSeconds / 20))
+while True:
+    elapsed = time.time() - started
+    percent = min(100.0, 100 * elapsed / encodeSeconds) if encodeSeconds > 0 else 100.0
+    fps = frames / encodeSeconds if encodeSeconds > 0 else 0.0
+    left = int(max(0, encodeSeconds - elapsed))
+    sys.stdout.write("\rEncoding: task 1 of 1, %.2f %% (%.2f fps, avg %.2f fps, ETA %02dh%02dm%02ds)" % (percent, fps, fps, left // 3600, left // 60 % 60, left % 60))
+    sys.stdout.flush()
+    if percent >= 100:
+        break
+    time.sleep(min(interval, encodeSeconds - elapsed))
+with open(output, "wb") as outputFile:
+    outputFile.truncate(int(sizeInMB * fraction * float(os.environ["MANAGEHD_FAKEHB_OUTPUTRATIO"]) * 1048576))
+sys.stdout.write("\nEncode done!\n")
+sys.stderr.write("[bench] libhb: work result = 0\nHandBrake has exited.\n")
+'''
+
+    def __init__(self, directory, mbPerSecond=2000.0, jitter=0.1, outputRatio=0.4, startupSeconds=0.05,
+                 secondsOfVideoPerMB=0.4):
+        """ FakeHandbrake class constructor. """
+        self.fileName            = os.path.join(directory, "HandBrakeCLI")
+        self.mbPerSecond         = mbPerSecond
+        self.jitter              = jitter
+        self.outputRatio         = outputRatio
+        self.startupSeconds      = startupSeconds
+        self.secondsOfVideoPerMB = secondsOfVideoPerMB
+
+    def Install(self):
+        """ Writes the stand-in and points the engine (and the Handbrake processes it starts) at it. """
+        with open(self.fileName, "w") as scriptFile:
+            scriptFile.write(self.script.replace("{python}", sys.executable))
+        os.chmod(self.fileName, 0o755)
+        os.environ['MANAGEHD_HANDBRAKECLI']               = self.fileName
+        os.environ['MANAGEHD_FAKEHB_MBPERSECOND']         = str(self.mbPerSecond)
+        os.environ['MANAGEHD_FAKEHB_JITTER']              = str(self.jitter)
+        os.environ['MANAGEHD_FAKEHB_OUTPUTRATIO']         = str(self.outputRatio)
+        os.environ['MANAGEHD_FAKEHB_STARTUPSECONDS']      = str(self.startupSeconds)
+        os.environ['MANAGEHD_FAKEHB_SECONDSOFVIDEOPERMB'] = str(self.secondsOfVideoPerMB)
+
+    def EncodeSeconds(self, sizeInMB):
+        """ Seconds the stand-in needs for a video of the given size, leaving the jitter out. """
+        return self.startupSeconds + sizeInMB / self.mbPerSecond
+
+class SyntheticLibrary():
+    """ A tree of sparse files looking like a video library: sizes are log-normally distributed around
+        medianSizeInMB (a few huge videos among many average ones) and spread over sub directories. Sparse files
+        cost no disk space, so libraries of 100k videos can be generated in seconds. """
+    def __init__(self, directory, fileCount, medianSizeInMB=1500, sigma=0.8, filesPerDirectory=250, seed=1):
+        """ SyntheticLibrary class constructor. """
+        self.directory         = directory
+        self.fileCount         = fileCount
+        self.medianSizeInMB    = medianSizeInMB
+        self.sigma             = sigma
+        self.filesPerDirectory = filesPerDirectory
+        self.seed              = seed
+        self.sizes             = {} # path -> size in MB
+
+    def Create(self):
+        """ Generates the library. Returns the list of file sizes in MB. """
+        generator = random.Random(self.seed)
+        for index in range(self.fileCount):
+            shelf = os.path.join(self.directory, "shelf-{:04d}".format(index // self.filesPerDirectory))
+            if index % self.filesPerDirectory == 0:
+                os.makedirs(shelf, exist_ok=True)
+            sizeInMB = max(1, int(generator.lognormvariate(math.log(self.medianSizeInMB), self.sigma)))
+            path = os.path.join(shelf, "video-{:06d}.mkv".format(index))
+            with open(path, "wb") as video:
+                video.truncate(sizeInMB * 1024 * 1024)
+            self.sizes[path] = sizeInMB
+        return list(self.sizes.values())
+
+    def Restore(self, archiveDirectory):
+        """ Moves the videos a batch archived back into the library. """
+        for directory, subDirectories, fileNames in os.walk(archiveDirectory):
+            for fileName in fileNames:
+                archived = os.path.join(directory, fileName)
+                os.renames(archived, os.path.join(self.directory, os.path.relpath(archived, archiveDirectory)))
+
+class Benchmark():
+    """ Runs the measurements inside workDirectory, which also receives the manifest, history and logs of the runs. """
+    sampleSeconds = 0.5 # how often the time remaining is sampled for the ETA error
+
+    def __init__(self, workDirectory, handbrake, batchSize=100, numWorkers=4, medianSizeInMB=1500):
+        """ Benchmark class constructor. """
+        self.workDirectory     = workDirectory
+        self.handbrake         = handbrake
+        self.numWorkers        = numWorkers
+        self.sourceDirectory   = os.path.join(workDirectory, "source")
+        self.destinationDir    = os.path.join(workDirectory, "converted")
+        self.archiveDirectory  = os.path.join(workDirectory, "archive")
+        self.library           = SyntheticLibrary(self.sourceDirectory, batchSize, medianSizeInMB)
+        self.sizes             = []
+
+    def Prepare(self):
+        """ Installs the stand-in Handbrake and generates the library every batch converts. """
+        os.makedirs(self.workDirectory, exist_ok=True)
+        os.chdir(self.workDirectory)
+        self.handbrake.Install()
+        self.sizes = self.library.Create()
+
+    def MeasureScan(self, fileCount):
+        """ Times FileManip.ScanForVideos over a library of fileCount videos, cold (first walk after creating it)
+            and warm. Returns a dict of the results. """
+        library = SyntheticLibrary(os.path.join(self.workDirectory, "scan"), fileCount, seed=2)
+        library.Create()
+        fm = FileManip()
+        result = {'files' : fileCount}
+        for run in ('firstScanSeconds', 'secondScanSeconds'):
+            started = time()
+            found = sum(1 for video in fm.ScanForVideos(library.directory, ['mkv']))
+            result[run] = time() - started
+        result['found'] = found
+        result['filesPerSecond'] = fileCount / max(result['secondScanSeconds'], 1e-9)
+        shutil.rmtree(library.directory)
+        return result
+
+    def RunBatch(self, policy):
+        """ Converts and archives the library once with the given scheduling policy. Returns a dict of the results. """
+        self.library.Restore(self.archiveDirectory)
+        os.makedirs(self.archiveDirectory, exist_ok=True)
+        shutil.rmtree(self.destinationDir, ignore_errors=True)
+        os.makedirs(self.destinationDir)
+        manifest = ConversionManifest()
+        with manifest.connection:
+            manifest.connection.execute('DELETE FROM converted')
+        manifest.Close()
+        logDirectory = os.path.join(self.workDirectory, "logs", "{}-{}".format(policy, int(time() * 1000)))
+        os.environ['MANAGEHD_LOGDIR'] = logDirectory
+        Progress.ResetStatuses()
+
+        cliParameters = {'sourceDir' : self.sourceDirectory, \
+                         'archiveDir' : self.archiveDirectory, \
+                         'destinationDir' : self.destinationDir, \
+                         'maxNumberOfVideosToProcess' : 0, \
+                         'videoTypes' : "mkv", \
+                         'schedulingPolicy' : policy, \
+                         'numberOfWorkers' : self.numWorkers, \
+                         'segmentThresholdInMB' : 0, \
+                         'metricsPort' : "", \
+                         'metricsDirectory' : "", \
+                         'traceFile' : ""
+                        }
+        etaSamples = []
+        batchCompletedAt = []
+
+        def OnEngineEvent(event, subject):
+            if event == 'batchComplete':
+                batchCompletedAt.append(time())
+
+        def SampleTimeRemaining():
+            while not Progress.batchComplete.wait(self.sampleSeconds):
+                if Progress.statuses['EndTime'] != "":
+                    return
+                minutesRemaining = Progress.CalculateMinutesRemaining()[0]
+                if minutesRemaining != None:
+                    etaSamples.append((time(), minutesRemaining * 60))
+
+        Progress.Subscribe(OnEngineEvent)
+        sampler = threading.Thread(target=SampleTimeRemaining)
+        sampler.daemon = True
+        sampler.start()
+        try:
+            ProcessMovies().Start(useGUI=True, cliParameters=cliParameters)
+        finally:
+            Progress.Unsubscribe(OnEngineEvent)
+        sampler.join()
+
+        statuses = Progress.statuses.Snapshot()
+        startTime = statuses['StartTime'].timestamp()
+        endTime = statuses['EndTime'].timestamp()
+        makespan = endTime - startTime
+        idealMakespan = JobScheduler.MakespanLowerBound([self.handbrake.EncodeSeconds(size) for size in self.sizes],
+                                                        self.numWorkers)
+        archived = sum(len(fileNames) for directory, subDirectories, fileNames in os.walk(self.archiveDirectory))
+        return {'policy' : policy,
+                'workers' : self.numWorkers,
+                'videos' : statuses['VideosCompleted'],
+                'failed' : statuses['VideosFailed'],
+                'archived' : archived,
+                'makespanSeconds' : makespan,
+                'idealMakespanSeconds' : idealMakespan,
+                'efficiency' : idealMakespan / makespan if makespan > 0 else None,
+                'utilization' : self.BusySeconds(logDirectory) / (self.numWorkers * makespan) if makespan > 0 else None,
+                'etaError' : self.EtaError(etaSamples, endTime),
+                'archiveSeconds' : batchCompletedAt[0] - endTime if batchCompletedAt else None}
+
+    def Check(self, results):
+        """ Sanity checks of the results, a benchmark of a broken engine means nothing. Returns the list of problems
+            found, empty when there are none. """
+        problems = []
+        scan = results['scan']
+        if scan != None and scan['found'] != scan['files']:
+            problems.append("the scan found {} of {} videos".format(scan['found'], scan['files']))
+        for batch in results['batches']:
+            name = batch['policy'] + " batch"
+            if batch['videos'] != self.library.fileCount or batch['failed'] != 0:
+                problems.append("{}: {} of {} videos converted, {} failed".format(name, batch['videos'],
+                                self.library.fileCount, batch['failed']))
+            if batch['archived'] != self.library.fileCount:
+                problems.append("{}: {} of {} sources archived".format(name, batch['archived'], self.library.fileCount))
+            # the ideal makespan leaves the jitter out, only a faster than possible batch is wrong
+            if batch['efficiency'] == None or batch['efficiency'] > 1 + self.handbrake.jitter:
+                problems.append("{}: makespan {:.2f}s against an ideal of {:.2f}s".format(name,
+                                batch['makespanSeconds'], batch['idealMakespanSeconds']))
+            if batch['utilization'] == None or batch['utilization'] > 1:
+                problems.append("{}: worker utilization {}".format(name, FormatPercent(batch['utilization'])))
+        return problems
+
+    @staticmethod
+    def BusySeconds(logDirectory):
+        """ Adds up the time the workers spent running Handbrake, from the jobs.jsonl of a run. A video split into
+            segments is counted through its segments only. """
+        records = []
+        with open(os.path.join(logDirectory, JobSummaryLog.fileName)) as summaryFile:
+            for line in summaryFile:
+                records.append(json.loads(line))
+        splitVideos = set(record['segmentOf'] for record in records if 'segmentOf' in record)
+        return sum(record['wallSeconds'] or 0 for record in records if record['destination'] not in splitVideos)
+
+    def EtaError(self, etaSamples, endTime):
+        """ Mean and worst relative error of the sampled time remaining against the time the batch really took. """
+        errors = []
+        for sampledAt, secondsRemaining in etaSamples:
+            actualSeconds = endTime - sampledAt
+            if actualSeconds >= self.sampleSeconds:
+                errors.append(abs(secondsRemaining - actualSeconds) / actualSeconds)
+        if len(errors) == 0:
+            return None
+        return {'mean' : sum(errors) / len(errors), 'worst' : max(errors), 'samples' : len(errors)}
+
+def FormatPercent(fraction):
+    """ Formats a fraction as a percentage, '-' when it could not be measured. """
+    if fraction == None:
+        return "-"
+    return '%.1f' % (100 * fraction) + "%"
+
+def PrintReport(results):
+    """ Prints the benchmark results as a table. """
+    scan = results['scan']
+    if scan != None:
+        print("Scan of " + str(scan['files']) + " videos: " + '%.2f' % scan['firstScanSeconds'] + " s first, " +
+              '%.2f' % scan['secondScanSeconds'] + " s second (" + str(int(scan['filesPerSecond'])) + " files/s)")
+    print("")
+    print("{:<8}{:>8}{:>12}{:>12}{:>12}{:>13}{:>12}{:>12}{:>10}".format("policy", "workers", "makespan", "ideal",
+          "efficiency", "utilization", "eta error", "eta worst", "archive"))
+    for batch in results['batches']:
+        etaError = batch['etaError'] or {}
+        print("{:<8}{:>8}{:>11.2f}s{:>11.2f}s{:>12}{:>13}{:>12}{:>12}{:>9}s".format(batch['policy'], batch['workers'],
+              batch['makespanSeconds'], batch['idealMakespanSeconds'], FormatPercent(batch['efficiency']),
+              FormatPercent(batch['utilization']), FormatPercent(etaError.get('mean')),
+              FormatPercent(etaError.get('worst')),
+              '%.2f' % batch['archiveSeconds'] if batch['archiveSeconds'] != None else "-"))
+
+def UsageMessage():
+    print("")
+    print("python ManageHD_Bench.py [l=<videos to scan>] [b=<videos per batch>] [n=<workers>] [o=<policies>]")
+    print("                         [x=<fake MB/second>] [j=<jitter>] [r=<repeats>] [w=<work dir>] [f=<json file>]")
+    print("")
+    print("    l= size of the library the scan is timed on (default 10000, 0 to skip the scan)")
+    print("    b= videos in the library every batch converts (default 100)")
+    print("    n= concurrent encodes (default 4)")
+    print("    o= comma separated scheduling policies to compare (default " + ",".join(JobScheduler.policies) + ")")
+    print("    x= megabytes per second the fake Handbrake converts (default 2000)")
+    print("    j= random variation of the encode times, 0.1 is +/- 10% (default 0.1)")
+    print("    r= batches per policy, later ones see the throughput history of the earlier ones (default 1)")
+    print("    w= work directory, kept afterwards (default a temporary directory that is removed)")
+    print("    f= also write the results to this JSON file")
+    print("")
+
+def ParseParameters(arguments):
+    """ Reads the x=value parameters, returns None when one is not recognized. """
+    parameters = {'l' : "10000", 'b' : "100", 'n' : "4", 'o' : ",".join(JobScheduler.policies),
+                  'x' : "2000", 'j' : "0.1", 'r' : "1", 'w' : "", 'f' : ""}
+    for argument in arguments:
+        if len(argument) < 2 or argument[1] != "=" or argument[0] not in parameters:
+            print("")
+            print("Unrecognized parameter: " + argument)
+            return None
+        parameters[argument[0]] = argument[2:]
+    return parameters
+
+# ########################### #
+# Main Sentinel In Place Here #
+if __name__ == "__main__":
+    parameters = ParseParameters(sys.argv[1:])
+    if parameters == None or "-h" in sys.argv:
+        UsageMessage()
+        sys.exit(1)
+    workDirectory = parameters['w'] or tempfile.mkdtemp(prefix="ManageHD-bench-")
+    reportFile = os.path.abspath(parameters['f']) if parameters['f'] else ""
+    bench = Benchmark(os.path.abspath(workDirectory), FakeHandbrake(os.path.abspath(workDirectory),
+                      mbPerSecond=float(parameters['x']), jitter=float(parameters['j'])),
+                      batchSize=int(parameters['b']), numWorkers=int(parameters['n']))
+    try:
+        bench.Prepare()
+        results = {'scan' : None, 'batches' : []}
+        if int(parameters['l']) > 0:
+            results['scan'] = bench.MeasureScan(int(parameters['l']))
+        for repeat in range(int(parameters['r'])):
+            for policy in parameters['o'].split(","):
+                results['batches'].append(bench.RunBatch(policy.strip()))
+        PrintReport(results)
+        results['problems'] = bench.Check(results)
+        if reportFile:
+            with open(reportFile, "w") as jsonFile:
+                json.dump(results, jsonFile, indent=2)
+        for problem in results['problems']:
+            print("FAILED: " + problem)
+    finally:
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        if not parameters['w']:
+            shutil.rmtree(workDirectory, ignore_errors=True)
+    if results['problems']:
+        sys.exit(2)
+# ########################### #
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3.4
+
+# #########################################################################
+# This file is part of ManageHD.
+#
+# ManageHD is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ManageHD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ManageHD.  If not, see <http://www.gnu.org/licenses/>.
+# #########################################################################
+
+import sys
+import os
+import json
+import socket
+import socketserver
+import select
+import threading
+import itertools
+import heapq
+from time import sleep, time
+from datetime import datetime
+from ManageHD import ProcessMovies, Progress, Handbrake, Threads, VideoJob, JobRunner, \
+     JobScheduler, JobJournal, ConversionManifest, MetricsExporter, JobSummaryLog, ArchivePipeline, \
+     ArchiveCopier
+
+# ######################################################################################################################################
+# Spreads a batch over several machines. Sources and destination must be on storage shared by every machine,
+# mounted at the same path.
+#
+#     On the machine that owns the batch (workers are not authenticated, --host opens it to a trusted network):
+#         python3 ManageHD_Cluster.py coordinator 5455 --host 0.0.0.0 s=/mnt/vids/new d=/mnt/vids/720 a=/mnt/vids/archive
+#
+#     On every machine lending its cores (3 concurrent encodes here):
+#         python3 ManageHD_Cluster.py worker coordinator-host:5455 3
+#
+# Protocol: one JSON object per line over TCP, the worker always speaks first.
+#     worker      -> {"op" : "hello", "host" : ..., "slots" : ...}
+#     worker      -> {"op" : "request"}
+#     coordinator -> {"op" : "job", "id" : ..., "argv" : [...], ...} | {"op" : "wait", "seconds" : ...} | {"op" : "shutdown"}
+#     worker      -> {"op" : "progress", "id" : ..., "elapsed" : ..., "percent" : ...}   (while encoding, no reply)
+#     worker      -> {"op" : "result", "id" : ..., "exitCode" : ..., "elapsed" : ...}
+# A leased job goes back to the queue once its lease expires: leaseSeconds without progress or result from the
+# worker holding it, whether it disconnected (and cancelled its encode) or hangs.
+# #####################################################################################################################################
+
+class Coordinator():
+    """ Owns the job list of a batch and leases jobs to ClusterWorkers connecting over TCP. """
+    waitSeconds  = 2 # how long a worker idles when nothing can be handed out yet
+    leaseSeconds = 60 # a lease not renewed by progress for this long expires, several ClusterWorker.progressSeconds
+
+    def __init__(self, cliParameters, host='127.0.0.1', port=5455):
+        """ Coordinator class constructor. Workers are not authenticated: only listen on other addresses than the
+            loopback one on a network where every machine may be trusted with the batch. """
+        self.cliParameters = cliParameters
+        self.host          = host
+        self.port          = port
+        self.condition     = threading.Condition()
+        self.pending       = [] # heap of (priority, job id)
+        self.jobs          = {} # job id -> VideoJob
+        self.leased        = {} # job id -> (worker name, time the lease was last renewed)
+        self.jobIds        = itertools.count(1)
+        self.scanComplete  = False
+        self.threads       = Threads()
+        self.server        = None
+        self.connections   = set() # sockets of the connected workers
+
+    def Run(self):
+        """ Scans the source directory, serves jobs until every one of them is finished, then archives.
+            Ctrl+C cancels the batch, see Cancel(). """
+        try:
+            pm = ProcessMovies()
+            manifest = ConversionManifest()
+            manifest.LoadEntries()
+            self.threads.manifest  = manifest
+            self.threads.scheduler = JobScheduler(self.cliParameters.get('schedulingPolicy', 'lpt'))
+            self.threads.journal   = JobJournal()
+            self.threads.journal.Begin(self.cliParameters)
+            self.threads.metrics   = MetricsExporter.FromParameters(self.cliParameters)
+            if self.cliParameters['archiveDir']:
+                self.threads.archiver = ArchivePipeline(self.cliParameters['archiveDir'], self.cliParameters['sourceDir'],
+                                                        ArchiveCopier.FromParameters(self.cliParameters),
+                                                        self.cliParameters.get('archiveMode', 'move'))
+                self.threads.archiver.Start()
+            Progress.statuses['StartTime'] = datetime.now()
+
+            self.server = CoordinatorServer((self.host, self.port), CoordinatorRequestHandler)
+            self.server.coordinator = self
+            serverThread = threading.Thread(target=self.server.serve_forever)
+            serverThread.daemon = True
+            serverThread.start()
+
+            sizes = []
+            for job in pm.GenerateJobs(self.cliParameters, manifest):
+                self.threads.journal.RecordJob('queued', job)
+                sizes.append(job.sizeInMB)
+                with self.condition:
+                    jobId = next(self.jobIds)
+                    self.jobs[jobId] = job
+                    heapq.heappush(self.pending, (self.threads.scheduler.Priority(job), jobId))
+                    self.condition.notify_all()
+
+            with self.condition:
+                self.scanComplete = True
+                Progress.statuses['PredictedMakespanInMB'] = JobScheduler.ComparePolicies(sizes, max(1, self.threads.NumberOfThreads))
+                while self.pending or self.leased:
+                    self.condition.wait(self.leaseSeconds / 4)
+                    self.__ExpireLeases()
+
+            self.server.shutdown()
+            self.server.server_close()
+            Progress.statuses.Update({'TimeRemaining' : 'Done', 'EndTime' : datetime.now()})
+            archiveResult = 0
+            if self.threads.archiver != None:
+                archiveResult = self.threads.archiver.Finish()
+            self.threads.journal.End()
+            Progress.SignalBatchComplete()
+            return archiveResult
+        except KeyboardInterrupt:
+            # cancelled videos are not journaled as finished, resume converts them again
+            self.Cancel()
+            if self.threads.archiver != None:
+                self.threads.archiver.Finish()
+            raise
+        finally:
+            self.threads.CloseRecords()
+            if self.threads.metrics != None:
+                self.threads.metrics.Stop()
+
+    def Cancel(self):
+        """ Stops serving and cancels every job, leased or not. Closing the worker connections makes the workers
+            cancel their encodes and remove their partial output. """
+        if self.server != None:
+            self.server.shutdown()
+            self.server.server_close()
+        with self.condition:
+            self.scanComplete = True
+            leasedJobs = [self.jobs[jobId] for jobId in self.leased]
+            cancelledJobs = leasedJobs + [self.jobs[jobId] for priority, jobId in self.pending]
+            self.pending = []
+            self.leased = {}
+            connections = list(self.connections)
+            self.condition.notify_all()
+        with Threads.lock:
+            for job in leasedJobs:
+                self.threads.runningJobs.discard(job)
+        Progress.statuses.Increment('VideosCurrent', -len(leasedJobs))
+        for job in cancelledJobs:
+            job.state = "cancelled"
+            job.finished.set()
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass # already gone
+
+    def WorkerJoined(self, slots, connection):
+        """ A worker connection counts as slots workers in the progress statistics. """
+        with self.condition:
+            self.threads.NumberOfThreads += slots
+            self.connections.add(connection)
+
+    def WorkerLeft(self, slots, connection):
+        """ A worker connection closed. Its jobs keep their leases until they expire: its encode may still be writing
+            the temporary file for a moment, a new lease must not start another one on the same file. """
+        with self.condition:
+            self.threads.NumberOfThreads -= slots
+            self.connections.discard(connection)
+            self.condition.notify_all()
+
+    def __ExpireLeases(self):
+        """ Private method, puts the jobs whose lease expired back in the queue. Call with the condition held. """
+        now = time()
+        for jobId, (workerName, renewed) in list(self.leased.items()):
+            if now - renewed < self.leaseSeconds:
+                continue
+            del self.leased[jobId]
+            job = self.jobs[jobId]
+            job.state = "queued"
+            job.percent = 0.0
+            job.reportedMB = 0.0
+            heapq.heappush(self.pending, (self.threads.scheduler.Priority(job), jobId))
+            with Threads.lock:
+                self.threads.runningJobs.discard(job)
+            Progress.statuses.Increment('VideosCurrent', -1)
+
+    def LeaseJob(self, workerName):
+        """ Returns the reply to a worker's request for work. """
+        with self.condition:
+            self.__ExpireLeases()
+            if not self.pending:
+                if self.scanComplete and not self.leased:
+                    return {'op' : 'shutdown'}
+                return {'op' : 'wait', 'seconds' : self.waitSeconds}
+            priority, jobId = heapq.heappop(self.pending)
+            job = self.jobs[jobId]
+            job.state = "running"
+            self.leased[jobId] = (workerName, time())
+        job.startTime = time()
+        self.threads.journal.RecordJob('running', job)
+        with Threads.lock:
+            self.threads.runningJobs.add(job)
+        Progress.statuses.Increment('VideosCurrent')
+        return {'op' : 'job',
+                'id' : jobId,
+                'argv' : job.argv,
+                'sourcePath' : job.sourcePath,
+                'destinationPath' : job.destinationPath,
+                'temporaryPath' : job.temporaryPath,
+                'sizeInMB' : job.sizeInMB,
+                'modifiedTime' : job.modifiedTime}
+
+    def JobProgress(self, workerName, jobId, elapsed, percent=None):
+        """ Renews the lease of a job still encoding. """
+        with self.condition:
+            if self.leased.get(jobId, ("", 0))[0] != workerName:
+                return
+            self.leased[jobId] = (workerName, time())
+            job = self.jobs[jobId]
+        if percent != None:
+            self.threads.UpdateLiveProgress(job, (percent, None, None, None), reportInterval=0)
+
+    def JobFinished(self, workerName, jobId, exitCode, elapsed):
+        """ Accounts for a job the worker reports as finished (its output is already renamed or removed).
+            Results of an expired lease are ignored, the job is someone else's by now. """
+        with self.condition:
+            if self.leased.get(jobId, ("", 0))[0] != workerName:
+                return
+            del self.leased[jobId]
+            job = self.jobs[jobId]
+        job.exitCode = exitCode
+        job.state = "done" if exitCode == 0 else "failed"
+        self.threads.journal.RecordJob(job.state, job)
+        self.threads.AccountForFinishedJob(job, int(elapsed))
+        job.finished.set()
+        with self.condition:
+            self.condition.notify_all()
+
+class CoordinatorServer(socketserver.ThreadingTCPServer):
+    """ One thread per worker connection. """
+    daemon_threads      = True
+    allow_reuse_address = True
+
+class CoordinatorRequestHandler(socketserver.StreamRequestHandler):
+    """ Speaks the line based JSON protocol with one worker connection. """
+    def handle(self):
+        coordinator = self.server.coordinator
+        workerName = "{}:{}".format(*self.client_address[:2])
+        slots = 0
+        try:
+            for line in self.rfile:
+                message = json.loads(line.decode('utf-8'))
+                reply = None
+                if message['op'] == 'hello':
+                    workerName = "{} ({})".format(message.get('host', workerName), workerName)
+                    slots = int(message.get('slots', 1))
+                    coordinator.WorkerJoined(slots, self.connection)
+                elif message['op'] == 'request':
+                    reply = coordinator.LeaseJob(workerName)
+                elif message['op'] == 'progress':
+                    coordinator.JobProgress(workerName, message['id'], message.get('elapsed', 0), message.get('percent'))
+                elif message['op'] == 'result':
+                    coordinator.JobFinished(workerName, message['id'], message['exitCode'], message.get('elapsed', 0))
+                if reply != None:
+                    self.wfile.write((json.dumps(reply) + "\n").encode('utf-8'))
+                    self.wfile.flush()
+                    if reply['op'] == 'shutdown':
+                        break
+        except (OSError, ValueError):
+            pass
+        finally:
+            coordinator.WorkerLeft(slots, self.connection)
+
+class ClusterWorker():
+    """ Pulls jobs from a Coordinator and runs them with the local HandbrakeCLI, slots at a time. """
+    progressSeconds = 10 # interval between progress reports of a running job
+    pollSeconds     = 1  # interval between checks that the coordinator is still there
+
+    def __init__(self, host, port, slots=1):
+        """ ClusterWorker class constructor. """
+        self.host       = host
+        self.port       = port
+        self.slots      = slots
+        self.summaryLog = JobSummaryLog() # on this machine, next to the Handbrake logs of its jobs
+
+    def Run(self):
+        """ Opens one connection per slot and returns when the coordinator has no more work. """
+        connections = []
+        for slot in range(self.slots):
+            thread = threading.Thread(target=self.Serve)
+            thread.start()
+            connections.append(thread)
+        for thread in connections:
+            thread.join()
+
+    def Serve(self):
+        """ Request, run, report, until the coordinator says shutdown or goes away. """
+        try:
+            connection = socket.create_connection((self.host, self.port))
+        except OSError:
+            print("Could not connect to the coordinator at {}:{}".format(self.host, self.port))
+            return
+        sendLock = threading.Lock()
+        def IsClosed():
+            """ The coordinator says nothing while a job runs, anything to read then is the connection closing. """
+            try:
+                return bool(select.select([connection], [], [], 0)[0]) and connection.recv(1, socket.MSG_PEEK) == b""
+            except OSError:
+                return True
+        try:
+            with connection, connection.makefile('rb') as reader, connection.makefile('wb') as writer:
+                def Send(message):
+                    with sendLock:
+                        writer.write((json.dumps(message) + "\n").encode('utf-8'))
+                        writer.flush()
+                Send({'op' : 'hello', 'host' : socket.gethostname(), 'slots' : 1})
+                while True:
+                    Send({'op' : 'request'})
+                    line = reader.readline()
+                    if not line:
+                        break
+                    reply = json.loads(line.decode('utf-8'))
+                    if reply['op'] == 'shutdown':
+                        break
+                    if reply['op'] == 'wait':
+                        sleep(reply['seconds'])
+                        continue
+                    exitCode, elapsed = self.RunJob(reply, Send, IsClosed)
+                    Send({'op' : 'result', 'id' : reply['id'], 'exitCode' : exitCode, 'elapsed' : elapsed})
+        except (OSError, ValueError):
+            pass # the coordinator went away
+
+    def RunJob(self, message, Send, IsClosed=None):
+        """ Encodes one leased job, reporting progress while it runs. Returns (exit code, seconds taken).
+            The encode is cancelled as soon as IsClosed() tells the coordinator closed the connection. """
+        job = VideoJob(message['sourcePath'], message['sizeInMB'], message['modifiedTime'])
+        job.destinationPath = message['destinationPath']
+        job.temporaryPath   = message['temporaryPath']
+        # the coordinator's HandbrakeCLI location means nothing here
+        job.argv = [Handbrake.GetHandBrakeCLIPath()] + message['argv'][1:]
+        os.makedirs(os.path.dirname(job.destinationPath), exist_ok=True)
+        job.runner = JobRunner(job.argv)
+
+        startTime = time()
+        job.startTime = startTime
+        job.concurrency = self.slots
+        encoder = threading.Thread(target=self.__Encode, args=(job,))
+        encoder.start()
+        lastReport = startTime
+        try:
+            while not job.finished.wait(self.pollSeconds):
+                if IsClosed != None and IsClosed():
+                    raise OSError("the coordinator closed the connection")
+                if time() - lastReport >= self.progressSeconds:
+                    lastReport = time()
+                    Send({'op' : 'progress', 'id' : message['id'], 'elapsed' : lastReport - startTime, 'percent' : job.percent})
+        except (OSError, ValueError):
+            # the coordinator is gone and hands the job out again once the lease expires, stop writing to its file
+            job.runner.Cancel()
+            encoder.join()
+            job.state = "cancelled"
+            job.CommitOutput()
+            raise
+        encoder.join()
+        job.state = "done" if job.exitCode == 0 else "failed"
+        job.CommitOutput()
+        if job.state != "done" and job.exitCode == 0:
+            job.exitCode = -1 # the rename failed
+        self.summaryLog.RecordJob(job, Handbrake.GetJobLogFile(job))
+        return job.exitCode, time() - startTime
+
+    def __Encode(self, job):
+        try:
+            with Handbrake.OpenJobLog(job) as logFile:
+                def OnOutputLine(line):
+                    progress = Handbrake.ParseProgressLine(line)
+                    if progress != None:
+                        job.percent, job.fps, job.averageFps, job.eta = progress
+                    else:
+                        logFile.write(line + "\n")
+                job.exitCode = job.runner.Run(stderr=logFile, onOutputLine=OnOutputLine)
+        finally:
+            job.finished.set()
+
+def UsageMessage():
+    print("")
+    print("python ManageHD_Cluster.py coordinator <port> [--host <address>] s=<video dir> d=<target dir> [a=...] [v=...] [m=...] [o=...] [k=...] [l=...] [b=...]")
+    print("python ManageHD_Cluster.py worker <coordinator host>:<port> [concurrent encodes]")
+    print("")
+    print("    --host   Address the coordinator listens on. Default is 127.0.0.1, only workers on the")
+    print("             same machine can connect. Workers are not authenticated, only use 0.0.0.0 or")
+    print("             another address on a trusted network.")
+    print("")
+
+# ########################### #
+# Main Sentinel In Place Here #
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "coordinator":
+        port = int(sys.argv[2])
+        host = '127.0.0.1'
+        if len(sys.argv) >= 5 and sys.argv[3] == "--host":
+            host = sys.argv[4]
+            del sys.argv[3:5]
+        sys.argv = [sys.argv[0]] + sys.argv[3:]
+        try:
+            Coordinator(ProcessMovies().ParseCommandLine(), host=host, port=port).Run()
+        except KeyboardInterrupt:
+            print("")
+            print("Cancelled. 'python ManageHD.py resume' converts the rest of the batch on this machine.")
+            sys.exit(130)
+    elif len(sys.argv) >= 3 and sys.argv[1] == "worker":
+        host, port = sys.argv[2].rsplit(":", 1)
+        slots = 1
+        if len(sys.argv) >= 4:
+            slots = int(sys.argv[3])
+        ClusterWorker(host, int(port), slots).Run()
+    else:
+        UsageMessage()
+# ########################### #
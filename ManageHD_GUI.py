@@ -22,14 +22,16 @@ import os
 import string
 import ctypes
 import pygame
+import threading
 from threading import Thread
 from datetime import datetime
-from ManageHD import ProcessMovies, Progress, FileManip
+from ManageHD import ProcessMovies, Progress, FileManip, Handbrake
 from time import sleep
-from PySide.QtCore import Qt, QDateTime, QTimer, SIGNAL, QEvent
+from PySide.QtCore import Qt, QDateTime, QObject, Signal, QEvent, QTimer, QAbstractTableModel, QModelIndex
 from PySide.QtGui import QApplication, QDesktopWidget, QWidget, QLabel, QStatusBar, \
      QMainWindow, QProgressBar, QGridLayout, QIcon, QPushButton, QMessageBox, QLCDNumber, \
-     QAction, QKeySequence, QTextEdit, QWidget, QLineEdit, QFont, QFileDialog
+     QAction, QKeySequence, QTextEdit, QWidget, QLineEdit, QFont, QFileDialog, QTableView, QHeaderView, \
+     QAbstractItemView
 
 class QLineEditNoPeriodsOrCommas(QLineEdit):
     """ Subclassing PySide.QtGui.QLineEdit to add field validation ability """
@@ -104,6 +106,122 @@ class QLineEditDirectoriesOnly(QLineEdit):
         Progress.statuses['DirectoryChanged'] = True
         QLineEdit.focusOutEvent(self, event)
 
+class JobTableModel(QAbstractTableModel):
+    """ One row per video of the batch. Rows only hold the VideoJob, the view asks for the text of the rows it
+        actually shows. Changes are collected and handed to the view in one go, at most every flushInterval ms. """
+    columns       = ('File', 'Size (MB)', 'State', 'Percent', 'FPS', 'ETA')
+    flushInterval = 250
+
+    def __init__(self, parent=None):
+        """ Constructor Function """
+        QAbstractTableModel.__init__(self, parent)
+        self.jobs           = []
+        self.rowOf          = {}    # VideoJob -> row
+        self.groupOf        = {}    # VideoJob split into segments -> its SegmentGroup
+        self.pendingJobs    = []    # queued, not yet inserted
+        self.dirtyRows      = set()
+        self.flushScheduled = False
+
+    def rowCount(self, parent=QModelIndex()): #Override
+        if parent.isValid():
+            return 0
+        return len(self.jobs)
+
+    def columnCount(self, parent=QModelIndex()): #Override
+        if parent.isValid():
+            return 0
+        return len(self.columns)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole): #Override
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.columns[section]
+        return str(section + 1)
+
+    def data(self, index, role=Qt.DisplayRole): #Override
+        if not index.isValid():
+            return None
+        if role == Qt.TextAlignmentRole and index.column() > 0:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        if role != Qt.DisplayRole:
+            return None
+        job = self.jobs[index.row()]
+        column = index.column()
+        if column == 0:
+            return os.path.basename(job.sourcePath)
+        if column == 1:
+            return '%.1f' % job.sizeInMB
+        state, percent, fps, eta = self.__LiveValues(job)
+        if column == 2:
+            return state
+        if column == 3:
+            return '%.1f %%' % percent if state != "queued" else ""
+        if column == 4:
+            return '%.1f' % fps if fps != None else ""
+        if eta == None or state != "running":
+            return ""
+        return "%dh%02dm%02ds" % (eta // 3600, eta % 3600 // 60, eta % 60)
+
+    def __LiveValues(self, job):
+        """ Private method, (state, percent, fps, ETA seconds) of a job, summed over its segments when it was split. """
+        group = self.groupOf.get(job)
+        if group == None or job.state in ("done", "failed", "refused", "cancelled"):
+            percent = 100.0 if job.state == "done" else job.percent
+            return job.state, percent, job.fps, job.eta
+        percents = [100.0 if part.state == "done" else part.percent for part in group.segments]
+        running = [part for part in group.segments if part.state == "running"]
+        fps = sum(part.fps for part in running if part.fps != None) if running else None
+        etas = [part.eta for part in running if part.eta != None]
+        state = "running" if running or any(part.state == "done" for part in group.segments) else "queued"
+        return state, sum(percents) / len(percents), fps, max(etas) if etas else None
+
+    def AddJobs(self, jobs):
+        """ Appends newly queued jobs. """
+        self.pendingJobs.extend(jobs)
+        self.__ScheduleFlush()
+
+    def JobChanged(self, job):
+        """ Marks the row of a job (or of the video a segment belongs to) for repainting. """
+        if job.parent != None:
+            self.groupOf[job.parent.job] = job.parent
+            job = job.parent.job
+        row = self.rowOf.get(job)
+        if row != None:
+            self.dirtyRows.add(row)
+            self.__ScheduleFlush()
+
+    def Clear(self):
+        """ Empties the table for a new batch. """
+        self.beginResetModel()
+        self.jobs = []
+        self.rowOf = {}
+        self.groupOf = {}
+        self.pendingJobs = []
+        self.dirtyRows = set()
+        self.endResetModel()
+
+    def __ScheduleFlush(self):
+        if not self.flushScheduled:
+            self.flushScheduled = True
+            QTimer.singleShot(self.flushInterval, self.Flush)
+
+    def Flush(self):
+        """ Hands the collected changes to the view: one insert for all new rows, one dataChanged for the rest. """
+        self.flushScheduled = False
+        if self.pendingJobs:
+            first = len(self.jobs)
+            self.beginInsertRows(QModelIndex(), first, first + len(self.pendingJobs) - 1)
+            for job in self.pendingJobs:
+                self.rowOf[job] = len(self.jobs)
+                self.jobs.append(job)
+            self.pendingJobs = []
+            self.endInsertRows()
+        if self.dirtyRows:
+            top, bottom = min(self.dirtyRows), max(self.dirtyRows)
+            self.dirtyRows = set()
+            self.dataChanged.emit(self.index(top, 2), self.index(bottom, len(self.columns) - 1))
+
 class MainWindow(QMainWindow):
     """ Starting point of the GUI based application """
     isMyProgressTimer = False
@@ -126,6 +244,16 @@ class MainWindow(QMainWindow):
         self.qlDestinationSpace = QLabel('', self)
         self.qlArcSpace         = QLabel('', self)
         self.qlProcessingSpeed  = QLabel('', self)
+
+        self.jobTableModel      = JobTableModel(self)
+        self.qtvJobs            = QTableView()
+        self.qtvJobs.setModel(self.jobTableModel)
+        self.qtvJobs.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.qtvJobs.setWordWrap(False)
+        # fixed row heights, so the view never measures rows it does not show
+        self.qtvJobs.verticalHeader().setResizeMode(QHeaderView.Fixed)
+        self.qtvJobs.verticalHeader().setDefaultSectionSize(self.qtvJobs.fontMetrics().height() + 6)
+        self.qtvJobs.horizontalHeader().setResizeMode(0, QHeaderView.Stretch)
         
         self.qleSourceDir       = QLineEditDirectoriesOnly()
         self.qleArchiveDir      = QLineEditDirectoriesOnly()
@@ -286,6 +414,8 @@ class MainWindow(QMainWindow):
         g1.addWidget(self.qpbSourceDir,      0, 4,)
         g1.addWidget(self.qpbArchiveDir,     1, 4,)
         g1.addWidget(self.qpbTargetDir,      2, 4,)        
+
+        g1.addWidget(self.qtvJobs,           11, 0, 1, 5)
         self.show
         
     def GetParameterFileInfo(self):
@@ -316,6 +446,7 @@ class MainWindow(QMainWindow):
             self.qlArcSpace.setText(str(self.GetDriveSpace(self.qleArchiveDir.text())))
         self.qlEndTime.setText("")
         self.qlProcessingSpeed.setText("")
+        self.jobTableModel.Clear()
     
     def VerifyRequiredFieldsFilled(self):
         """ Cancels the RUN functionality and informs the user via Message Box if the required fields are not all completed. """
@@ -373,7 +504,6 @@ class MainWindow(QMainWindow):
 
         sleep(1)
         self.qlTimeLeft.setText(Progress.CalculateTimeRemaining())
-        Progress.statuses['StatusesHaveChanged'] = True
         return
 
     def __CreateButton(self, folderIcon, txt, pxSize, actionFunction):
@@ -473,8 +603,8 @@ class MainWindow(QMainWindow):
     
     def stdConversion(self):
         """ Called by the STANDARD menu item under FILE. Sets ManageHD to perform the standard Handbrake conversion. """
-        Progress.statuses['HandbrakeOptionsString'] = str(" -i {0} -o {1} -f mkv --width 1280 --crop 0:0:0:0 --decomb -s 1 -N eng -m --large-file --encoder x264 -q 19 -E ffac3")
-        Progress.statuses['OutputExtension'] = 'mkv'
+        options, extension = Handbrake.presets['stdConversion']
+        Progress.statuses.Update({'HandbrakeOptionsString' : options, 'OutputExtension' : extension})
         self.altAction.setChecked(False)
         if Progress.runPlatform == "win":
             self.altAction.setIcon(QIcon('convert.png'))
@@ -483,8 +613,8 @@ class MainWindow(QMainWindow):
     
     def altConversion(self):
         """ Called by the ALTERNATE menu item under FILE. Sets ManageHD to perform Handbrake conversions using an alternate series of settings. """
-        Progress.statuses['HandbrakeOptionsString'] = str(" -i {0} -o {1} -f mp4 --width 1280 --crop 0:0:0:0 --decomb -s 1 -N eng -m --large-file --encoder x264 -q 19 -E ffac3")
-        Progress.statuses['OutputExtension'] = 'mp4'
+        options, extension = Handbrake.presets['altConversion']
+        Progress.statuses.Update({'HandbrakeOptionsString' : options, 'OutputExtension' : extension})
         self.stdAction.setChecked(False)
         if Progress.runPlatform == "win":
             self.altAction.setIcon(QIcon('checked.jpg'))
@@ -498,41 +628,97 @@ class MainWindow(QMainWindow):
         pass
        
 
-class ProgressUpdateTimer(QWidget):
-    """ Class update progress """    
+class ProgressSignals(QObject):
+    """ Turns engine events, raised on worker threads, into Qt signals delivered on the GUI thread. """
+    statisticsChanged = Signal()
+    jobsQueued        = Signal()
+    jobStarted        = Signal(object)
+    jobProgress       = Signal(object)
+    jobFinished       = Signal(object)
+    batchComplete     = Signal()
+    driveSpaceChecked = Signal(str, str)
+
+    def __init__(self):
+        """ Constructor Function """
+        QObject.__init__(self)
+        self.statisticsPending = threading.Event() # a statisticsChanged signal is queued and not yet handled
+        self.queuedJobsLock    = threading.Lock()
+        self.queuedJobs        = [] # queued jobs not yet taken by the GUI, scanning can queue thousands at once
+
+    def OnEngineEvent(self, event, subject):
+        """ Progress listener, called on whichever thread changed the state. """
+        if event == 'statisticsChanged':
+            # one queued repaint covers any number of changes made before it runs
+            if not self.statisticsPending.is_set():
+                self.statisticsPending.set()
+                self.statisticsChanged.emit()
+        elif event == 'jobQueued':
+            with self.queuedJobsLock:
+                self.queuedJobs.append(subject)
+                emit = len(self.queuedJobs) == 1
+            if emit:
+                self.jobsQueued.emit()
+        elif event == 'jobStarted':
+            self.jobStarted.emit(subject)
+        elif event == 'jobProgress':
+            self.jobProgress.emit(subject)
+        elif event == 'jobFinished':
+            self.jobFinished.emit(subject)
+        elif event == 'batchComplete':
+            self.batchComplete.emit()
+
+    def TakeQueuedJobs(self):
+        """ Returns and forgets the jobs queued since the last call. """
+        with self.queuedJobsLock:
+            jobs, self.queuedJobs = self.queuedJobs, []
+        return jobs
+
+class ProgressUpdateListener(QWidget):
+    """ Class update progress, repaints the statistics whenever the engine reports a change """    
     def __init__(self, main):
         """ Constructor Function """
         QWidget.__init__(self)
         self.target = main
-        timer = QTimer(self)
-        self.connect(timer, SIGNAL("timeout()"), self.UpdateProgressStats)
-        timer.start(100)
+        self.renderedVersion = None # version of the progress statistics on screen
+        self.signals = ProgressSignals()
+        self.signals.statisticsChanged.connect(self.UpdateProgressStats)
+        self.signals.batchComplete.connect(self.__CheckForBatchCompletion)
+        self.signals.driveSpaceChecked.connect(self.__ShowDriveSpace)
+        self.signals.jobsQueued.connect(self.__AddQueuedJobs)
+        self.signals.jobStarted.connect(self.target.jobTableModel.JobChanged)
+        self.signals.jobProgress.connect(self.target.jobTableModel.JobChanged)
+        self.signals.jobFinished.connect(self.target.jobTableModel.JobChanged)
+        Progress.Subscribe(self.signals.OnEngineEvent)
         pygame.init()
 
     def UpdateProgressStats(self):
         """ Function to update the progress statistics """
+        self.signals.statisticsPending.clear()
         self.__CheckForDirectoryChange()
         self.__CheckForExistenceOfVideoFiles()        
         self.__CheckForInvalidQuotingInFileName()
         self.__CheckForInsufficientSpaceOnArchive()
-        self.__CheckForBatchCompletion()
         self.__CheckForChangeInStatistics()
         
     def __CheckForDirectoryChange(self):
         if Progress.statuses['DirectoryChanged']:
+            Progress.statuses['DirectoryChanged'] = False
             Progress.cliParams['sourceDir'] = self.target.qleSourceDir.text()
             Progress.cliParams['archiveDir'] = self.target.qleArchiveDir.text()
             Progress.cliParams['destinationDir'] = self.target.qleDestinationDir.text()
 
     def __CheckForInsufficientSpaceOnArchive(self):
         if Progress.statuses['BatchStatus'] == 'Insufficient Drive Space': #other possible value is 'Completed'    
+            # cleared first, the dialog below keeps handling events and would otherwise ask again
+            Progress.statuses['BatchStatus'] = ""
             boxChoice = QMessageBox.question(self, 'Message',
                     "There is insufficient room on your archive drive. Would you "
                     "like to make room and try again? Selecting 'No' will skip archiving. "
                     , QMessageBox.Yes | 
                     QMessageBox.No, QMessageBox.No)
             if boxChoice == QMessageBox.Yes:
-                Progress.ArchiveSourceVideo(self.qleArchiveDir.text(), self.qleSourceDir.text(), self.qleTargetDir.text())
+                Thread(target=Progress.ArchiveSourceVideo, args=(self.target.qleArchiveDir.text(), self.target.qleSourceDir.text(),
+                                                                 self.target.qleDestinationDir.text())).start()
             
     def __CheckForExistenceOfVideoFiles(self):        
         if Progress.statuses['NoVideoFilesFound'] == True:
@@ -548,58 +734,71 @@ class ProgressUpdateTimer(QWidget):
 
     def __CheckForInvalidQuotingInFileName(self):
         if Progress.statuses['InvalidQuotingInFileName'] != "":
+            Progress.statuses['InvalidQuotingInFileName'] = ""     
             QMessageBox.critical(self, "Invalid Filename", \
                                  "Filename(s) containing a double"
                                  "quote (\") detected, skipping file.", QMessageBox.Ok)
-            Progress.statuses['InvalidQuotingInFileName'] = ""     
 
     def __CheckForBatchCompletion(self):
-        fm = FileManip()
-        if Progress.statuses['VideosCurrent'] == 0 and \
-           Progress.statuses['VideosCompleted'] != 0 and \
-           Progress.statuses['TimeRemaining'] != 'Done':
+        if Progress.batchComplete.is_set() and \
+           (self.target.qlEndTime.text() == "" or self.target.qlEndTime.text() == None):
             self.target.EnableGuiElements()
-            if self.target.qlEndTime.text() == "" or self.target.qlEndTime.text() == None:
-                self.target.qlEndTime.setText(datetime.now().strftime("%a, %d %b %Y %H:%M:%S"))                
+            self.target.qlEndTime.setText(datetime.now().strftime("%a, %d %b %Y %H:%M:%S"))                
+            if Progress.statuses['VideosCompleted'] != 0:
                 self.target.qlTimeLeft.setText('Done')
-                self.target.qlDestinationSpace.setText(str(self.target.GetDriveSpace(self.target.qleDestinationDir.text())))
-                if self.target.qleArchiveDir.text() != "":
-                    self.target.qlArcSpace.setText(str(self.target.GetDriveSpace(self.target.qleArchiveDir.text())))
-                Progress.statuses['TimeRemaining'] = 'Done'
                 pygame.mixer.music.load("ding.mp3")
                 pygame.mixer.music.set_volume(0.3)
                 pygame.mixer.music.play()                        
                 status = Progress.statuses['ProcessingCompleteStatus']
                 if status != None:
                     self.target.DisplayAbnormalTerminationStatus(status)
-                    Progress.statuses['ProcessingCompleteStatus'] = None
-                    Progress.statuses['ProcessingComplete'] = False
-                fm.WriteSettingsFile()
-                
+                    Progress.statuses.Update({'ProcessingCompleteStatus' : None, 'ProcessingComplete' : False})
+                Thread(target=self.__FinishBatchInBackground,
+                       args=(self.target.qleDestinationDir.text(), self.target.qleArchiveDir.text())).start()
+
+    def __FinishBatchInBackground(self, destinationDir, archiveDir):
+        """ Disk space queries and the settings file can block on slow storage, so they stay off the GUI thread. """
+        fm = FileManip()
+        destinationSpace = str(fm.GetDriveSpace(destinationDir))
+        archiveSpace = ""
+        if archiveDir != "":
+            archiveSpace = str(fm.GetDriveSpace(archiveDir))
+        self.signals.driveSpaceChecked.emit(destinationSpace, archiveSpace)
+        fm.WriteSettingsFile()
+
+    def __AddQueuedJobs(self):
+        self.target.jobTableModel.AddJobs(self.signals.TakeQueuedJobs())
 
+    def __ShowDriveSpace(self, destinationSpace, archiveSpace):
+        self.target.qlDestinationSpace.setText(destinationSpace)
+        if archiveSpace != "":
+            self.target.qlArcSpace.setText(archiveSpace)
 
     def __CheckForChangeInStatistics(self):
-        if Progress.statuses['StatusesHaveChanged'] == True:            
-            self.target.qlVidsDone.setText(str(Progress.statuses['VideosCompleted']))
-            self.target.qlVidsInProgress.setText(str(Progress.statuses['VideosCurrent']))
-            self.target.qlStartTime.setText(str(Progress.statuses['StartTime'].strftime("%a, %d %b %Y %H:%M:%S")))
+        statuses = Progress.statuses.Snapshot()
+        if statuses['Version'] != self.renderedVersion:
+            self.target.qlVidsDone.setText(str(statuses['VideosCompleted']))
+            self.target.qlVidsInProgress.setText(str(statuses['VideosCurrent']))
+            self.target.qlStartTime.setText(str(statuses['StartTime'].strftime("%a, %d %b %Y %H:%M:%S")))
             if self.target.qlDestinationSpace.text() == "":
                 self.target.qlProcessingSpeed.setText("0")
-            if Progress.statuses['ProcessingSpeedInGBperHour'] == 0 and \
+            if statuses['ProcessingSpeedInGBperHour'] == 0 and \
                self.target.qlDestinationSpace.text() != "":                  
                 if Progress.cliParams['ProcessingSpeedInGBperHour'] != 0:
                     self.target.qlProcessingSpeed.setText(Progress.cliParams['ProcessingSpeedInGBperHour'])
+                elif statuses['LiveSpeedInMBperSecond'] != 0:
+                    self.target.qlProcessingSpeed.setText('%.1f' % (statuses['LiveSpeedInMBperSecond'] * 3600 / 1024) + " GB/hour so far")
                 else:
                     self.target.qlProcessingSpeed.setText("Calc'd at end of 1st video ...")
             elif self.target.qlDestinationSpace.text() != "":
-                self.target.qlProcessingSpeed.setText('%.1f' % Progress.statuses['ProcessingSpeedInGBperHour'] + " GB/hour")
+                self.target.qlProcessingSpeed.setText('%.1f' % statuses['ProcessingSpeedInGBperHour'] + " GB/hour")
             else:
                 self.target.qlProcessingSpeed.setText("0")
             
-            if Progress.statuses['TimeRemaining'] != 0:                
+            if statuses['TimeRemaining'] != 0:                
                 if self.target.qlTimeLeft.text() != "Done":
-                    self.target.qlTimeLeft.setText(str(Progress.statuses['TimeRemaining']))
-            Progress.statuses['StatusesHaveChanged'] = False
+                    self.target.qlTimeLeft.setText(str(statuses['TimeRemaining']))
+            self.renderedVersion = statuses['Version']
 
 
 if __name__ == '__main__':
@@ -609,6 +808,6 @@ if __name__ == '__main__':
     mw.ResetStats()
     mw.show()
     
-    ProgressTimer = ProgressUpdateTimer(mw)
+    ProgressListener = ProgressUpdateListener(mw)
     myApp.exec_()
     sys.exit()
@@ -0,0 +1,92 @@
+# #########################################################################
+# This file is part of ManageHD.
+#
+# ManageHD is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ManageHD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ManageHD.  If not, see <http://www.gnu.org/licenses/>.
+# #########################################################################
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from ManageHD import ProcessMovies, Progress
+from ManageHD_Bench import FakeHandbrake
+
+class EngineTestCase(unittest.TestCase):
+    """ Runs every test in a temporary work directory (which receives the manifest, journal and logs) with the
+        stand-in Handbrake of ManageHD_Bench, converting sparse source videos. """
+    mbPerSecond  = 500.0 # speed of the stand-in Handbrake
+    batchTimeout = 60
+
+    def setUp(self):
+        self.previousDirectory   = os.getcwd()
+        self.previousEnvironment = dict(os.environ)
+        self.workDirectory       = tempfile.mkdtemp(prefix="ManageHD-test-")
+        self.sourceDir           = os.path.join(self.workDirectory, "source")
+        self.destinationDir      = os.path.join(self.workDirectory, "converted")
+        self.archiveDir          = os.path.join(self.workDirectory, "archive")
+        for directory in (self.sourceDir, self.destinationDir, self.archiveDir):
+            os.makedirs(directory)
+        os.chdir(self.workDirectory)
+        self.handbrake = FakeHandbrake(self.workDirectory, mbPerSecond=self.mbPerSecond, jitter=0)
+        self.handbrake.Install()
+        os.environ['MANAGEHD_LOGDIR'] = os.path.join(self.workDirectory, "logs")
+        Progress.ResetStatuses()
+        Progress.listOfSourceVideos = []
+
+    def tearDown(self):
+        os.chdir(self.previousDirectory)
+        os.environ.clear()
+        os.environ.update(self.previousEnvironment)
+        shutil.rmtree(self.workDirectory, ignore_errors=True)
+
+    def MakeVideo(self, name, sizeInMB):
+        """ Creates a sparse source video, returns its path. """
+        path = os.path.join(self.sourceDir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as video:
+            video.truncate(int(sizeInMB * 1024 * 1024))
+        return path
+
+    def CliParameters(self, **changes):
+        """ The parameters of a batch converting the source directory, with changes applied. """
+        cliParameters = {'sourceDir' : self.sourceDir, \
+                         'archiveDir' : "", \
+                         'destinationDir' : self.destinationDir, \
+                         'maxNumberOfVideosToProcess' : 0, \
+                         'videoTypes' : "mkv", \
+                         'numberOfWorkers' : 1, \
+                         'segmentThresholdInMB' : 0, \
+                         'metricsPort' : "", \
+                         'metricsDirectory' : "", \
+                         'traceFile' : ""
+                        }
+        cliParameters.update(changes)
+        return cliParameters
+
+    def RunBatch(self, cliParameters):
+        """ Runs a batch to its end, as the GUI does. Returns its result. """
+        results = []
+        batch = threading.Thread(target=lambda: results.append(ProcessMovies().Start(useGUI=True,
+                                                                                     cliParameters=cliParameters)))
+        batch.daemon = True
+        batch.start()
+        batch.join(self.batchTimeout)
+        self.assertFalse(batch.is_alive(), "the batch did not finish")
+        self.assertEqual(len(results), 1, "the batch raised")
+        return results[0]
+
+    def Converted(self):
+        """ Sorted names of the videos in the destination directory. """
+        return sorted(fileName for fileName in os.listdir(self.destinationDir) if not fileName.startswith("."))
@@ -0,0 +1,129 @@
+# #########################################################################
+# This file is part of ManageHD.
+#
+# ManageHD is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ManageHD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ManageHD.  If not, see <http://www.gnu.org/licenses/>.
+# #########################################################################
+
+
+import os
+import sys
+import unittest
+from unittest import mock
+from queue import PriorityQueue
+from ManageHD import ProcessMovies, StorageAdmission, FileManip, VideoJob, Progress
+from tests.enginetest import EngineTestCase
+
+def FreeSpace(freeInMB):
+    """ Patches the free space of every drive, on top of the default margin. """
+    return mock.patch.object(FileManip, 'GetFreeSpaceInMB',
+                             lambda self, path: StorageAdmission.marginInMB + freeInMB)
+
+class StorageAdmissionTest(unittest.TestCase):
+    def setUp(self):
+        Progress.ResetStatuses()
+        self.activeQueue = PriorityQueue()
+        self.admission = StorageAdmission("/converted")
+
+    def Take(self, name, sizeInMB):
+        """ A job as a worker has it, just taken from the queue. """
+        job = VideoJob("/source/" + name, sizeInMB)
+        job.destinationPath = "/converted/" + name
+        self.activeQueue.put(((0,), job))
+        return self.activeQueue.get()
+
+    def testJobWaitsUntilSpaceIsReleased(self):
+        with FreeSpace(150):
+            first = self.Take("first.mkv", 400)[1]
+            self.assertEqual(self.admission.Admit(first, self.activeQueue, (0,)), 'admitted')
+            priority, second = self.Take("second.mkv", 400)
+            self.assertEqual(self.admission.Admit(second, self.activeQueue, priority), 'held')
+            self.assertEqual(Progress.statuses['VideosHeld'], 1)
+            self.assertTrue(self.activeQueue.empty())
+            # a smaller one still fits next to the first
+            small = self.Take("small.mkv", 40)[1]
+            self.assertEqual(self.admission.Admit(small, self.activeQueue, (0,)), 'admitted')
+
+            self.admission.ReleaseOutput(first)
+            self.assertEqual(Progress.statuses['VideosHeld'], 0)
+            self.assertIs(self.activeQueue.get_nowait()[1], second)
+
+    def testJobThatCanNeverFitIsRefused(self):
+        with FreeSpace(50):
+            job = self.Take("huge.mkv", 400)[1]
+            self.assertEqual(self.admission.Admit(job, self.activeQueue, (0,)), 'refused')
+
+    def testMargin(self):
+        with FreeSpace(0):
+            job = self.Take("video.mkv", 400)[1]
+            admission = StorageAdmission("/converted", marginInMB=StorageAdmission.marginInMB - 100)
+            self.assertEqual(admission.Admit(job, self.activeQueue, (0,)), 'admitted')
+
+    def testCancelLetsHeldJobsGo(self):
+        with FreeSpace(150):
+            self.admission.Admit(self.Take("first.mkv", 400)[1], self.activeQueue, (0,))
+            priority, held = self.Take("held.mkv", 400)
+            self.admission.Admit(held, self.activeQueue, priority)
+            self.admission.Cancel()
+            self.assertEqual(held.state, "cancelled")
+            self.assertTrue(held.finished.is_set())
+            self.assertEqual(self.activeQueue.unfinished_tasks, 1) # only the admitted job is left to finish
+            self.assertEqual(self.admission.Admit(self.Take("late.mkv", 4)[1], self.activeQueue, (0,)), 'cancelled')
+
+class AdmissionBatchTest(EngineTestCase):
+    def setUp(self):
+        EngineTestCase.setUp(self)
+        # outputs as large as the default estimate, what the history learns from the first videos changes nothing
+        os.environ['MANAGEHD_FAKEHB_OUTPUTRATIO'] = str(StorageAdmission.defaultOutputRatio)
+
+    def RunWithFreeSpace(self, freeInMB, **changes):
+        held = []
+        def OnEngineEvent(event, subject):
+            if event == 'statisticsChanged':
+                held.append(subject['VideosHeld'])
+        Progress.Subscribe(OnEngineEvent)
+        try:
+            with FreeSpace(freeInMB):
+                self.RunBatch(self.CliParameters(numberOfWorkers=2, **changes))
+        finally:
+            Progress.Unsubscribe(OnEngineEvent)
+        return max(held)
+
+    def testBatchHoldsAndRefuses(self):
+        self.MakeVideo("huge.mkv", 200) # needs 50 MB, never fits
+        self.MakeVideo("first.mkv", 80)  # 20 MB each, only one at a time
+        self.MakeVideo("second.mkv", 80)
+        self.MakeVideo("small.mkv", 4)
+        self.assertGreaterEqual(self.RunWithFreeSpace(30), 1)
+        self.assertEqual(Progress.statuses['VideosRefused'], 1)
+        self.assertEqual(Progress.statuses['VideosFailed'], 0)
+        self.assertEqual(Progress.statuses['VideosHeld'], 0)
+        self.assertEqual(self.Converted(), ["first.mkv", "second.mkv", "small.mkv"])
+
+    def testAdmissionOff(self):
+        self.MakeVideo("huge.mkv", 200)
+        self.assertEqual(self.RunWithFreeSpace(0, admissionMarginInGB="off"), 0)
+        self.assertEqual(Progress.statuses['VideosRefused'], 0)
+        self.assertEqual(self.Converted(), ["huge.mkv"])
+
+    def testMarginFromTheCommandLine(self):
+        self.MakeVideo("video.mkv", 40) # needs 10 MB, 24 MB are free
+        self.RunWithFreeSpace(24 - StorageAdmission.marginInMB, admissionMarginInGB="0")
+        self.assertEqual(Progress.statuses['VideosRefused'], 0)
+        self.assertEqual(self.Converted(), ["video.mkv"])
+
+        with mock.patch.object(sys, 'argv', ["ManageHD.py", "s=" + self.sourceDir, "d=" + self.destinationDir, "x=off"]):
+            self.assertEqual(ProcessMovies().ParseCommandLine()['admissionMarginInGB'], "off")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# #########################################################################
+# This file is part of ManageHD.
+#
+# ManageHD is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ManageHD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ManageHD.  If not, see <http://www.gnu.org/licenses/>.
+# #########################################################################
+
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+import unittest
+import ManageHD_Bench
+from ManageHD_Bench import Benchmark, FakeHandbrake
+
+class BenchmarkTest(unittest.TestCase):
+    def setUp(self):
+        self.workDirectory = tempfile.mkdtemp(prefix="ManageHD-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.workDirectory, ignore_errors=True)
+
+    def Batch(self, **changes):
+        batch = {'policy' : 'lpt', 'workers' : 2, 'videos' : 4, 'failed' : 0, 'archived' : 4,
+                 'makespanSeconds' : 2.0, 'idealMakespanSeconds' : 1.8, 'efficiency' : 0.9, 'utilization' : 0.9,
+                 'etaError' : None, 'archiveSeconds' : 0.1}
+        batch.update(changes)
+        return batch
+
+    def testCheckFlagsABrokenBatch(self):
+        bench = Benchmark(self.workDirectory, FakeHandbrake(self.workDirectory, jitter=0.1), batchSize=4)
+        results = {'scan' : {'files' : 10, 'found' : 10}, 'batches' : [self.Batch()]}
+        self.assertEqual(bench.Check(results), [])
+        results = {'scan' : {'files' : 10, 'found' : 9},
+                   'batches' : [self.Batch(failed=1), self.Batch(archived=3), self.Batch(efficiency=1.5)]}
+        self.assertEqual(len(bench.Check(results)), 4)
+
+    def testSmallRun(self):
+        reportFile = os.path.join(self.workDirectory, "results.json")
+        environment = dict(os.environ)
+        environment['MANAGEHD_LOGDIR'] = os.path.join(self.workDirectory, "logs")
+        bench = subprocess.run([sys.executable, os.path.abspath(ManageHD_Bench.__file__), "l=50", "b=6", "n=2",
+                                "x=4000", "o=fifo,lpt", "w=" + os.path.join(self.workDirectory, "bench"),
+                                "f=" + reportFile],
+                               cwd=self.workDirectory, env=environment, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, timeout=120)
+        self.assertEqual(bench.returncode, 0, bench.stdout.decode('utf-8', 'replace'))
+        with open(reportFile) as jsonFile:
+            results = json.load(jsonFile)
+        self.assertEqual(results['problems'], [])
+        self.assertEqual(results['scan']['found'], 50)
+        self.assertEqual([batch['policy'] for batch in results['batches']], ['fifo', 'lpt'])
+        for batch in results['batches']:
+            self.assertEqual(batch['videos'], 6)
+            self.assertEqual(batch['archived'], 6)
+            self.assertGreaterEqual(batch['makespanSeconds'], batch['idealMakespanSeconds'] * 0.9)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# #########################################################################
+# This file is part of ManageHD.
+#
+# ManageHD is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ManageHD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ManageHD.  If not, see <http://www.gnu.org/licenses/>.
+# #########################################################################
+
+
+import os
+import sys
+import signal
+import subprocess
+import threading
+import unittest
+from time import sleep, time
+import ManageHD_Cluster
+from ManageHD import Progress
+from ManageHD_Cluster import Coordinator, ClusterWorker
+from tests.enginetest import EngineTestCase
+
+class ClusterTest(EngineTestCase):
+    mbPerSecond = 20.0 # two seconds per video, long enough to kill a worker mid-job
+
+    def setUp(self):
+        EngineTestCase.setUp(self)
+        self.patched = [(Coordinator, 'leaseSeconds', 3), (Coordinator, 'waitSeconds', 0.2),
+                        (ClusterWorker, 'progressSeconds', 0.5), (ClusterWorker, 'pollSeconds', 0.2)]
+        self.original = [getattr(cls, name) for cls, name, value in self.patched]
+        for cls, name, value in self.patched:
+            setattr(cls, name, value)
+
+    def tearDown(self):
+        for (cls, name, value), original in zip(self.patched, self.original):
+            setattr(cls, name, original)
+        EngineTestCase.tearDown(self)
+
+    def WaitFor(self, condition, timeout=20):
+        deadline = time() + timeout
+        while not condition():
+            self.assertLess(time(), deadline, "timed out")
+            sleep(0.05)
+
+    def StartWorkerProcess(self, port):
+        """ A worker in a session of its own, so it can be killed together with its Handbrake, like a machine
+            going down. """
+        return subprocess.Popen([sys.executable, os.path.abspath(ManageHD_Cluster.__file__), "worker",
+                                 "127.0.0.1:" + str(port), "1"],
+                                cwd=self.workDirectory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                start_new_session=True)
+
+    def testKilledWorkersJobIsRequeuedOnceItsLeaseExpires(self):
+        names = ["a.mkv", "b.mkv", "c.mkv", "d.mkv"]
+        for name in names:
+            self.MakeVideo(name, 40)
+        coordinator = Coordinator(self.CliParameters(numberOfWorkers=0), port=0)
+        results = []
+        batch = threading.Thread(target=lambda: results.append(coordinator.Run()))
+        batch.daemon = True
+        batch.start()
+        self.WaitFor(lambda: coordinator.server != None)
+        host, port = coordinator.server.server_address
+        self.assertEqual(host, "127.0.0.1")
+
+        doomed = self.StartWorkerProcess(port)
+        try:
+            self.WaitFor(lambda: len(coordinator.leased) == 1)
+            jobId = list(coordinator.leased)[0]
+            sleep(0.5)
+        finally:
+            os.killpg(doomed.pid, signal.SIGKILL)
+            doomed.wait()
+
+        # the worker is gone, its job stays leased until the lease expires and is then queued again
+        with coordinator.condition:
+            self.assertIn(jobId, coordinator.leased)
+        self.WaitFor(lambda: jobId in [pendingId for priority, pendingId in coordinator.pending])
+        self.assertEqual(Progress.statuses['VideosCurrent'], 0)
+
+        workers = [threading.Thread(target=ClusterWorker("127.0.0.1", port, 1).Run) for index in range(2)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        batch.join(self.batchTimeout)
+        self.assertFalse(batch.is_alive(), "the batch did not finish")
+        for worker in workers:
+            worker.join(10)
+            self.assertFalse(worker.is_alive())
+
+        self.assertEqual(results, [0])
+        self.assertEqual(Progress.statuses['VideosCompleted'], 4)
+        self.assertEqual(Progress.statuses['VideosFailed'], 0)
+        self.assertEqual(Progress.statuses['VideosCurrent'], 0)
+        self.assertEqual(sorted(os.listdir(self.destinationDir)), names) # no partial files left over
+        for name in names:
+            self.assertEqual(os.path.getsize(os.path.join(self.destinationDir, name)),
+                             int(40 * self.handbrake.outputRatio * 1024 * 1024))
+
+if __name__ == '__main__':
+    unittest.main()
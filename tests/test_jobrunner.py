@@ -0,0 +1,94 @@
+# #########################################################################
+# This file is part of ManageHD.
+#
+# ManageHD is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ManageHD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ManageHD.  If not, see <http://www.gnu.org/licenses/>.
+# #########################################################################
+
+
+import sys
+import threading
+import unittest
+from queue import PriorityQueue
+from time import time
+from ManageHD import JobRunner, Threads, VideoJob, Progress
+from tests.enginetest import EngineTestCase
+
+sleeper = [sys.executable, "-c", "import time; time.sleep(30)"]
+
+class JobRunnerTest(unittest.TestCase):
+    def testTimeoutStopsTheCommand(self):
+        runner = JobRunner(sleeper, timeout=0.5)
+        started = time()
+        self.assertNotEqual(runner.Run(), 0)
+        self.assertLess(time() - started, 10)
+        self.assertTrue(runner.timedOut)
+        self.assertTrue(runner.cancelled)
+
+    def testCancelFromAnotherThread(self):
+        runner = JobRunner(sleeper)
+        threading.Timer(0.5, runner.Cancel).start()
+        started = time()
+        self.assertNotEqual(runner.Run(), 0)
+        self.assertLess(time() - started, 10)
+        self.assertTrue(runner.cancelled)
+        self.assertFalse(runner.timedOut)
+
+    def testCancelBeforeRunNeverStartsTheCommand(self):
+        runner = JobRunner(sleeper)
+        runner.Cancel()
+        self.assertEqual(runner.Run(), None)
+        self.assertEqual(runner.process, None)
+
+    def testMissingCommand(self):
+        self.assertEqual(JobRunner(["/nonexistent/HandBrakeCLI"]).Run(), -1)
+
+    def testOutputLinesEndAtCarriageReturns(self):
+        lines = []
+        runner = JobRunner([sys.executable, "-c", "import sys; sys.stdout.write('one\\rtwo\\nthree')"])
+        self.assertEqual(runner.Run(onOutputLine=lines.append), 0)
+        self.assertEqual(lines, ["one", "two", "three"])
+
+class CancelAllTest(unittest.TestCase):
+    def testWaitingJobsBehindRetireTokensAreCancelled(self):
+        threads = Threads()
+        threads.activeQueue = PriorityQueue()
+        jobs = [VideoJob("video-" + str(index) + ".mkv", 10) for index in range(3)]
+        threads.activeQueue.put(((float('-inf'), 0), None))
+        for index, job in enumerate(jobs):
+            threads.activeQueue.put(((index,), job))
+        threads.activeQueue.put(((float('-inf'), 1), None))
+
+        threads.CancelAll()
+        for job in jobs:
+            self.assertEqual(job.state, "cancelled")
+            self.assertTrue(job.finished.is_set())
+        self.assertEqual(threads.activeQueue.qsize(), 2)
+        self.assertEqual(threads.activeQueue.unfinished_tasks, 2)
+        self.assertEqual(threads.activeQueue.get()[1], None)
+
+class JobTimeoutTest(EngineTestCase):
+    mbPerSecond = 10.0
+
+    def testSlowVideoFailsAndTheBatchGoesOn(self):
+        self.MakeVideo("slow.mkv", 30)
+        self.MakeVideo("quick.mkv", 2)
+        self.RunBatch(self.CliParameters(jobTimeoutInMinutes=0.02))
+        # VideosCompleted counts every video that is through, failed ones included
+        self.assertEqual(Progress.statuses['VideosCompleted'], 2)
+        self.assertEqual(Progress.statuses['VideosFailed'], 1)
+        self.assertEqual(Progress.statuses['VideosCurrent'], 0)
+        self.assertEqual(self.Converted(), ["quick.mkv"])
+
+if __name__ == '__main__':
+    unittest.main()
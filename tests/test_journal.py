@@ -0,0 +1,78 @@
+# #########################################################################
+# This file is part of ManageHD.
+#
+# ManageHD is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ManageHD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ManageHD.  If not, see <http://www.gnu.org/licenses/>.
+# #########################################################################
+
+
+import os
+import unittest
+from ManageHD import JobJournal, ProcessMovies, Progress, VideoJob, Handbrake
+from tests.enginetest import EngineTestCase
+
+class JobJournalTest(EngineTestCase):
+    def Job(self, name):
+        sourcePath = os.path.join(self.sourceDir, name)
+        job = VideoJob(sourcePath, os.path.getsize(sourcePath) / 1024 / 1024, os.stat(sourcePath).st_mtime)
+        job.destinationPath = os.path.join(self.destinationDir, name)
+        return job
+
+    def testReplayIgnoresATornLastLine(self):
+        self.MakeVideo("a.mkv", 2)
+        journal = JobJournal()
+        journal.Begin(self.CliParameters())
+        journal.RecordJob('running', self.Job("a.mkv"))
+        journal.Close()
+        with open(JobJournal.fileName, "a") as journalFile:
+            journalFile.write('{"event": "done", "sourcePa')
+
+        batch, jobs, finished = JobJournal().Replay()
+        self.assertEqual(batch['cliParameters']['sourceDir'], self.sourceDir)
+        self.assertEqual(jobs[os.path.join(self.sourceDir, "a.mkv")]['event'], 'running')
+        self.assertFalse(finished)
+
+    def testFinishedBatchIsNotResumed(self):
+        self.MakeVideo("a.mkv", 2)
+        self.RunBatch(self.CliParameters())
+        self.assertTrue(JobJournal().Replay()[2])
+        self.assertEqual(ProcessMovies().Resume(), 1)
+
+    def testResumeConvertsWhatIsLeft(self):
+        for name in ("a.mkv", "b.mkv", "c.mkv"):
+            self.MakeVideo(name, 2)
+        cliParameters = self.CliParameters(archiveDir=self.archiveDir)
+        journal = JobJournal()
+        journal.Begin(cliParameters)
+        interrupted = self.Job("a.mkv")
+        journal.RecordJob('running', interrupted)
+        partialPath = Handbrake().GetTemporaryPath(interrupted.destinationPath)
+        with open(partialPath, "wb") as partialFile:
+            partialFile.write(b"half an encode")
+        done = self.Job("b.mkv")
+        with open(done.destinationPath, "wb") as convertedFile:
+            convertedFile.truncate(1024)
+        journal.RecordJob('done', done)
+        journal.Close()
+
+        self.assertEqual(ProcessMovies().Resume(), 0)
+        # a was interrupted, c was never reached, b only had to be archived
+        self.assertEqual(Progress.statuses['VideosCompleted'], 2)
+        self.assertEqual(self.Converted(), ["a.mkv", "b.mkv", "c.mkv"])
+        self.assertFalse(os.path.exists(partialPath))
+        self.assertEqual(os.path.getsize(done.destinationPath), 1024)
+        self.assertEqual(sorted(os.listdir(self.archiveDir)), ["a.mkv", "b.mkv", "c.mkv"])
+        self.assertTrue(JobJournal().Replay()[2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# #########################################################################
+# This file is part of ManageHD.
+#
+# ManageHD is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ManageHD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ManageHD.  If not, see <http://www.gnu.org/licenses/>.
+# #########################################################################
+
+
+import os
+import unittest
+from ManageHD import ConversionManifest, Progress
+from tests.enginetest import EngineTestCase
+
+class ConversionManifestTest(EngineTestCase):
+    def testConvertedVideosAreSkippedOnTheNextBatch(self):
+        for name in ("a.mkv", "b.mkv", "c.mkv"):
+            self.MakeVideo(name, 5)
+        self.assertEqual(self.RunBatch(self.CliParameters()), 0)
+        self.assertEqual(Progress.statuses['VideosCompleted'], 3)
+
+        for name in self.Converted():
+            os.remove(os.path.join(self.destinationDir, name))
+        Progress.ResetStatuses()
+        self.assertEqual(self.RunBatch(self.CliParameters()), 1)
+        self.assertEqual(Progress.statuses['VideosSkipped'], 3)
+        self.assertEqual(Progress.statuses['VideosCompleted'], 0)
+        self.assertEqual(Progress.statuses['BatchStatus'], 'Nothing New To Convert')
+        self.assertEqual(self.Converted(), [])
+
+    def testChangedSourceIsConvertedAgain(self):
+        for name in ("a.mkv", "b.mkv"):
+            self.MakeVideo(name, 5)
+        self.RunBatch(self.CliParameters())
+        changed = self.MakeVideo("b.mkv", 6)
+        os.utime(changed, (os.stat(changed).st_atime, os.stat(changed).st_mtime + 10))
+
+        Progress.ResetStatuses()
+        self.RunBatch(self.CliParameters())
+        self.assertEqual(Progress.statuses['VideosSkipped'], 1)
+        self.assertEqual(Progress.statuses['VideosCompleted'], 1)
+
+    def testManifestSurvivesReopening(self):
+        self.MakeVideo("a.mkv", 5)
+        self.RunBatch(self.CliParameters())
+        manifest = ConversionManifest()
+        try:
+            self.assertEqual(manifest.LoadEntries(), 1)
+        finally:
+            manifest.Close()
+
+if __name__ == '__main__':
+    unittest.main()
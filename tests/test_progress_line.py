@@ -0,0 +1,58 @@
+# #########################################################################
+# This file is part of ManageHD.
+#
+# ManageHD is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ManageHD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ManageHD.  If not, see <http://www.gnu.org/licenses/>.
+# #########################################################################
+
+
+import unittest
+from time import time
+from ManageHD import Handbrake, Threads, VideoJob, Progress
+
+class ParseProgressLineTest(unittest.TestCase):
+    def testFullLine(self):
+        self.assertEqual(Handbrake.ParseProgressLine(
+                         "Encoding: task 1 of 1, 45.67 % (87.53 fps, avg 90.12 fps, ETA 01h12m34s)"),
+                         (45.67, 87.53, 90.12, 3600 + 12 * 60 + 34))
+
+    def testBeforeHandbrakeHasMeasuredTheSpeed(self):
+        self.assertEqual(Handbrake.ParseProgressLine("Encoding: task 1 of 1, 0.12 %"), (0.12, None, None, None))
+
+    def testLaterTaskOfATwoPassEncode(self):
+        self.assertEqual(Handbrake.ParseProgressLine("Encoding: task 2 of 2, 50.00 %")[0], 75.0)
+
+    def testOtherLines(self):
+        for line in ("", "HandBrake has exited.", "[12:01:02] libhb: work result = 0", "Encode done!"):
+            self.assertEqual(Handbrake.ParseProgressLine(line), None)
+
+class LiveProgressTest(unittest.TestCase):
+    def setUp(self):
+        Progress.ResetStatuses()
+
+    def testLiveSpeedLeavesTheMeasuredSpeedAlone(self):
+        Progress.statuses['ProcessingSpeedInGBperHour'] = 12.5
+        threads = Threads()
+        job = VideoJob("video.mkv", 1000)
+        job.startTime = time() - 10
+        threads.runningJobs.add(job)
+        threads.UpdateLiveProgress(job, Handbrake.ParseProgressLine("Encoding: task 1 of 1, 25.00 % (50.00 fps, "
+                                                                    "avg 50.00 fps, ETA 00h00m30s)"))
+        self.assertEqual(job.percent, 25.0)
+        self.assertEqual(job.eta, 30)
+        self.assertEqual(Progress.statuses['InProgressMB'], 250.0)
+        self.assertAlmostEqual(Progress.statuses['LiveSpeedInMBperSecond'], 25.0, places=0)
+        self.assertEqual(Progress.statuses['ProcessingSpeedInGBperHour'], 12.5)
+
+if __name__ == '__main__':
+    unittest.main()
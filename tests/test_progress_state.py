@@ -0,0 +1,78 @@
+# #########################################################################
+# This file is part of ManageHD.
+#
+# ManageHD is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ManageHD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ManageHD.  If not, see <http://www.gnu.org/licenses/>.
+# #########################################################################
+
+
+import threading
+import unittest
+from ManageHD import ProgressState
+
+class ProgressStateTest(unittest.TestCase):
+    def setUp(self):
+        self.state = ProgressState({'VideosCompleted' : 0, 'VideoNames' : "", 'EtaPrediction' : {}})
+
+    def testSnapshotIsNotChangedByLaterUpdates(self):
+        before = self.state.Snapshot()
+        self.state['VideoNames'] = "a.mkv"
+        self.state.Increment('VideosCompleted')
+        self.assertEqual(before['VideoNames'], "")
+        self.assertEqual(before['VideosCompleted'], 0)
+        self.assertEqual(self.state['VideosCompleted'], 1)
+        self.assertEqual(self.state.Snapshot()['Version'], before['Version'] + 2)
+
+    def testSnapshotIsReadOnly(self):
+        self.state['EtaPrediction'] = {'seconds' : 60}
+        snapshot = self.state.Snapshot()
+        with self.assertRaises(TypeError):
+            snapshot['VideosCompleted'] = 5
+        with self.assertRaises(TypeError):
+            snapshot['EtaPrediction']['seconds'] = 5
+
+    def testUnchangedValuesDoNotBumpTheVersion(self):
+        version = self.state.Update({'VideoNames' : ""}, {'VideosCompleted' : 0})
+        self.assertEqual(version, 0)
+        self.assertEqual(self.state.Update({'VideoNames' : "b.mkv"}), 1)
+
+    def testConcurrentIncrementsAreNotLost(self):
+        def Work():
+            for count in range(1000):
+                self.state.Increment('VideosCompleted')
+        workers = [threading.Thread(target=Work) for index in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.state['VideosCompleted'], 8000)
+        self.assertEqual(self.state.Snapshot()['Version'], 8000)
+
+    def testListenersGetTheNewSnapshot(self):
+        events = []
+        def Listener(event, subject):
+            events.append((event, subject['VideosCompleted']))
+        self.state.Subscribe(Listener)
+        self.state.Increment('VideosCompleted', 3)
+        self.state.Unsubscribe(Listener)
+        self.state.Increment('VideosCompleted')
+        self.assertEqual(events, [('statisticsChanged', 3)])
+
+    def testWaitForChange(self):
+        version = self.state.Snapshot()['Version']
+        threading.Timer(0.1, self.state.Increment, ('VideosCompleted',)).start()
+        self.assertEqual(self.state.WaitForChange(version, timeout=10)['VideosCompleted'], 1)
+        self.assertEqual(self.state.WaitForChange(version + 1, timeout=0.1)['Version'], version + 1)
+
+if __name__ == '__main__':
+    unittest.main()
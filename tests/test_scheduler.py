@@ -0,0 +1,56 @@
+# #########################################################################
+# This file is part of ManageHD.
+#
+# ManageHD is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ManageHD is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ManageHD.  If not, see <http://www.gnu.org/licenses/>.
+# #########################################################################
+
+
+import unittest
+from queue import PriorityQueue
+from ManageHD import JobScheduler, VideoJob
+
+class JobSchedulerTest(unittest.TestCase):
+    def Dispatch(self, policy, sizes):
+        """ Sizes of the jobs in the order the workers take them from the queue. """
+        scheduler = JobScheduler(policy)
+        activeQueue = PriorityQueue()
+        for index, size in enumerate(sizes):
+            job = VideoJob("video-" + str(index) + ".mkv", size)
+            activeQueue.put((scheduler.Priority(job), job))
+        return [activeQueue.get()[1].sizeInMB for index in range(len(sizes))]
+
+    def testLptDispatchesLargestFirst(self):
+        self.assertEqual(self.Dispatch('lpt', [300, 4000, 50, 4000, 1200]), [4000, 4000, 1200, 300, 50])
+
+    def testFifoKeepsScanOrder(self):
+        self.assertEqual(self.Dispatch('fifo', [300, 4000, 50, 4000, 1200]), [300, 4000, 50, 4000, 1200])
+
+    def testLptAvoidsTheLongTail(self):
+        sizes = [1, 1, 1, 1, 4]
+        self.assertEqual(JobScheduler.PredictMakespan(sizes, 2, 'fifo'), 6)
+        self.assertEqual(JobScheduler.PredictMakespan(sizes, 2, 'lpt'), 4)
+        self.assertEqual(JobScheduler.MakespanLowerBound(sizes, 2), 4)
+
+    def testLptStaysCloseToTheLowerBound(self):
+        sizes = [4870, 310, 1520, 990, 2200, 75, 3300, 640, 1800, 130, 2650, 410]
+        for numWorkers in (1, 2, 3, 4, 8):
+            predictions = JobScheduler.ComparePolicies(sizes, numWorkers)
+            self.assertLessEqual(predictions['lpt'], predictions['lowerBound'] * 4 / 3)
+            self.assertGreaterEqual(predictions['lpt'], predictions['lowerBound'])
+
+    def testUnknownPolicy(self):
+        self.assertRaises(ValueError, JobScheduler, 'random')
+
+if __name__ == '__main__':
+    unittest.main()